@@ -13,6 +13,7 @@ from .models import (
     Patient, Doctor, Service, Appointment, Payment, TreatmentRoom,
     TreatmentRegistration, CashRegister, Outcome, LabRegistration, Visit
 )
+from .billing import schedule_balance_refresh
 
 from django.contrib import messages
 from django.shortcuts import redirect, get_object_or_404
@@ -83,6 +84,7 @@ class PatientAdmin(admin.ModelAdmin):
 
             # reassign any remaining CashRegister rows (room/treatment/other) to placeholder
             reassigned = CashRegister.objects.filter(patient_id__in=pks).update(patient=dummy)
+            schedule_balance_refresh(dummy.pk)
 
             # finally delete the patients themselves
             deleted = Patient.objects.filter(pk__in=pks).delete()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps'
+
+    def ready(self):
+        import apps.signals  # noqa: F401  (PatientBalance ledger receivers)
+        import apps.metrics  # noqa: F401  (Celery task timing receivers)
@@ -0,0 +1,224 @@
+# apps/archive.py
+"""
+Monthly patient archive: export patients registered over a year ago together
+with their appointments, stays, payments, lab work and results, email the
+file, then delete them.
+
+Patients are read in keyset pages of ``batch_size`` and their related rows
+per page, and everything is streamed into openpyxl's write-only workbook, so
+memory stays flat however many patients are archived. Deletes run in batches
+of the same size, each in its own transaction. Progress is checkpointed on a
+PatientArchive row: a run interrupted while deleting resumes after its last
+committed batch; one interrupted while exporting writes the file again.
+
+Patients with CashRegister rows (PROTECT: the cash book is kept) or an open
+stay are left alone.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from openpyxl import Workbook
+
+from apps.models import (
+    Appointment,
+    CashRegister,
+    LabRegistration,
+    Patient,
+    PatientArchive,
+    PatientResult,
+    TreatmentPayment,
+    TreatmentRegistration,
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = 365
+BATCH_SIZE = 500
+# bigger files are left on the server and only their path is emailed
+MAX_ATTACHMENT_BYTES = 20 * 1024 * 1024
+
+SHEETS = {
+    "Patients": ["ID", "First Name", "Last Name", "Age", "Phone", "Address", "Doctor", "Created At"],
+    "Appointments": ["ID", "Patient ID", "Doctor", "Referred By", "Status", "Turn", "Services", "Reason",
+                     "Amount Due", "Amount Paid", "Payment Status", "Created At"],
+    "Stays": ["ID", "Patient ID", "Room", "Appointment ID", "Assigned At", "Discharged At", "Total Paid"],
+    "Payments": ["ID", "Patient ID", "Amount", "Status", "Method", "Notes", "Date"],
+    "Lab": ["ID", "Patient ID", "Service", "Stay ID", "Status", "Notes", "Repeat Count", "Created At"],
+    "Results": ["ID", "Patient ID", "Title", "Description", "File", "Uploaded At"],
+}
+
+
+def eligible(cutoff):
+    """Patients registered before ``cutoff`` that may be archived and deleted."""
+    return (
+        Patient.objects.filter(created_at__lte=cutoff)
+        .exclude(pk__in=CashRegister.objects.values("patient_id"))
+        .exclude(pk__in=TreatmentRegistration.objects.filter(discharged_at__isnull=True).values("patient_id"))
+    )
+
+
+def _naive(value):
+    # Excel has no time zones: write clinic-local wall time
+    return timezone.localtime(value).replace(tzinfo=None) if value else None
+
+
+def _pages(queryset, batch_size):
+    last_pk = 0
+    while True:
+        page = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not page:
+            return
+        last_pk = page[-1].pk
+        yield page
+
+
+def _related_rows(ids):
+    """(sheet, row) for every archived row that belongs to the patients ``ids``."""
+    appointments = (
+        Appointment.objects.filter(patient_id__in=ids)
+        .select_related("doctor", "referred_by", "payment")
+        .prefetch_related("services").order_by("id")
+    )
+    for a in appointments.iterator(chunk_size=BATCH_SIZE):
+        payment = getattr(a, "payment", None)
+        yield "Appointments", [
+            a.id, a.patient_id, a.doctor.name, a.referred_by.name if a.referred_by else None,
+            a.status, a.turn_number, ", ".join(s.name for s in a.services.all()), a.reason,
+            payment and payment.amount_due, payment and payment.amount_paid, payment and payment.status,
+            _naive(a.created_at),
+        ]
+    stays = TreatmentRegistration.objects.filter(patient_id__in=ids).select_related("room").order_by("id")
+    for r in stays.iterator(chunk_size=BATCH_SIZE):
+        yield "Stays", [
+            r.id, r.patient_id, r.room.name if r.room else None, r.appointment_id,
+            _naive(r.assigned_at), _naive(r.discharged_at), r.total_paid,
+        ]
+    payments = TreatmentPayment.objects.filter(patient_id__in=ids).order_by("id")
+    for p in payments.iterator(chunk_size=BATCH_SIZE):
+        yield "Payments", [p.id, p.patient_id, p.amount, p.status, p.payment_method, p.notes, _naive(p.date)]
+    labs = LabRegistration.objects.filter(patient_id__in=ids).select_related("service").order_by("id")
+    for lab in labs.iterator(chunk_size=BATCH_SIZE):
+        yield "Lab", [
+            lab.id, lab.patient_id, lab.service.name, lab.visit_id, lab.status, lab.notes,
+            lab.repeat_count, _naive(lab.created_at),
+        ]
+    results = PatientResult.objects.filter(patient_id__in=ids).order_by("id")
+    for res in results.iterator(chunk_size=BATCH_SIZE):
+        yield "Results", [
+            res.id, res.patient_id, res.title, res.description, res.result_file.name or None,
+            _naive(res.uploaded_at),
+        ]
+
+
+def export(archive, batch_size=BATCH_SIZE):
+    """Write ``archive``'s patients and their history to a new xlsx file."""
+    patients = eligible(archive.cutoff)
+    archive.max_patient_id = patients.aggregate(top=Max("pk"))["top"] or 0
+    patients = patients.filter(pk__lte=archive.max_patient_id).select_related("patients_doctor")
+
+    os.makedirs(settings.PATIENT_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(
+        settings.PATIENT_ARCHIVE_DIR,
+        f"patients_archive_{timezone.localdate():%Y-%m}_{archive.pk}.xlsx",
+    )
+    book = Workbook(write_only=True)
+    sheets = {}
+    for title, header in SHEETS.items():
+        sheets[title] = book.create_sheet(title)
+        sheets[title].append(header)
+
+    exported = 0
+    for page in _pages(patients, batch_size):
+        for p in page:
+            sheets["Patients"].append([
+                p.id, p.first_name, p.last_name, p.age, p.phone, p.address,
+                p.patients_doctor.name if p.patients_doctor else None, _naive(p.created_at),
+            ])
+        for title, row in _related_rows([p.pk for p in page]):
+            sheets[title].append(row)
+        exported += len(page)
+    book.save(path)
+
+    archive.file_path = path
+    archive.exported = exported
+    archive.status = "exported"
+    archive.save(update_fields=["file_path", "exported", "max_patient_id", "status"])
+    logger.info("Patient archive #%s: %s patient(s) exported to %s", archive.pk, exported, path)
+
+
+def send(archive):
+    size = os.path.getsize(archive.file_path)
+    body = f"Archive of {archive.exported} patient(s) registered before {_naive(archive.cutoff):%Y-%m-%d}."
+    email = EmailMessage(
+        subject="📁 Monthly Patient Archive",
+        from_email=settings.EMAIL_HOST_USER,
+        to=settings.PATIENT_ARCHIVE_RECIPIENTS,
+    )
+    if size <= MAX_ATTACHMENT_BYTES:
+        email.attach_file(archive.file_path)
+    else:
+        body += f"\nThe file is too large to attach ({size // (1024 * 1024)} MB); it is on the server at {archive.file_path}."
+    email.body = body
+    email.send()
+
+
+def _deletable(archive):
+    patients = eligible(archive.cutoff).filter(pk__lte=archive.max_patient_id)
+    # anyone with activity since the run began may be missing from the file:
+    # keep them for the next run
+    since = archive.created_at
+    return (
+        patients.exclude(appointment__created_at__gte=since)
+        .exclude(treatmentregistration__assigned_at__gte=since)
+        .exclude(treatmentregistration__discharged_at__gte=since)
+        .exclude(treatmentpayment__date__gte=since)
+        .exclude(labregistration__created_at__gte=since)
+    )
+
+
+def delete(archive, batch_size=BATCH_SIZE):
+    """Delete the archived patients ``batch_size`` at a time, checkpointing each batch."""
+    pending = _deletable(archive).order_by("pk").values_list("pk", flat=True)
+    while True:
+        ids = list(pending.filter(pk__gt=archive.last_deleted_id)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            Patient.objects.filter(pk__in=ids).delete()
+            archive.last_deleted_id = ids[-1]
+            archive.deleted += len(ids)
+            archive.save(update_fields=["last_deleted_id", "deleted"])
+    archive.status = "done"
+    archive.finished_at = timezone.now()
+    archive.save(update_fields=["status", "finished_at"])
+    logger.info("Patient archive #%s: %s patient(s) deleted", archive.pk, archive.deleted)
+
+
+def run(days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, email=True):
+    """
+    Resume the unfinished archive run, or start one for patients older than
+    ``days``. Returns the PatientArchive, or None when nobody is due.
+    """
+    archive = PatientArchive.objects.exclude(status="done").order_by("-pk").first()
+    if archive is None:
+        cutoff = timezone.now() - timedelta(days=days)
+        if not eligible(cutoff).exists():
+            return None
+        archive = PatientArchive.objects.create(cutoff=cutoff)
+
+    if archive.status == "exporting":
+        export(archive, batch_size)
+    if archive.status == "exported":
+        if email:
+            send(archive)
+        archive.status = "deleting"
+        archive.save(update_fields=["status"])
+    if archive.status == "deleting":
+        delete(archive, batch_size)
+    return archive
@@ -0,0 +1,510 @@
+# apps/billing.py
+"""
+Billing math shared by the balances, unpaid and receipt views.
+
+``_BillingMath.compute_for_patient`` is the per-patient reference;
+``_BillingMath.compute_for_patients`` produces the same numbers for a whole
+patient queryset with a fixed number of queries per batch. The
+``PatientBalance`` ledger stores those numbers and is refreshed from here.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.models import (
+    Appointment,
+    CashRegister,
+    Doctor,
+    LabRegistration,
+    Patient,
+    PatientBalance,
+    Service,
+    TreatmentPayment,
+    TreatmentRegistration,
+    TreatmentRoom,
+)
+
+logger = logging.getLogger(__name__)
+
+UZT = ZoneInfo("Asia/Tashkent")
+# patients per refresh_patient_balances call when one write touches many
+REFRESH_BATCH_SIZE = 1000
+
+
+def local_day_bounds(start=None, end=None):
+    """
+    Half-open aware datetimes [lo, hi) covering local days start..end inclusive.
+    Either end may be None (open range). Filtering ``field__gte=lo, field__lt=hi``
+    keeps the column bare so its index is usable, unlike ``field__date__range``.
+    """
+    lo = datetime.combine(start, time.min, tzinfo=UZT) if start else None
+    hi = datetime.combine(end + timedelta(days=1), time.min, tzinfo=UZT) if end else None
+    return lo, hi
+
+
+def filter_local_days(qs, field, start=None, end=None):
+    """``qs`` restricted to rows whose ``field`` falls on local days start..end."""
+    lo, hi = local_day_bounds(start, end)
+    if lo:
+        qs = qs.filter(**{f"{field}__gte": lo})
+    if hi:
+        qs = qs.filter(**{f"{field}__lt": hi})
+    return qs
+
+
+def _count_9am_days(start_dt, end_dt):
+    """
+    Count “days” as 09:00→09:00 slots in Asia/Tashkent.
+
+    Rules:
+      - If start is at/after 09:00 local, you are already in Day 1.
+      - If start is before 09:00, Day 1 starts at that day’s 09:00 (only if end reaches it).
+      - Crossing a 09:00 boundary increments the day count, but EXACTLY at 09:00
+        still belongs to the previous day (boundary itself does NOT increment).
+    """
+    if not start_dt or not end_dt or end_dt <= start_dt:
+        return 0
+
+    s = timezone.localtime(start_dt, UZT)
+    e = timezone.localtime(end_dt, UZT)
+
+    # Determine the 09:00 slot that 's' belongs to: [slot_start, slot_end)
+    day_9 = s.replace(hour=9, minute=0, second=0, microsecond=0)
+    if s >= day_9:
+        slot_start = day_9                    # same day 09:00
+    else:
+        slot_start = day_9 - timedelta(days=1)  # previous day 09:00
+    slot_end = slot_start + timedelta(days=1)   # next 09:00
+
+    # If we never reach the first slot_end:
+    if e <= slot_end:
+        # Day 1 applies if we were already after today's 09:00, or
+        # we started before 09:00 and reached it.
+        return 1 if (s >= day_9 or e >= day_9) and e > s else 0
+
+    # We passed the first 09:00 boundary strictly → at least 2 days.
+    delta_after_first = e - slot_end
+    extra = delta_after_first.days
+    if delta_after_first.seconds or delta_after_first.microseconds:
+        extra += 1
+    return 1 + extra
+
+
+_CANCELLED_LAB_STATUSES = ("cancelled", "canceled", "bekor", "bekor qilingan")
+_UNCOUNTED_ROOM_PAYMENT_STATUSES = ["unpaid", "canceled", "cancelled"]
+
+
+def _doctor_display_name(doctor):
+    if not doctor:
+        return None
+    if getattr(doctor, "user", None):
+        full = (doctor.user.get_full_name() or "").strip()
+        return full or getattr(doctor, "name", None) or None
+    return getattr(doctor, "name", None) or None
+
+
+def _room_charge(stays, now):
+    """
+    Sum room charges for ``stays`` — (start, end, price_per_day) tuples ordered
+    by (assigned_at, id). Open stays (end=None) are charged up to ``now``.
+    """
+    total = 0.0
+    prev_end = None
+    for start, end, price_per_day in stays:
+        end = end or now
+        total += _stay_ticks(start, end, prev_end) * float(price_per_day or 0)
+        prev_end = end
+    return total
+
+
+def _stay_ticks(start, end, prev_end=None):
+    """09:00 ticks charged for one stay; ``prev_end`` is where the patient's previous stay ended."""
+    ticks = _count_9am_days(start, end)
+
+    # If a new reg starts the same *calendar* day the previous ended, avoid double baseline.
+    if prev_end and timezone.localtime(start, UZT).date() == timezone.localtime(prev_end, UZT).date():
+        ticks = max(ticks - 1, 0)
+    return ticks
+
+
+def accrue_room_charges(now=None):
+    """
+    Raise each open stay's ``total_paid`` (the room charge accrued so far) to
+    its 09:00 ticks x room price, by the same rules as ``_room_charge``. One
+    query reads the open stays with their previous stay's end, one
+    ``bulk_update`` writes the rows that grew; totals never go down, so
+    running it again the same day changes nothing. Returns rows updated.
+    """
+    now = now or timezone.now()
+    previous = (
+        # roomless stays are not charged, so _room_charge skips them as previous stays too
+        TreatmentRegistration.objects.filter(patient=OuterRef("patient"), room__isnull=False)
+        .filter(Q(assigned_at__lt=OuterRef("assigned_at"))
+                | Q(assigned_at=OuterRef("assigned_at"), pk__lt=OuterRef("pk")))
+        .order_by("-assigned_at", "-id")
+        .annotate(end=Coalesce("discharged_at", Value(now)))
+        .values("end")[:1]
+    )
+    stays = (
+        TreatmentRegistration.objects.filter(discharged_at__isnull=True, room__isnull=False)
+        .annotate(prev_end=Subquery(previous))
+        .select_related("room")
+        .only("id", "assigned_at", "total_paid", "room__price_per_day")
+    )
+    changed = []
+    for reg in stays:
+        expected = _stay_ticks(reg.assigned_at, now, reg.prev_end) * reg.room.price_per_day
+        if reg.total_paid < expected:
+            reg.total_paid = expected
+            changed.append(reg)
+    TreatmentRegistration.objects.bulk_update(changed, ["total_paid"], batch_size=500)
+    return len(changed)
+
+
+def _totals(doctor, consult_expected, services_expected, room_expected,
+            paid_consult, paid_service, paid_other_cash, paid_room):
+    expected_due = consult_expected + services_expected + room_expected
+    paid_total = paid_consult + paid_service + paid_other_cash + paid_room
+    return {
+        "doctor_id": doctor.pk if doctor else None,
+        "doctor_name": _doctor_display_name(doctor),
+        "consult_expected": round(consult_expected),
+        "services_expected": round(services_expected),
+        "room_expected": round(room_expected),
+        "expected_due": round(expected_due),
+        "paid_consult": round(paid_consult),
+        "paid_service": round(paid_service),
+        "paid_other_cash": round(paid_other_cash),
+        "paid_room": round(paid_room),
+        "paid_total": round(paid_total),
+        "balance": round(expected_due - paid_total),
+    }
+
+
+class _BillingMath:
+    """Compute per-patient expected & paid totals (receipt view).
+       Room (yotoqxona) uses 09:00→09:00 charging. If a new stay starts on the
+       same *calendar* day the previous stay ended, that first day is NOT double-charged.
+    """
+
+    # patients per round of set-based queries in compute_for_patients
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def compute_for_patient(p):
+        # --- find doctor for header/consultation price
+        doctor = getattr(p, "patients_doctor", None)
+        if not doctor:
+            try:
+                last_app = p.appointment_set.order_by("-created_at").first()
+            except Exception:
+                last_app = None
+            if last_app and getattr(last_app, "doctor", None):
+                doctor = last_app.doctor
+        if not doctor:
+            try:
+                for reg in p.treatmentregistration_set.all():
+                    if getattr(reg, "appointment", None) and getattr(reg.appointment, "doctor", None):
+                        doctor = reg.appointment.doctor
+                        break
+            except Exception:
+                pass
+
+        # consultation
+        consult_expected = float(doctor.consultation_price) if (doctor and doctor.consultation_price) else 0.0
+
+        # services
+        services_expected = 0.0
+        try:
+            lrs = getattr(p, "labregistration_set", None)
+            if lrs is not None and lrs.exists():
+                for lr in lrs.select_related("service"):
+                    status = (getattr(lr, "status", "") or "").lower()
+                    if status in _CANCELLED_LAB_STATUSES:
+                        continue
+                    svc = getattr(lr, "service", None)
+                    services_expected += float(getattr(svc, "price", 0) or 0)
+            else:
+                seen = set()
+                for app in p.appointment_set.all():
+                    for s in app.services.all():
+                        if s.id in seen:
+                            continue
+                        seen.add(s.id)
+                        services_expected += float(s.price or 0)
+        except Exception:
+            services_expected = 0.0
+
+        # room (09:00 logic)
+        room_expected = 0.0
+        try:
+            regs = (
+                p.treatmentregistration_set
+                 .select_related("room")
+                 .order_by("assigned_at", "id")
+            )
+            stays = []
+            for reg in regs:
+                room = getattr(reg, "room", None)
+                if not room:
+                    continue
+                start = (
+                    getattr(reg, "assigned_at", None)
+                    or getattr(reg, "admitted_at", None)
+                    or getattr(reg, "start_date", None)
+                    or getattr(reg, "created_at", None)
+                )
+                stays.append((start, getattr(reg, "discharged_at", None), getattr(room, "price_per_day", 0)))
+            room_expected = _room_charge(stays, timezone.now())
+        except Exception:
+            pass
+
+        # paid (cash register)
+        paid_consult = 0.0
+        paid_service = 0.0
+        paid_other_cash = 0.0
+        try:
+            for cr in p.cashregister_set.all():
+                t = (cr.transaction_type or "").lower()
+                amt = float(cr.amount or 0)
+                if t == "consultation":
+                    paid_consult += amt
+                elif t == "service":
+                    paid_service += amt
+                else:
+                    paid_other_cash += amt
+        except Exception:
+            pass
+
+        # paid (room)
+        paid_room = 0.0
+        try:
+            qs = p.treatmentpayment_set.exclude(status__in=_UNCOUNTED_ROOM_PAYMENT_STATUSES)
+            for tp in qs:
+                paid_room += float(tp.amount or 0)
+        except Exception:
+            pass
+
+        return _totals(doctor, consult_expected, services_expected, room_expected,
+                       paid_consult, paid_service, paid_other_cash, paid_room)
+
+    @classmethod
+    def compute_for_patients(cls, patients, now=None):
+        """
+        Set-based equivalent of ``compute_for_patient`` for many patients.
+
+        Returns ``{patient_id: math}`` with exactly the same dicts the per-patient
+        method produces, using a fixed number of queries per ``BATCH_SIZE``
+        patients no matter what the caller prefetched. Row amounts are folded in
+        Python in the same order as the per-patient path so float rounding of the
+        totals is identical.
+        """
+        now = now or timezone.now()
+        patients = list(patients)
+        out = {}
+        for i in range(0, len(patients), cls.BATCH_SIZE):
+            out.update(cls._compute_batch(patients[i:i + cls.BATCH_SIZE], now))
+        return out
+
+    @staticmethod
+    def _compute_batch(patients, now):
+        ids = [p.pk for p in patients]
+
+        # --- doctor: patients_doctor → latest appointment → first stay with an appointment
+        doctor_ids = {p.pk: p.patients_doctor_id for p in patients}
+        missing = [pid for pid, did in doctor_ids.items() if not did]
+        if missing:
+            last_app_doctor = (
+                Appointment.objects.filter(patient=OuterRef("pk"))
+                .order_by("-created_at").values("doctor_id")[:1]
+            )
+            reg_doctor = (
+                TreatmentRegistration.objects
+                .filter(patient=OuterRef("pk"), appointment__isnull=False)
+                .order_by("pk").values("appointment__doctor_id")[:1]
+            )
+            fallback = (
+                Patient.objects.filter(pk__in=missing)
+                .annotate(fallback_doctor_id=Coalesce(Subquery(last_app_doctor), Subquery(reg_doctor)))
+                .values_list("pk", "fallback_doctor_id")
+            )
+            doctor_ids.update(fallback)
+        doctors = (
+            Doctor.objects.select_related("user")
+            .only("name", "consultation_price", "user__first_name", "user__last_name")
+            .in_bulk({did for did in doctor_ids.values() if did})
+        )
+
+        # --- services: lab registrations if the patient has any, else distinct appointment services
+        lab_rows = defaultdict(list)
+        for pid, status, price in (
+            LabRegistration.objects.filter(patient_id__in=ids)
+            .order_by("pk").values_list("patient_id", "status", "service__price")
+        ):
+            lab_rows[pid].append((status, price))
+
+        app_rows = defaultdict(list)
+        no_lab = [pid for pid in ids if pid not in lab_rows]
+        if no_lab:
+            for pid, service_id, price in (
+                Appointment.services.through.objects
+                .filter(appointment__patient_id__in=no_lab)
+                .order_by("appointment_id", "pk")
+                .values_list("appointment__patient_id", "service_id", "service__price")
+            ):
+                app_rows[pid].append((service_id, price))
+
+        # --- room stays in 09:00 charging order
+        stays = defaultdict(list)
+        for pid, start, end, price_per_day in (
+            TreatmentRegistration.objects
+            .filter(patient_id__in=ids, room__isnull=False)
+            .order_by("patient_id", "assigned_at", "id")
+            .values_list("patient_id", "assigned_at", "discharged_at", "room__price_per_day")
+        ):
+            stays[pid].append((start, end, price_per_day))
+
+        # --- payments (cash register keeps its Meta ordering, as the prefetch does)
+        cash_rows = defaultdict(list)
+        for pid, t, amount in (
+            CashRegister.objects.filter(patient_id__in=ids)
+            .order_by("patient_id", "-created_at")
+            .values_list("patient_id", "transaction_type", "amount")
+        ):
+            cash_rows[pid].append((t, amount))
+
+        room_paid = defaultdict(list)
+        for pid, amount in (
+            TreatmentPayment.objects.filter(patient_id__in=ids)
+            .exclude(status__in=_UNCOUNTED_ROOM_PAYMENT_STATUSES)
+            .order_by("pk").values_list("patient_id", "amount")
+        ):
+            room_paid[pid].append(amount)
+
+        out = {}
+        for pid in ids:
+            doctor = doctors.get(doctor_ids.get(pid))
+            consult_expected = float(doctor.consultation_price) if (doctor and doctor.consultation_price) else 0.0
+
+            services_expected = 0.0
+            if pid in lab_rows:
+                for status, price in lab_rows[pid]:
+                    if (status or "").lower() in _CANCELLED_LAB_STATUSES:
+                        continue
+                    services_expected += float(price or 0)
+            else:
+                seen = set()
+                for service_id, price in app_rows[pid]:
+                    if service_id in seen:
+                        continue
+                    seen.add(service_id)
+                    services_expected += float(price or 0)
+
+            room_expected = _room_charge(stays[pid], now)
+
+            paid_consult = 0.0
+            paid_service = 0.0
+            paid_other_cash = 0.0
+            for t, amount in cash_rows[pid]:
+                t = (t or "").lower()
+                amt = float(amount or 0)
+                if t == "consultation":
+                    paid_consult += amt
+                elif t == "service":
+                    paid_service += amt
+                else:
+                    paid_other_cash += amt
+
+            paid_room = 0.0
+            for amount in room_paid[pid]:
+                paid_room += float(amount or 0)
+
+            out[pid] = _totals(doctor, consult_expected, services_expected,
+                               room_expected, paid_consult, paid_service, paid_other_cash, paid_room)
+        return out
+
+
+# ------------------------ PatientBalance ledger ------------------------
+LEDGER_FIELDS = (
+    "doctor_id",
+    "doctor_name",
+    "consult_expected",
+    "services_expected",
+    "room_expected",
+    "expected_due",
+    "paid_consult",
+    "paid_service",
+    "paid_other_cash",
+    "paid_room",
+    "paid_total",
+    "balance",
+)
+
+
+def refresh_patient_balances(patient_ids, now=None):
+    """
+    Recompute and upsert ledger rows for ``patient_ids``. Returns rows written.
+    """
+    patients = list(Patient.objects.filter(pk__in=set(patient_ids)).only("pk", "patients_doctor"))
+    if not patients:
+        return 0
+    billing = _BillingMath.compute_for_patients(patients, now=now)
+    rows = [
+        PatientBalance(patient_id=pid, **{f: math[f] for f in LEDGER_FIELDS})
+        for pid, math in billing.items()
+    ]
+    PatientBalance.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["patient"],
+        update_fields=[*(f.removesuffix("_id") for f in LEDGER_FIELDS), "updated_at"],
+    )
+    return len(rows)
+
+
+def schedule_balance_refresh(*patient_ids):
+    """Refresh these patients' ledger rows once the current transaction commits."""
+    patient_ids = sorted({pid for pid in patient_ids if pid})
+    if not patient_ids:
+        return
+
+    def _refresh():
+        for i in range(0, len(patient_ids), REFRESH_BATCH_SIZE):
+            batch = patient_ids[i:i + REFRESH_BATCH_SIZE]
+            try:
+                refresh_patient_balances(batch)
+            except Exception:
+                logger.exception("PatientBalance refresh failed for patients=%s", batch)
+
+    transaction.on_commit(_refresh)
+
+
+def patients_billed_by(instance):
+    """
+    Ids of the patients whose ledger rows use ``instance`` (a Doctor, Service
+    or TreatmentRoom): its price, or for a doctor also the name, is part of
+    their totals. Call it before a delete, while the relations still exist.
+    """
+    if isinstance(instance, Doctor):
+        sources = (
+            Patient.objects.filter(patients_doctor=instance).values_list("pk", flat=True),
+            Appointment.objects.filter(doctor=instance).values_list("patient_id", flat=True),
+            TreatmentRegistration.objects.filter(appointment__doctor=instance).values_list("patient_id", flat=True),
+        )
+    elif isinstance(instance, Service):
+        sources = (
+            LabRegistration.objects.filter(service=instance).values_list("patient_id", flat=True),
+            Appointment.services.through.objects.filter(service=instance)
+            .values_list("appointment__patient_id", flat=True),
+        )
+    elif isinstance(instance, TreatmentRoom):
+        sources = (TreatmentRegistration.objects.filter(room=instance).values_list("patient_id", flat=True),)
+    else:
+        raise TypeError(f"{type(instance).__name__} is not priced on the ledger")
+    return {pid for qs in sources for pid in qs.distinct()}
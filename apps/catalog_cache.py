@@ -0,0 +1,187 @@
+# apps/catalog_cache.py
+"""
+Read-through cache for the catalog lists every registration form loads
+(doctors, services, rooms).
+
+Responses are cached as rendered JSON bytes in Redis, with a small LRU per
+worker process in front, and stamped with the catalog version
+(``VERSION_KEY``). The receivers in apps.signals bump it after every commit
+that saves or deletes a Doctor, Service or TreatmentRoom, so a cached list
+is never served past a change. Room lists also show who is in each room and
+depend on ``OCCUPANCY_VERSION_KEY`` as well. apps.receipt_cache stamps its
+receipts with the same catalog version.
+
+A hit costs one Redis round trip (the version read) and no SQL. The ETag is
+the version stamp, so a browser that already holds the current list gets a
+304 without the body. Without Redis every request is built as before.
+``stats()`` counts outcomes per catalog for this process.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import redis
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from apps import redis_client
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "catalog"
+VERSION_KEY = f"{PREFIX}:v"
+OCCUPANCY_VERSION_KEY = f"{PREFIX}:v:occupancy"
+ENTRY_TTL = redis_client.CACHE_ENTRY_TTL
+LOCAL_ENTRIES = 128
+# response headers that are part of a cached list (legacy pages' Link)
+KEPT_HEADERS = ("Link",)
+
+OUTCOMES = ("local_hit", "redis_hit", "miss", "not_modified", "bypass")
+
+_local = OrderedDict()
+_lock = threading.Lock()
+_stats = Counter()
+
+
+def _entry_key(name, url):
+    return f"{PREFIX}:{name}:{hashlib.md5(url.encode()).hexdigest()}"
+
+
+def _stamp(client, version_keys):
+    stamp = client.mget(version_keys)
+    if None in stamp:
+        # start a missing (e.g. flushed) version at the clock, not at 0, so it
+        # cannot collide with a stamp still held by a worker or a browser
+        for key in version_keys:
+            client.set(key, time.time_ns(), nx=True)
+        stamp = client.mget(version_keys)
+    return stamp
+
+
+def _count(name, outcome):
+    with _lock:
+        _stats[name, outcome] += 1
+
+
+def _local_get(key, stamp):
+    with _lock:
+        entry = _local.get(key)
+        if entry is None or entry["stamp"] != stamp:
+            return None
+        _local.move_to_end(key)
+        return entry
+
+
+def _local_put(key, entry):
+    with _lock:
+        _local[key] = entry
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_ENTRIES:
+            _local.popitem(last=False)
+
+
+def _response(entry, etag):
+    response = HttpResponse(entry["body"], content_type="application/json")
+    for header, value in entry["headers"].items():
+        response[header] = value
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def respond(request, name, version_keys, build):
+    """
+    The response of catalog list ``name`` at ``request``'s URL: cached while
+    ``version_keys`` are unchanged, else ``build()`` (a DRF Response) rendered
+    and cached. Call it after authentication and permission checks.
+    """
+    client = redis_client.client
+    stamp = None
+    if client is not None:
+        try:
+            stamp = _stamp(client, version_keys)
+        except redis.RedisError as e:
+            logger.warning("Catalog cache unavailable: %s", e)
+    if stamp is None:
+        _count(name, "bypass")
+        return build()
+
+    etag = quote_etag(f"{name}-{'-'.join(stamp)}")
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        _count(name, "not_modified")
+        return HttpResponseNotModified(headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    key = _entry_key(name, request.build_absolute_uri())
+    entry = _local_get(key, stamp)
+    if entry is not None:
+        _count(name, "local_hit")
+        return _response(entry, etag)
+    try:
+        raw = client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Catalog cache unavailable: %s", e)
+        raw = None
+    if raw is not None:
+        entry = json.loads(raw)
+        if entry["stamp"] == stamp:
+            _local_put(key, entry)
+            _count(name, "redis_hit")
+            return _response(entry, etag)
+
+    _count(name, "miss")
+    response = build()
+    if response.status_code != 200:
+        return response
+    entry = {
+        "stamp": stamp,
+        "body": JSONRenderer().render(response.data).decode(),
+        "headers": {h: response[h] for h in KEPT_HEADERS if response.has_header(h)},
+    }
+    try:
+        client.set(key, json.dumps(entry), ex=ENTRY_TTL)
+    except redis.RedisError as e:
+        logger.warning("Catalog cache unavailable: %s", e)
+    _local_put(key, entry)
+    return _response(entry, etag)
+
+
+class CachedListMixin:
+    """
+    Serve a ListAPIView's GET through the catalog cache. Set ``catalog`` to
+    the list's name and ``catalog_versions`` to the version keys it reads.
+    """
+    catalog = None
+    catalog_versions = (VERSION_KEY,)
+
+    def list(self, request, *args, **kwargs):
+        return respond(request, self.catalog, self.catalog_versions,
+                       lambda: super(CachedListMixin, self).list(request, *args, **kwargs))
+
+
+def stats():
+    """``{catalog: {outcome: count, ..., "hit_rate": ...}}`` for this process."""
+    with _lock:
+        counts = dict(_stats)
+    out = {}
+    for name in sorted({name for name, _ in counts}):
+        row = {outcome: counts.get((name, outcome), 0) for outcome in OUTCOMES}
+        served = sum(row.values())
+        hits = row["local_hit"] + row["redis_hit"] + row["not_modified"]
+        row["hit_rate"] = round(hits / served, 4) if served else None
+        out[name] = row
+    return out
+
+
+# ---- invalidation
+def schedule_invalidate():
+    """Outdate cached catalogs and receipts (doctor, service or room changed) after commit."""
+    redis_client.schedule_bump(VERSION_KEY)
+
+
+def schedule_invalidate_occupancy():
+    """Outdate cached room lists (someone moved in or out) after commit."""
+    redis_client.schedule_bump(OCCUPANCY_VERSION_KEY)
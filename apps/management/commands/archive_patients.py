@@ -1,50 +1,20 @@
 from django.core.management.base import BaseCommand
-from django.core.mail import EmailMessage
-from django.utils import timezone
-from apps.models import Patient
-from datetime import datetime, timedelta
-import pandas as pd
-import os
+
+from apps import archive
 
 
 class Command(BaseCommand):
-    help = 'Archive patients older than 1 year, email to admin, and delete them'
+    help = ("Archive patients older than 1 year, email the file to admin, and delete them. "
+            "Resumes an interrupted run instead of starting a new one.")
 
-    def handle(self, *args, **kwargs):
-        one_year_ago = timezone.now() - timedelta(days=365)
-        patients = Patient.objects.filter(created_at__lt=one_year_ago)
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+        parser.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE)
+        parser.add_argument("--no-email", action="store_true", help="Write the file but do not email it.")
 
-        if not patients.exists():
+    def handle(self, *args, **opts):
+        run = archive.run(days=opts["days"], batch_size=max(1, opts["batch_size"]), email=not opts["no_email"])
+        if run is None:
             self.stdout.write("✅ No patients to archive.")
             return
-
-        # Create export folder
-        os.makedirs("archives", exist_ok=True)
-        file_name = f"patients_archive_{datetime.now().strftime('%Y_%m')}.xlsx"
-        file_path = os.path.join("archives", file_name)
-
-        data = [{
-            "First Name": p.first_name,
-            "Last Name": p.last_name,
-            "Phone": p.phone,
-            "Address": p.address,
-            "Created At": p.created_at
-        } for p in patients]
-
-        df = pd.DataFrame(data)
-        df.to_excel(file_path, index=False)
-
-        # Email
-        email = EmailMessage(
-            subject="🗂️ Archived Patients Export",
-            body="Attached is the monthly archive of patients registered over a year ago.",
-            from_email="your_email@gmail.com",
-            to=["admin@example.com"]
-        )
-        email.attach_file(file_path)
-        email.send()
-
-        # Delete
-        count = patients.count()
-        patients.delete()
-        self.stdout.write(f"✅ Archived and deleted {count} patients.")
+        self.stdout.write(f"✅ Archived {run.exported} patients to {run.file_path} and deleted {run.deleted}.")
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps import revenue
+from apps.models import CashRegister, CashRegisterLine, Service
+
+
+def _service_index():
+    """name -> {doctor_id: Service}; the first service per (name, doctor) wins."""
+    index = defaultdict(dict)
+    for service in Service.objects.order_by("pk").only("id", "name", "price", "doctor_id").iterator():
+        index[service.name.strip()].setdefault(service.doctor_id, service)
+    return index
+
+
+def _resolve(index, name, doctor_id):
+    candidates = index.get(name)
+    if not candidates:
+        return None
+    return candidates.get(doctor_id) or next(iter(candidates.values()))
+
+
+class Command(BaseCommand):
+    help = ("Create CashRegisterLine rows for service payments recorded before lines existed, "
+            "parsing the \"Service Payment: a, b\" notes, then rebuild the DailyRevenue rollup.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report what would be created without writing.")
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, opts["batch_size"])
+        index = _service_index()
+        pending = (
+            CashRegister.objects
+            .filter(transaction_type="service", notes__startswith=revenue.SERVICE_NOTE_PREFIX, lines__isnull=True)
+            .order_by("pk")
+            .values_list("pk", "doctor_id", "notes", "amount")
+        )
+
+        payments = lines = unresolved = 0
+        last_pk = 0
+        while True:
+            page = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not page:
+                break
+            last_pk = page[-1][0]
+            batch = []
+            for pk, doctor_id, notes, amount in page:
+                names = [name for name in revenue.service_names_from_notes(notes) if name]
+                if not names:
+                    continue
+                services = [_resolve(index, name, doctor_id) for name in names]
+                weights = [s.price if s else None for s in services]
+                for name, service, share in zip(names, services, revenue.split_amount(amount, weights)):
+                    batch.append(CashRegisterLine(cash_register_id=pk, service=service, name=name, amount=share))
+                    unresolved += service is None
+                payments += 1
+            if batch and not opts["dry_run"]:
+                with transaction.atomic():
+                    CashRegisterLine.objects.bulk_create(batch)
+            lines += len(batch)
+
+        verb = "Would create" if opts["dry_run"] else "Created"
+        self.stdout.write(f"{verb} {lines} line(s) for {payments} payment(s); "
+                          f"{unresolved} name(s) matched no Service and were kept without one.")
+        if opts["dry_run"]:
+            return
+
+        rows = revenue.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"✅ DailyRevenue rebuilt: {rows} row(s)."))
@@ -0,0 +1,179 @@
+import json
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps import redis_client
+from apps.models import (
+    Appointment, CashRegister, Doctor, LabRegistration, Patient, TreatmentPayment, TreatmentRegistration, User,
+)
+
+API = "/api/v1"
+
+
+def _registration(doctor):
+    return {
+        "first_name": "Benchmark", "last_name": "Bemor", "phone": "+998900000000", "address": "Toshkent",
+        "age": 30, "doctor_id": doctor.pk, "services": list(doctor.services.values_list("pk", flat=True)[:2]),
+        "reason": "Benchmark", "amount_paid": "0", "amount_owed": "0",
+    }
+
+
+def endpoints(doctor):
+    """(name, method, path, params or JSON body): the pages the front desk and dashboards hit most."""
+    today = timezone.localdate()
+    month = {"start_date": (today - timedelta(days=29)).isoformat(), "end_date": today.isoformat()}
+    out = [
+        ("balances", "GET", "/patient-balances/data/", {"limit": 200}),
+        ("balances_search", "GET", "/patient-balances/data/", {"q": "ali", "limit": 200}),
+        ("unpaid", "GET", "/unpaid-patients/data/", {"limit": 200}),
+        ("patient_search", "GET", "/patients/search/", {"q": "karim 9"}),
+        ("admin_statistics", "GET", "/admin-statistics/", month),
+        ("admin_chart", "GET", "/admin-chart-data/", month),
+        ("accounting_dashboard", "GET", "/accounting-dashboard/", month),
+        ("current_calls", "GET", "/current-calls/", {}),
+        ("room_status", "GET", "/room-status/", {}),
+        ("treatment_rooms", "GET", "/treatment-rooms/", {"legacy": 1}),
+        ("treatment_room_payments", "GET", "/treatment-room-payments/", {}),
+    ]
+    if doctor is not None:
+        out.append(("register_patient", "POST", "/register-patient/", _registration(doctor)))
+    return out
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def _commit():
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                    text=True, cwd=settings.BASE_DIR).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + ("-dirty" if dirty else "")
+
+
+class Command(BaseCommand):
+    help = ("Latency and SQL queries of the hot API endpoints against the current database (see seed_clinic). "
+            "Writes a JSON report; --compare prints the change against an earlier report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--user", help="Email of the user to call the API as; default: the first superuser.")
+        parser.add_argument("--only", nargs="+", metavar="NAME", help="Benchmark only these endpoints.")
+        parser.add_argument("--without-redis", action="store_true",
+                            help="Run with the Redis client disabled (database fallbacks, no caches).")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+        parser.add_argument("--compare", metavar="REPORT", help="Earlier JSON report to compare with.")
+
+    def handle(self, *args, **opts):
+        runs, warmup = max(1, opts["runs"]), max(0, opts["warmup"])
+        users = User.objects.filter(email=opts["user"]) if opts["user"] else User.objects.filter(is_superuser=True)
+        user = users.order_by("pk").first()
+        if user is None:
+            raise CommandError("No user to call the API as; pass --user or create a superuser.")
+        baseline = None
+        if opts["compare"]:
+            with open(opts["compare"]) as f:
+                baseline = json.load(f)
+
+        token = str(RefreshToken.for_user(user).access_token)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        doctor = Doctor.objects.filter(services__isnull=False).order_by("pk").first()
+        selected = [e for e in endpoints(doctor) if not opts["only"] or e[0] in opts["only"]]
+        if not selected:
+            raise CommandError("No endpoint matches --only.")
+
+        saved_client = redis_client.client
+        if opts["without_redis"]:
+            redis_client.client = None
+        try:
+            results = {name: self.measure(client, method, API + path, data, runs, warmup)
+                       for name, method, path, data in selected}
+        finally:
+            redis_client.client = saved_client
+
+        report = {
+            "meta": {
+                "commit": _commit(),
+                "at": timezone.now().isoformat(timespec="seconds"),
+                "database": connection.vendor,
+                "redis": redis_client.client is not None and not opts["without_redis"],
+                "runs": runs,
+                "warmup": warmup,
+                "rows": {model.__name__: model.objects.count() for model in (
+                    Patient, Appointment, TreatmentRegistration, LabRegistration, CashRegister, TreatmentPayment)},
+            },
+            "endpoints": results,
+        }
+        self.print_table(report, baseline)
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Report written to {opts['output']}"))
+
+    def measure(self, client, method, path, data, runs, warmup):
+        timings, queries, status, size = [], [], None, 0
+        for i in range(warmup + runs):
+            # writes are rolled back so every run starts from the same data
+            with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                if method == "GET":
+                    response = client.get(path, data)
+                else:
+                    response = client.generic(method, path, json.dumps(data), content_type="application/json")
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if i < warmup:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(captured.captured_queries))
+            status = response.status_code
+            size = 0 if response.streaming else len(response.content)
+        timings.sort()
+        return {
+            "method": method,
+            "path": path,
+            "status": status,
+            "bytes": size,
+            "queries": {"min": min(queries), "max": max(queries)},
+            "ms": {
+                "min": round(timings[0], 2),
+                "p50": round(_percentile(timings, 50), 2),
+                "p95": round(_percentile(timings, 95), 2),
+                "max": round(timings[-1], 2),
+                "mean": round(sum(timings) / len(timings), 2),
+            },
+        }
+
+    def print_table(self, report, baseline):
+        meta = report["meta"]
+        self.stdout.write(f"{meta['commit'] or '?'} on {meta['database']}, redis={meta['redis']}, "
+                          f"{meta['runs']} runs, rows: {meta['rows']}")
+        before = (baseline or {}).get("endpoints", {})
+        if baseline:
+            self.stdout.write(f"compared with {baseline['meta'].get('commit') or '?'}")
+        self.stdout.write(f"{'endpoint':<26}{'status':>7}{'queries':>9}{'p50 ms':>10}{'p95 ms':>10}"
+                          + (f"{'p50 Δ':>10}{'queries Δ':>11}" if baseline else ""))
+        for name, row in report["endpoints"].items():
+            line = (f"{name:<26}{row['status']:>7}{row['queries']['max']:>9}"
+                    f"{row['ms']['p50']:>10.1f}{row['ms']['p95']:>10.1f}")
+            old = before.get(name)
+            if old:
+                change = (row["ms"]["p50"] - old["ms"]["p50"]) / old["ms"]["p50"] * 100 if old["ms"]["p50"] else 0
+                line += f"{change:>+9.0f}%{row['queries']['max'] - old['queries']['max']:>+11d}"
+            elif baseline:
+                line += f"{'new':>10}"
+            self.stdout.write(line)
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from escpos.printer import Dummy
+
+from apps import receipts
+
+SAMPLES = {
+    "cash_receipt": lambda i: {
+        "receipt_number": f"CR-{i}", "date": "2025-01-01 09:30", "patient_name": f"Ali G‘ulomov {i}",
+        "doctor_name": "Dr Karimov", "transaction_type": "Konsultatsiya", "amount": 150000 + i,
+        "payment_method": "Naqd", "notes": "",
+    },
+    "room_receipt": lambda i: {
+        "receipt_number": f"TP-{i}", "date": "2025-01-01 09:30:00", "patient_name": f"Vali Rustamov {i}",
+        "transaction_type": "Davolash", "amount": 300000 + i, "payment_method": "cash",
+        "processed_by": "Kassir", "notes": "", "qr": f'{{"name": "Vali Rustamov {i}", "amount": "{300000 + i}"}}',
+    },
+    "turn_ticket": lambda i: {
+        "patient_name": f"Ali Valiyev {i}", "doctor_name": "Dr Karimov", "turn_number": f"A{i % 1000:03d}",
+        "date": "2025-01-01 09:30", "qr": f"http://yourdomain.com/patient/detail/{i}/",
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ("Receipts per second per layout: compiled byte templates (apps.receipts) "
+            "against drawing op by op on escpos' Dummy printer.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        count = max(1, opts["count"])
+        self.stdout.write(f"{count} receipts per layout, RECEIPT_NATIVE_QR={settings.RECEIPT_NATIVE_QR}")
+        for kind, sample in SAMPLES.items():
+            payloads = [sample(i) for i in range(count)]
+            layout = receipts.LAYOUTS[kind]
+            receipts.template(kind)  # compile outside the timed loop
+
+            started = time.perf_counter()
+            for payload in payloads:
+                device = Dummy()
+                layout.draw(device, payload)
+                device.output
+            drawn = count / (time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for payload in payloads:
+                receipts.render(kind, payload)
+            compiled = count / (time.perf_counter() - started)
+
+            self.stdout.write(f"{kind:<14} draw {drawn:>10.0f}/s   compiled {compiled:>10.0f}/s   "
+                              f"x{compiled / drawn:.1f}")
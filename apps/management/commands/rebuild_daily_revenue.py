@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps import revenue
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailyRevenue rollup from CashRegister, TreatmentPayment and Outcome rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First local day to rebuild (YYYY-MM-DD); default: beginning.")
+        parser.add_argument("--end", help="Last local day to rebuild (YYYY-MM-DD); default: today.")
+
+    def handle(self, *args, **opts):
+        start = parse_date(opts["start"]) if opts["start"] else None
+        end = parse_date(opts["end"]) if opts["end"] else None
+        if (opts["start"] and not start) or (opts["end"] and not end):
+            raise CommandError("Dates must be YYYY-MM-DD.")
+
+        rows = revenue.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"✅ DailyRevenue rebuilt: {rows} row(s)."))
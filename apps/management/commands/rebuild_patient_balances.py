@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.billing import LEDGER_FIELDS, _BillingMath, refresh_patient_balances
+from apps.models import Patient, PatientBalance
+
+
+def _batches(ids, size):
+    batch = []
+    for pid in ids:
+        batch.append(pid)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Rebuild the PatientBalance ledger from source rows, or verify it with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true",
+                            help="Compare the ledger with freshly computed balances without writing.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, opts["batch_size"])
+        now = timezone.now()
+        ids = Patient.objects.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=batch_size)
+
+        if not opts["verify"]:
+            written = sum(refresh_patient_balances(batch, now=now) for batch in _batches(ids, batch_size))
+            self.stdout.write(self.style.SUCCESS(f"✅ Rebuilt {written} patient balance row(s)."))
+            return
+
+        checked = 0
+        mismatched = []
+        for batch in _batches(ids, batch_size):
+            patients = list(Patient.objects.filter(pk__in=batch))
+            expected = _BillingMath.compute_for_patients(patients, now=now)
+            stored = PatientBalance.objects.in_bulk(batch)
+            for pid, math in expected.items():
+                row = stored.get(pid)
+                if row is None or any(getattr(row, f) != math[f] for f in LEDGER_FIELDS):
+                    mismatched.append(pid)
+            checked += len(expected)
+
+        if mismatched:
+            sample = ", ".join(str(pid) for pid in mismatched[:20])
+            raise CommandError(f"{len(mismatched)} of {checked} ledger row(s) out of date (patients: {sample}).")
+        self.stdout.write(self.style.SUCCESS(f"✅ Ledger matches for {checked} patient(s)."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps import seed
+
+
+class Command(BaseCommand):
+    help = ("Add synthetic doctors, services, rooms and patients with their visits, stays, lab work, "
+            "payments and outcomes (apps.seed), for local load testing. Existing rows are kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=2000)
+        parser.add_argument("--days", type=int, default=180, help="Spread patients over this many days up to today.")
+        parser.add_argument("--doctors", type=int, default=12)
+        parser.add_argument("--services-per-doctor", type=int, default=6)
+        parser.add_argument("--rooms", type=int, default=15)
+        parser.add_argument("--return-rate", type=float, default=0.3, help="Share of patients with a second visit.")
+        parser.add_argument("--stay-rate", type=float, default=0.15, help="Share of visits followed by a room stay.")
+        parser.add_argument("--lab-rate", type=float, default=0.3, help="Share of visits with lab registrations.")
+        parser.add_argument("--outcomes-per-day", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=None, help="Random seed, for repeatable data.")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        if opts["patients"] < 0 or opts["days"] < 1 or opts["doctors"] < 1 or opts["rooms"] < 0:
+            raise CommandError("Need --doctors >= 1, --days >= 1 and non-negative --patients / --rooms.")
+        counts = seed.seed(
+            doctors=opts["doctors"],
+            services_per_doctor=opts["services_per_doctor"],
+            rooms=opts["rooms"],
+            patients=opts["patients"],
+            days=opts["days"],
+            return_rate=opts["return_rate"],
+            stay_rate=opts["stay_rate"],
+            lab_rate=opts["lab_rate"],
+            outcomes_per_day=opts["outcomes_per_day"],
+            random_seed=opts["seed"],
+            batch_size=max(1, opts["batch_size"]),
+            log=lambda message: self.stdout.write(f"  {message}") if opts["verbosity"] > 1 else None,
+        )
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"✅ Seeded {summary}."))
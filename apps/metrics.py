@@ -0,0 +1,311 @@
+# apps/metrics.py
+"""
+Request and Celery task instrumentation, exported in the Prometheus text
+format (``GET /api/v1/metrics/``, admins only).
+
+``RequestMetricsMiddleware`` times every request and counts its SQL through
+``connection.execute_wrapper``, per route pattern and method: a latency
+histogram, a queries-per-request histogram, SQL time, response bytes and
+status codes. Queries slower than ``METRICS_SLOW_QUERY_MS`` are sampled with
+the innermost project frame that issued them. Requests slower than
+``METRICS_SLOW_REQUEST_MS``, or issuing more than ``METRICS_MANY_QUERIES``
+queries, go to a ring buffer of the last ``METRICS_WORST_REQUESTS`` such
+requests (``GET /api/v1/metrics/requests/``). Request metrics live in the web
+process that served them.
+
+Celery tasks run in other processes, so their run counts, durations and
+queue waits (publish to start, from a ``published_at`` header) are added up
+in a Redis hash that the web process reads when scraped. Without Redis task
+metrics are not collected.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+import redis
+from celery import signals as celery_signals
+from django.conf import settings
+from django.db import connections
+
+from apps import catalog_cache, redis_client
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+SLOW_QUERY_SAMPLES = 100
+TASKS_KEY = "metrics:celery"
+
+_PROJECT_DIR = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class Histogram:
+    """Counts per bucket (not cumulative until rendered), plus sum and count."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Route:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.response_bytes = 0
+        self.slow_queries = 0
+        self.statuses = defaultdict(int)
+
+
+_lock = threading.Lock()
+_routes = defaultdict(_Route)  # (route, method) -> _Route
+_slow_queries = deque(maxlen=SLOW_QUERY_SAMPLES)
+_worst = deque(maxlen=settings.METRICS_WORST_REQUESTS)
+
+
+def _origin():
+    """``path:line in function`` of the innermost project frame on the stack."""
+    for frame in reversed(traceback.extract_stack()):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_PROJECT_DIR) and path != _THIS_FILE and "site-packages" not in path:
+            return f"{os.path.relpath(path, _PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class _QueryTimer:
+    """``execute_wrapper`` counting and timing one request's queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed * 1000 >= settings.METRICS_SLOW_QUERY_MS:
+                self.slow.append({"sql": sql[:2000], "ms": round(elapsed * 1000, 1), "origin": _origin()})
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    return match.route if match else "<unmatched>"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        record(request, response, time.perf_counter() - started, timer)
+        return response
+
+
+def record(request, response, seconds, timer):
+    route, method = _route(request), request.method
+    size = 0 if response.streaming else len(response.content)
+    worst = (seconds * 1000 >= settings.METRICS_SLOW_REQUEST_MS
+             or timer.count > settings.METRICS_MANY_QUERIES)
+    with _lock:
+        stats = _routes[route, method]
+        stats.latency.observe(seconds)
+        stats.queries.observe(timer.count)
+        stats.db_seconds += timer.seconds
+        stats.response_bytes += size
+        stats.slow_queries += len(timer.slow)
+        stats.statuses[response.status_code] += 1
+        for query in timer.slow:
+            _slow_queries.append({"route": route, "method": method, **query})
+        if worst:
+            _worst.append({
+                "at": time.time(),
+                "route": route,
+                "method": method,
+                "path": request.get_full_path()[:500],
+                "status": response.status_code,
+                "ms": round(seconds * 1000, 1),
+                "queries": timer.count,
+                "db_ms": round(timer.seconds * 1000, 1),
+                "bytes": size,
+            })
+
+
+def recent():
+    """The ring buffers: worst requests and slow query samples, newest first."""
+    with _lock:
+        return {"worst_requests": list(_worst)[::-1], "slow_queries": list(_slow_queries)[::-1]}
+
+
+# ---- Celery tasks
+@celery_signals.before_task_publish.connect(dispatch_uid="metrics-publish")
+def _stamp_published(headers=None, **kwargs):
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+
+@celery_signals.task_prerun.connect(dispatch_uid="metrics-prerun")
+def _task_prerun(task=None, **kwargs):
+    # on the request context, which is popped with the run: nothing outlives a
+    # task whose postrun never fires
+    task.request.metrics_started = time.perf_counter()
+    published_at = getattr(task.request, "published_at", None)
+    if published_at is not None:
+        _task_add(task.name, "wait", max(0.0, time.time() - published_at))
+
+
+@celery_signals.task_postrun.connect(dispatch_uid="metrics-postrun")
+def _task_postrun(task=None, state=None, **kwargs):
+    started = getattr(task.request, "metrics_started", None)
+    if started is not None:
+        _task_add(task.name, "duration", time.perf_counter() - started, state or "UNKNOWN")
+
+
+def _task_add(name, metric, seconds, state=None):
+    client = redis_client.client
+    if client is None:
+        return
+    bucket = bisect.bisect_left(TASK_BUCKETS, seconds)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(TASKS_KEY, f"{name}|{metric}|bucket|{bucket}", 1)
+        pipe.hincrbyfloat(TASKS_KEY, f"{name}|{metric}|sum", seconds)
+        if state is not None:
+            pipe.hincrby(TASKS_KEY, f"{name}|runs|{state}", 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Task metrics unavailable: %s", e)
+
+
+def _task_histograms():
+    """``({(task, metric): Histogram}, {(task, state): runs})`` from Redis."""
+    client = redis_client.client
+    histograms, runs = {}, {}
+    if client is None:
+        return histograms, runs
+    try:
+        fields = client.hgetall(TASKS_KEY)
+    except redis.RedisError as e:
+        logger.warning("Task metrics unavailable: %s", e)
+        return histograms, runs
+    for field, value in fields.items():
+        name, metric, kind, *rest = field.split("|")
+        if metric == "runs":
+            runs[name, kind] = int(value)
+            continue
+        histogram = histograms.setdefault((name, metric), Histogram(TASK_BUCKETS))
+        if kind == "sum":
+            histogram.sum = float(value)
+        else:
+            histogram.counts[int(rest[0])] = int(value)
+            histogram.count += int(value)
+    return histograms, runs
+
+
+# ---- Prometheus text format
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+
+def _histogram_lines(name, histogram, labels):
+    lines, cumulative = [], 0
+    for le, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{{{labels},le=\"{le}\"}} {cumulative}")
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def _family(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _snapshot():
+    """Copies of the per-route stats, taken under the lock."""
+    with _lock:
+        out = []
+        for (route, method), stats in sorted(_routes.items()):
+            copy = _Route()
+            copy.latency, copy.queries = _copy(stats.latency), _copy(stats.queries)
+            copy.db_seconds, copy.response_bytes = stats.db_seconds, stats.response_bytes
+            copy.slow_queries, copy.statuses = stats.slow_queries, dict(stats.statuses)
+            out.append((route, method, copy))
+        return out
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    routes = [(route, method, _labels(route=route, method=method), stats) for route, method, stats in _snapshot()]
+    lines = []
+    _family(lines, "http_request_duration_seconds", "histogram", "Request latency by route.")
+    for _, _, labels, stats in routes:
+        lines += _histogram_lines("http_request_duration_seconds", stats.latency, labels)
+    _family(lines, "http_request_db_queries", "histogram", "SQL queries per request by route.")
+    for _, _, labels, stats in routes:
+        lines += _histogram_lines("http_request_db_queries", stats.queries, labels)
+    for name, attr, kind, help_text in (
+        ("http_request_db_seconds_total", "db_seconds", "counter", "Time spent in SQL by route."),
+        ("http_response_bytes_total", "response_bytes", "counter", "Response body bytes by route."),
+        ("http_slow_queries_total", "slow_queries", "counter",
+         f"Queries over {settings.METRICS_SLOW_QUERY_MS} ms by route."),
+    ):
+        _family(lines, name, kind, help_text)
+        for _, _, labels, stats in routes:
+            lines.append(f"{name}{{{labels}}} {getattr(stats, attr):g}")
+    _family(lines, "http_responses_total", "counter", "Responses by route and status code.")
+    for route, method, _, stats in routes:
+        for code, count in sorted(stats.statuses.items()):
+            lines.append(f"http_responses_total{{{_labels(route=route, method=method, status=code)}}} {count}")
+
+    _family(lines, "catalog_cache_requests_total", "counter", "Catalog list requests by outcome (apps.catalog_cache).")
+    for catalog, row in catalog_cache.stats().items():
+        for outcome in catalog_cache.OUTCOMES:
+            lines.append(f"catalog_cache_requests_total{{{_labels(catalog=catalog, outcome=outcome)}}} {row[outcome]}")
+
+    histograms, runs = _task_histograms()
+    _family(lines, "celery_task_runs_total", "counter", "Finished Celery task runs by state.")
+    for (name, state), count in sorted(runs.items()):
+        lines.append(f"celery_task_runs_total{{{_labels(task=name, state=state)}}} {count}")
+    for metric, family, help_text in (
+        ("duration", "celery_task_duration_seconds", "Celery task run time."),
+        ("wait", "celery_task_queue_wait_seconds", "Celery task time from publish to start."),
+    ):
+        _family(lines, family, "histogram", help_text)
+        for (name, m), histogram in sorted(histograms.items()):
+            if m == metric:
+                lines += _histogram_lines(family, histogram, _labels(task=name))
+    return "\n".join(lines) + "\n"
+
+
+def _copy(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+    return copy
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0007_payment_repeat_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientBalance',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger', serialize=False, to='apps.patient')),
+                ('doctor_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('consult_expected', models.BigIntegerField(default=0)),
+                ('services_expected', models.BigIntegerField(default=0)),
+                ('room_expected', models.BigIntegerField(default=0)),
+                ('expected_due', models.BigIntegerField(default=0)),
+                ('paid_consult', models.BigIntegerField(default=0)),
+                ('paid_service', models.BigIntegerField(default=0)),
+                ('paid_other_cash', models.BigIntegerField(default=0)),
+                ('paid_room', models.BigIntegerField(default=0)),
+                ('paid_total', models.BigIntegerField(default=0)),
+                ('balance', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['balance', 'patient'], name='patientbalance_balance_idx')],
+            },
+        ),
+    ]
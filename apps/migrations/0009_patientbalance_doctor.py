@@ -0,0 +1,27 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The ledger is not filled here: the billing engine reads live models, which a
+# migration must not import. Run `manage.py rebuild_patient_balances` after
+# deploying (README, step 5); until then the unpaid list is empty.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0008_patientbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientbalance',
+            name='doctor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='patient_balances', to='apps.doctor'),
+        ),
+        migrations.AddIndex(
+            model_name='patientbalance',
+            index=models.Index(fields=['doctor', 'balance', 'patient'], name='patientbalance_doctor_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0009_patientbalance_doctor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(choices=[('cash', 'Kassa'), ('cash_service', 'Kassa (xizmat bo‘yicha)'), ('room_payment', 'Xona to‘lovi'), ('outcome', 'Xarajat')], max_length=20)),
+                ('transaction_type', models.CharField(blank=True, default='', max_length=50)),
+                ('payment_method', models.CharField(blank=True, default='', max_length=20)),
+                ('label', models.CharField(blank=True, default='', max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='apps.doctor')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='apps.treatmentroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'kind'], name='dailyrevenue_day_kind_idx')],
+            },
+        ),
+    ]
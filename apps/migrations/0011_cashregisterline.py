@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0010_dailyrevenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyrevenue',
+            name='service',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='apps.service'),
+        ),
+        migrations.CreateModel(
+            name='CashRegisterLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cash_register', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='apps.cashregister')),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cash_lines', to='apps.service')),
+            ],
+        ),
+    ]
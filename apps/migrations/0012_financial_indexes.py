@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0011_cashregisterline'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'doctor', 'created_at'], name='appointment_status_doc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashregister',
+            index=models.Index(fields=['created_at', 'transaction_type'], name='cashregister_created_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashregister',
+            index=models.Index(fields=['patient', 'created_at'], name='cashregister_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labregistration',
+            index=models.Index(fields=['patient', 'service'], name='labreg_patient_service_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatmentpayment',
+            index=models.Index(fields=['patient', 'date'], name='treatmentpay_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatmentregistration',
+            index=models.Index(fields=['room', 'discharged_at'], name='treatmentreg_room_disch_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0012_financial_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('assigned', 'Assigned'), ('cancelled', 'Cancelled'), ('done', 'Done'), ('expired', 'Expired')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.2 on 2026-10-17 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0013_appointment_expired_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField()),
+                ('status', models.CharField(choices=[('exporting', 'Exporting'), ('exported', 'Exported'), ('deleting', 'Deleting'), ('done', 'Done')], default='exporting', max_length=20)),
+                ('file_path', models.CharField(blank=True, default='', max_length=500)),
+                ('max_patient_id', models.BigIntegerField(default=0)),
+                ('last_deleted_id', models.BigIntegerField(default=0)),
+                ('exported', models.IntegerField(default=0)),
+                ('deleted', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.2 on 2026-10-17 19:34
+
+from django.db import migrations, models
+
+from apps.patient_search import normalize_phone
+
+TRIGRAM_INDEXES = {
+    'patient_first_name_trgm': 'first_name',
+    'patient_last_name_trgm': 'last_name',
+}
+
+
+def fill_phone_digits(apps, schema_editor):
+    Patient = apps.get_model('apps', 'Patient')
+    batch = []
+    for patient in Patient.objects.only('id', 'phone').iterator(chunk_size=2000):
+        patient.phone_digits = normalize_phone(patient.phone)
+        batch.append(patient)
+        if len(batch) == 2000:
+            Patient.objects.bulk_update(batch, ['phone_digits'])
+            batch = []
+    Patient.objects.bulk_update(batch, ['phone_digits'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm only exists on PostgreSQL; elsewhere names are matched by scan
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON apps_patient USING gin (UPPER({column}) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0016_receipt_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='phone_digits',
+            field=models.CharField(blank=True, default='', editable=False, max_length=15),
+        ),
+        migrations.RunPython(fill_phone_digits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone_digits'], name='patient_phone_digits_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:12
+
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def _digest(row):
+    # apps.revenue.key_digest as of this migration, over the historical row
+    key = [row.day.isoformat(), row.kind, row.transaction_type, row.payment_method,
+           row.doctor_id, row.room_id, row.service_id, row.label]
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+
+def fill_keys(apps, schema_editor):
+    # rows are additive, so duplicates left by racing first writes fold into one
+    DailyRevenue = apps.get_model('apps', 'DailyRevenue')
+    rows = defaultdict(list)
+    for row in DailyRevenue.objects.order_by('pk').iterator(chunk_size=2000):
+        rows[_digest(row)].append(row)
+    kept, extra = [], []
+    for digest, (first, *rest) in rows.items():
+        first.key = digest
+        first.amount += sum(row.amount for row in rest)
+        first.count += sum(row.count for row in rest)
+        kept.append(first)
+        extra += [row.pk for row in rest]
+    for i in range(0, len(extra), 1000):
+        DailyRevenue.objects.filter(pk__in=extra[i:i + 1000]).delete()
+    DailyRevenue.objects.bulk_update(kept, ['key', 'amount', 'count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0017_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyrevenue',
+            name='key',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dailyrevenue',
+            name='key',
+            field=models.CharField(editable=False, max_length=40, unique=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.2 on 2026-10-19 10:05
+
+from django.db import migrations
+
+
+def strip_trunk_prefix(apps, schema_editor):
+    # numbers saved as "8 90 123-45-67" before apps.patient_search dropped the
+    # trunk prefix; the rest were normalized by 0017 and Patient.save()
+    Patient = apps.get_model('apps', 'Patient')
+    batch = []
+    patients = Patient.objects.filter(phone_digits__regex=r'^8[0-9]{9}$').only('id', 'phone_digits')
+    for patient in patients.iterator(chunk_size=2000):
+        patient.phone_digits = patient.phone_digits[1:]
+        batch.append(patient)
+    Patient.objects.bulk_update(batch, ['phone_digits'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0018_dailyrevenue_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_trunk_prefix, migrations.RunPython.noop),
+    ]
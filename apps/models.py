@@ -2,8 +2,8 @@ import random
 from datetime import timedelta
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models import DateField, CharField, EmailField, BooleanField
+from django.db import IntegrityError, models, transaction
+from django.db.models import DateField, CharField, EmailField, BooleanField, F
 from django.db.models import Model, ForeignKey, DateTimeField, CASCADE, OneToOneField
 from django.utils import timezone
 from django.utils.timezone import now
@@ -12,6 +12,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.manager import CustomUserManager
+from apps.patient_search import normalize_phone
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
@@ -59,11 +60,27 @@ class Patient(models.Model):
     last_name = models.CharField(max_length=100)
     age = models.IntegerField(null=True, blank=True)
     phone = models.CharField(max_length=15)
+    # national number, digits only (see apps.patient_search); kept in sync by save()
+    phone_digits = models.CharField(max_length=15, blank=True, default='', editable=False)
     address = models.TextField()
     patients_doctor = ForeignKey(Doctor, on_delete=CASCADE, null=True , blank=True)
     services = models.ManyToManyField(Service, blank=True, related_name='patients')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # prefix LIKE; the trigram name indexes are PostgreSQL-only (migration 0017)
+            models.Index(fields=['phone_digits'], name='patient_phone_digits_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.phone_digits = normalize_phone(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_digits'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -84,7 +101,8 @@ class Appointment(models.Model):
         ('queued', 'Queued'),
         ('assigned', 'Assigned'),
         ('cancelled', 'Cancelled'),
-        ('done', 'Done')
+        ('done', 'Done'),
+        ('expired', 'Expired'),  # still queued when its clinic day ended (apps.turn_queue.sweep)
     ]
 
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -96,6 +114,11 @@ class Appointment(models.Model):
     turn_number = models.CharField(max_length=10, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'doctor', 'created_at'], name='appointment_status_doc_idx'),
+        ]
+
     def __str__(self):
         return f"{self.patient} with {self.doctor}"
 
@@ -120,6 +143,11 @@ class TreatmentRegistration(models.Model):
     discharged_at = models.DateTimeField(null=True, blank=True)
     total_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'discharged_at'], name='treatmentreg_room_disch_idx'),
+        ]
+
     def is_active(self):
         return self.discharged_at is None
 
@@ -154,6 +182,11 @@ class TreatmentPayment(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'date'], name='treatmentpay_patient_date_idx'),
+        ]
+
 
 class CashRegister(models.Model):
     TRANSACTION_TYPES = [
@@ -185,11 +218,64 @@ class CashRegister(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'transaction_type'], name='cashregister_created_type_idx'),
+            models.Index(fields=['patient', 'created_at'], name='cashregister_patient_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient} - {self.get_transaction_type_display()} - {self.amount}"
 
 
+class CashRegisterLine(models.Model):
+    """One paid service on a CashRegister row; amounts add up to the row's amount."""
+    cash_register = models.ForeignKey(CashRegister, on_delete=models.CASCADE, related_name='lines')
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='cash_lines')
+    name = models.CharField(max_length=255)  # service name at payment time
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.name}: {self.amount}"
+
+
+class ReceiptSequence(models.Model):
+    """
+    Per-day, per-prefix counter behind CashRegister.turn_number ("A001" for
+    consultations, "B001" otherwise). ``allocate`` increments the one row in
+    place, so a number costs an indexed UPDATE and a read whatever the size of
+    the cash book, and the row lock taken by the UPDATE keeps concurrent
+    cashiers from sharing one. Numbers whose receipt then fails to save are
+    skipped, not reused.
+    """
+    prefix = models.CharField(max_length=5)
+    day = models.DateField()
+    last_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['prefix', 'day'], name='receiptseq_prefix_day_uniq'),
+        ]
+
+    @classmethod
+    def allocate(cls, prefix, day=None):
+        day = day or timezone.localdate()
+        counter = cls.objects.filter(prefix=prefix, day=day)
+        with transaction.atomic():
+            if not counter.update(last_number=F('last_number') + 1):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(prefix=prefix, day=day, last_number=1)
+                    return 1
+                except IntegrityError:
+                    # another cashier opened the day first
+                    counter.update(last_number=F('last_number') + 1)
+            return counter.values_list('last_number', flat=True).get()
+
+    @staticmethod
+    def format(prefix, number):
+        return f"{prefix}{number:03d}"
+
+
 class TurnNumber(models.Model):
     doctor = models.OneToOneField(Doctor, on_delete=models.CASCADE)
     letter = models.CharField(max_length=1)  # A, B, C, etc.
@@ -197,14 +283,21 @@ class TurnNumber(models.Model):
     last_reset = models.DateField(auto_now_add=True)
 
     def get_next_turn(self):
-        today = timezone.now().date()
-        if self.last_reset != today:
-            self.current_number = 1
-            self.last_reset = today
-        else:
-            self.current_number += 1
-        self.save()
-        return f"{self.letter}{self.current_number:03d}"
+        """Next ticket for today, issued under a row lock so concurrent callers never share one."""
+        today = timezone.localdate()
+        with transaction.atomic():
+            locked = TurnNumber.objects.select_for_update().get(pk=self.pk)
+            if locked.last_reset != today:
+                locked.current_number = 1
+                locked.last_reset = today
+            else:
+                locked.current_number += 1
+            locked.save(update_fields=['current_number', 'last_reset'])
+        self.current_number, self.last_reset, self.letter = locked.current_number, locked.last_reset, locked.letter
+        return self.format_turn(self.current_number)
+
+    def format_turn(self, number):
+        return f"{self.letter}{number:03d}"
 
 
 class CallTurnView(APIView):
@@ -280,6 +373,11 @@ class LabRegistration(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     repeat_count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'service'], name='labreg_patient_service_idx'),
+        ]
+
 
 class Visit(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='visits')
@@ -288,3 +386,137 @@ class Visit(models.Model):
 
     def __str__(self):
         return f"Visit: {self.patient} to {self.doctor} on {self.created_at}"
+
+
+class PatientBalance(models.Model):
+    """
+    Denormalized per-patient billing totals (same numbers as
+    apps.billing._BillingMath), kept current by apps.signals and rebuilt with
+    `manage.py rebuild_patient_balances`.
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='ledger')
+    doctor = models.ForeignKey(Doctor, on_delete=models.SET_NULL, null=True, blank=True, related_name='patient_balances')
+    doctor_name = models.CharField(max_length=255, null=True, blank=True)
+    consult_expected = models.BigIntegerField(default=0)
+    services_expected = models.BigIntegerField(default=0)
+    room_expected = models.BigIntegerField(default=0)
+    expected_due = models.BigIntegerField(default=0)
+    paid_consult = models.BigIntegerField(default=0)
+    paid_service = models.BigIntegerField(default=0)
+    paid_other_cash = models.BigIntegerField(default=0)
+    paid_room = models.BigIntegerField(default=0)
+    paid_total = models.BigIntegerField(default=0)
+    balance = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['balance', 'patient'], name='patientbalance_balance_idx'),
+            models.Index(fields=['doctor', 'balance', 'patient'], name='patientbalance_doctor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id}: {self.balance}"
+
+
+class DailyRevenue(models.Model):
+    """
+    Per-day money rollup fed by CashRegister, TreatmentPayment and Outcome
+    (see apps.revenue). Rows are additive: readers always Sum() over them.
+
+    ``transaction_type`` holds the CashRegister transaction type, the
+    TreatmentPayment status or the Outcome category depending on ``kind``.
+    ``cash_service`` rows come from CashRegisterLine (``label`` = line name)
+    and overlap the matching ``cash`` row, so never add the two kinds up; on
+    ``cash`` rows ``label`` is the room name from "Room Payment:" notes.
+
+    ``key`` is a digest of the whole rollup key (apps.revenue.key_digest). It
+    is unique where the nullable doctor/room/service columns cannot be, so two
+    first writes for the same key cannot both insert.
+    """
+    KIND_CHOICES = [
+        ('cash', 'Kassa'),
+        ('cash_service', 'Kassa (xizmat bo‘yicha)'),
+        ('room_payment', 'Xona to‘lovi'),
+        ('outcome', 'Xarajat'),
+    ]
+
+    day = models.DateField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    transaction_type = models.CharField(max_length=50, blank=True, default='')
+    payment_method = models.CharField(max_length=20, blank=True, default='')
+    doctor = models.ForeignKey(Doctor, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    room = models.ForeignKey(TreatmentRoom, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    label = models.CharField(max_length=255, blank=True, default='')
+    key = models.CharField(max_length=40, unique=True, editable=False)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'kind'], name='dailyrevenue_day_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.kind}/{self.transaction_type}: {self.amount}"
+
+
+class PatientArchive(models.Model):
+    """
+    One run of the patient archiver (apps.archive): the export file plus the
+    checkpoint an interrupted run resumes from.
+    """
+    STATUS_CHOICES = [
+        ('exporting', 'Exporting'),
+        ('exported', 'Exported'),
+        ('deleting', 'Deleting'),
+        ('done', 'Done'),
+    ]
+
+    cutoff = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='exporting')
+    file_path = models.CharField(max_length=500, blank=True, default='')
+    max_patient_id = models.BigIntegerField(default=0)  # export snapshot: nobody above it is deleted
+    last_deleted_id = models.BigIntegerField(default=0)
+    exported = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Archive #{self.pk} ({self.status}): {self.exported} exported, {self.deleted} deleted"
+
+
+class PrintJob(models.Model):
+    """A queued ESC/POS print (apps.printing); the API hands out its id for status polling."""
+    KIND_CHOICES = [
+        ('cash_receipt', 'Kassa cheki'),
+        ('room_receipt', 'Xona to‘lovi cheki'),
+        ('turn_ticket', 'Navbat cheki'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('printing', 'Printing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    printer = models.CharField(max_length=50)  # key of settings.PRINTERS
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    printed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='printjob_status_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"PrintJob #{self.pk} {self.kind} → {self.printer} ({self.status})"
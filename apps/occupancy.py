@@ -0,0 +1,73 @@
+# apps/occupancy.py
+"""
+Room occupancy shared by the room status / room payment endpoints and
+``TreatmentRoomSerializer``.
+
+``rooms_with_occupants`` loads every room with its active registrations and
+their patients in two queries; ``payments_by_patient`` / ``paid_totals`` add
+the occupants' TreatmentPayment rows or sums in one more.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Prefetch, Sum
+
+from apps.models import TreatmentPayment, TreatmentRegistration, TreatmentRoom
+
+ACTIVE_REGISTRATIONS_ATTR = "active_registrations"
+
+
+def active_registrations_prefetch():
+    """Prefetch for TreatmentRoom querysets; fills ``room.active_registrations``."""
+    return Prefetch(
+        "treatmentregistration_set",
+        queryset=TreatmentRegistration.objects.filter(discharged_at__isnull=True)
+        .select_related("patient")
+        .order_by("id"),
+        to_attr=ACTIVE_REGISTRATIONS_ATTR,
+    )
+
+
+def active_registrations(room):
+    """Active registrations of ``room``; uses the prefetch when present."""
+    regs = getattr(room, ACTIVE_REGISTRATIONS_ATTR, None)
+    if regs is None:
+        regs = list(
+            room.treatmentregistration_set.filter(discharged_at__isnull=True)
+            .select_related("patient")
+            .order_by("id")
+        )
+    return regs
+
+
+def rooms_with_occupants(rooms=None):
+    """Rooms (default: all, by id) with ``active_registrations`` prefetched."""
+    if rooms is None:
+        rooms = TreatmentRoom.objects.order_by("id")
+    return list(rooms.prefetch_related(active_registrations_prefetch()))
+
+
+def occupant_ids(rooms):
+    return {reg.patient_id for room in rooms for reg in active_registrations(room)}
+
+
+def payments_by_patient(patient_ids):
+    """{patient_id: [TreatmentPayment, ...]} ordered by date, in one query."""
+    out = defaultdict(list)
+    if patient_ids:
+        for payment in TreatmentPayment.objects.filter(patient_id__in=patient_ids).order_by("date", "id"):
+            out[payment.patient_id].append(payment)
+    return out
+
+
+def paid_totals(patient_ids):
+    """{patient_id: total TreatmentPayment amount}, in one query."""
+    if not patient_ids:
+        return {}
+    rows = (
+        TreatmentPayment.objects.filter(patient_id__in=patient_ids)
+        .order_by()
+        .values("patient_id")
+        .annotate(total=Sum("amount"))
+    )
+    return {row["patient_id"]: row["total"] or Decimal("0") for row in rows}
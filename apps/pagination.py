@@ -0,0 +1,79 @@
+# apps/pagination.py
+"""
+Project-wide list pagination (``REST_FRAMEWORK["DEFAULT_PAGINATION_CLASS"]``).
+
+Cursor pages in the view's own order: its queryset's ``order_by()`` (or the
+model's ``Meta.ordering``), with the primary key added as a tie-breaker when
+that order is not unique, and newest first by primary key when the view does
+not order at all. Pages stay stable while rows are being added, and a page
+deep in the list costs the same index range scan as the first one.
+``?page_size=`` picks the size up to ``settings.API_MAX_PAGE_SIZE``; a view
+may set ``cursor_ordering`` to override the order.
+
+Pages written for the old bare-array responses opt in with ``?legacy=1``:
+they get up to ``settings.API_LEGACY_PAGE_SIZE`` rows as a JSON array, and
+the neighbouring pages in a ``Link`` header (rel="next" / rel="prev"), which
+``fetchAllPages()`` (static/js/api-pages.js) follows to the end.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import pagination
+from rest_framework.response import Response
+
+
+class CursorPagination(pagination.CursorPagination):
+    ordering = "-id"
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    legacy_query_param = "legacy"
+    legacy_page_size = settings.API_LEGACY_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.legacy = request.query_params.get(self.legacy_query_param) in ("1", "true")
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, "cursor_ordering", None)
+        if ordering is not None:
+            return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return self.queryset_ordering(queryset) or (self.ordering,)
+
+    @staticmethod
+    def queryset_ordering(queryset):
+        """
+        ``queryset``'s ordering made unique with a trailing primary key, or
+        None when it has none the cursor can use (no ordering, expressions or
+        lookups across relations).
+        """
+        query = queryset.query
+        ordering = query.order_by or (queryset.model._meta.ordering if query.default_ordering else ())
+        if not ordering or not all(isinstance(f, str) and "__" not in f and f != "?" for f in ordering):
+            return None
+        ordering = tuple(ordering)
+        for field in ordering:
+            name = field.lstrip("-")
+            if name == "pk":
+                return ordering
+            try:
+                model_field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue  # an annotation
+            if model_field.primary_key or model_field.unique:
+                return ordering
+        return ordering + (("-pk",) if ordering[0].startswith("-") else ("pk",))
+
+    def get_page_size(self, request):
+        if self.legacy:
+            return self.legacy_page_size
+        return super().get_page_size(request)
+
+    def get_paginated_response(self, data):
+        if not self.legacy:
+            return super().get_paginated_response(data)
+        links = [
+            f'<{url}>; rel="{rel}"'
+            for rel, url in (("next", self.get_next_link()), ("prev", self.get_previous_link()))
+            if url
+        ]
+        return Response(data, headers={"Link": ", ".join(links)} if links else None)
@@ -0,0 +1,160 @@
+# apps/patient_search.py
+"""
+Patient lookup shared by the registration desk and the billing pages.
+
+A query is split into words: digit words match the start of
+``Patient.phone_digits`` (the national number, digits only, so "+998 (90)
+123", "8 90 123" and "90123" find the same patient); other words must each
+match the first or last name. Every word has to match somewhere.
+
+On PostgreSQL names are matched through pg_trgm GIN indexes on
+``UPPER(first_name)`` / ``UPPER(last_name)`` (migration 0017): the same
+index serves the substring match (``icontains``) and a word-similarity match
+that tolerates typos ("Karimof" finds "Karimov"). Phones are matched by
+prefix on a ``varchar_pattern_ops`` index. Other databases (SQLite in
+tests) get the substring match only.
+
+Results are ranked: exact phone, phone prefix, exact name, name prefix,
+substring, fuzzy; newest patient first among equals.
+"""
+import re
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+COUNTRY_CODE = "998"
+# the old domestic dialling prefix: "8 90 123-45-67"
+TRUNK_PREFIX = "8"
+NATIONAL_LENGTH = 9
+MIN_QUERY_LENGTH = 2
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+# shorter words have too few trigrams for similarity to mean anything
+FUZZY_MIN_LENGTH = 3
+
+_WORD = re.compile(r"[^\s,]+")
+
+
+def normalize_phone(raw):
+    """
+    Digits of ``raw`` without the country code or trunk prefix: "+998 90
+    123-45-67" and "8 90 123-45-67" -> "901234567".
+    """
+    digits = re.sub(r"\D", "", raw or "")
+    if len(digits) > NATIONAL_LENGTH and digits.startswith(COUNTRY_CODE):
+        digits = digits[len(COUNTRY_CODE):]
+    elif len(digits) == NATIONAL_LENGTH + len(TRUNK_PREFIX) and digits.startswith(TRUNK_PREFIX):
+        digits = digits[len(TRUNK_PREFIX):]
+    return digits
+
+
+def _phone_prefixes(word):
+    """
+    Stored-number prefixes a typed digit word may stand for. "99890" could be
+    the country code and 90, or a national 99 8 90…; "8890" the trunk prefix
+    and 890…, or a national 88 90…; both are tried.
+    """
+    digits = re.sub(r"\D", "", word)
+    prefixes = {digits}
+    for lead in (COUNTRY_CODE, TRUNK_PREFIX):
+        if digits.startswith(lead) and len(digits) > len(lead):
+            prefixes.add(digits[len(lead):])
+    return prefixes
+
+
+def _is_phone(word):
+    return bool(re.fullmatch(r"\+?[\d()\-]+", word))
+
+
+def _words(q):
+    """Words of ``q``; consecutive digit groups ("+998 90 123") are one phone word."""
+    words = []
+    for word in _WORD.findall(q or ""):
+        if not word.strip("+()-"):
+            continue
+        if words and _is_phone(word) and _is_phone(words[-1]):
+            words[-1] += word
+        else:
+            words.append(word)
+    return words
+
+
+def _fuzzy():
+    return connection.vendor == "postgresql"
+
+
+def _name_match(word, prefix):
+    match = Q()
+    for field in ("first_name", "last_name"):
+        match |= Q(**{f"{prefix}{field}__icontains": word})
+        if _fuzzy() and len(word) >= FUZZY_MIN_LENGTH:
+            match |= Q(TrigramWordSimilar(Upper(f"{prefix}{field}"), Value(word.upper())))
+    return match
+
+
+def _phone_match(word, prefix):
+    match = Q()
+    for digits in _phone_prefixes(word):
+        match |= Q(**{f"{prefix}phone_digits__startswith": digits})
+    return match
+
+
+def matches(q, prefix=""):
+    """
+    Q of the patients matching every word of ``q``, or None for an empty
+    query. ``prefix`` reaches Patient through a relation, e.g. "patient__".
+    """
+    words = _words(q)
+    if not words:
+        return None
+    match = Q()
+    for word in words:
+        match &= _phone_match(word, prefix) if _is_phone(word) else _name_match(word, prefix)
+    return match
+
+
+def rank(q, prefix=""):
+    """Relevance of a matching row to ``q``; higher is better."""
+    score = Value(0)
+    for word in _words(q):
+        if _is_phone(word):
+            exact = Q()
+            for digits in _phone_prefixes(word):
+                exact |= Q(**{f"{prefix}phone_digits": digits})
+            score += Case(When(exact, then=Value(60)), default=Value(50), output_field=IntegerField())
+            continue
+        for field in ("first_name", "last_name"):
+            field = f"{prefix}{field}"
+            score += Case(
+                When(**{f"{field}__iexact": word}, then=Value(30)),
+                When(**{f"{field}__istartswith": word}, then=Value(20)),
+                When(**{f"{field}__icontains": word}, then=Value(10)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+    return score
+
+
+def search(queryset, q, limit=DEFAULT_LIMIT):
+    """
+    The best ``limit`` rows of ``queryset`` (Patients) for ``q``, each with
+    its ``search_rank``. Queries shorter than MIN_QUERY_LENGTH return no
+    rows without touching the database.
+    """
+    match = matches(q)
+    if match is None or len(q.strip()) < MIN_QUERY_LENGTH:
+        return queryset.none()
+    return (
+        queryset.filter(match)
+        .annotate(search_rank=rank(q))
+        .order_by("-search_rank", "-id")[:limit]
+    )
+
+
+def parse_limit(raw, default=DEFAULT_LIMIT):
+    try:
+        return min(max(1, int(raw)), MAX_LIMIT)
+    except (TypeError, ValueError):
+        return default
@@ -4,3 +4,9 @@ from rest_framework.permissions import BasePermission
 class IsDoctor(BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.is_doctor
+
+
+class IsAdmin(BasePermission):
+    def has_permission(self, request, view):
+        user = request.user
+        return user.is_authenticated and (user.is_superuser or user.is_staff or getattr(user, "role", "") == "admin")
@@ -0,0 +1,116 @@
+# apps/printing.py
+"""
+Queued ESC/POS printing. Views call ``enqueue()`` and return the job id
+straight away; the ``run_print_job`` Celery task sends the PrintJob's receipt
+(apps.receipts) to its printer and the client polls
+``/api/v1/print-jobs/<id>/`` for the outcome.
+
+Printers are configured by role in ``settings.PRINTERS`` with a backend:
+"usb", "win32" or "fake" (escpos' Dummy; output is kept in ``FAKE_OUTPUT``).
+Each worker process keeps one open connection per printer and drops it after
+an error so the retry reconnects. The task is routed to the "printing" queue;
+run one worker for it on the machine the printers are attached to:
+
+    celery -A root worker -Q printing -c 1
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from escpos.printer import Dummy, Usb, Win32Raw
+
+from apps import receipts
+from apps.models import PrintJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 2
+MAX_RETRY_DELAY_SECONDS = 30
+# a job "printing" for longer belonged to a worker that died; requeue_print_jobs releases it
+STUCK_AFTER = timedelta(minutes=5)
+
+FAKE_OUTPUT = defaultdict(list)  # printer name -> [bytes of each printed job]
+
+_connections = {}
+
+
+def _open(name):
+    config = dict(settings.PRINTERS[name])
+    backend = config.pop("backend")
+    if backend == "usb":
+        return Usb(config["vendor_id"], config["product_id"], timeout=config.get("timeout", 0))
+    if backend == "win32":
+        return Win32Raw(config["name"])
+    if backend == "fake":
+        return Dummy()
+    raise ValueError(f"Unknown printer backend {backend!r} for {name!r}")
+
+
+def connection(name):
+    """The open device for printer ``name``, reused across jobs in this process."""
+    if name not in _connections:
+        _connections[name] = _open(name)
+    return _connections[name]
+
+
+def disconnect(name):
+    device = _connections.pop(name, None)
+    if device is not None:
+        try:
+            device.close()
+        except Exception:
+            logger.debug("Closing printer %s failed", name, exc_info=True)
+
+
+# ---- jobs
+DEFAULT_PRINTERS = {
+    "cash_receipt": "receipt",
+    "room_receipt": "receipt",
+    "turn_ticket": "turn",
+}
+
+
+def dispatch(job_id):
+    from apps.tasks import run_print_job
+
+    try:
+        run_print_job.delay(job_id)
+    except Exception:
+        # the job stays queued; requeue_print_jobs picks it up later
+        logger.exception("Could not dispatch print job %s", job_id)
+
+
+def enqueue(kind, payload, printer=None, user=None):
+    """Record a print job and hand it to the print worker once the transaction commits."""
+    job = PrintJob.objects.create(
+        kind=kind,
+        printer=printer or DEFAULT_PRINTERS[kind],
+        payload=payload,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    transaction.on_commit(lambda: dispatch(job.pk))
+    return job
+
+
+def send(job):
+    """
+    Print ``job`` on its printer in one write of its pre-compiled receipt
+    (apps.receipts). Raises on printer errors after dropping the connection.
+    """
+    data = receipts.render(job.kind, job.payload)
+    device = connection(job.printer)
+    try:
+        device._raw(data)
+    except Exception:
+        disconnect(job.printer)
+        raise
+    if isinstance(device, Dummy):
+        FAKE_OUTPUT[job.printer].append(device.output)
+        device.clear()
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY_SECONDS * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS)
@@ -0,0 +1,116 @@
+# apps/receipt_cache.py
+"""
+Rendered A4 receipts (discharge, patient billing) cached in Redis.
+
+Each entry is stamped with the versions it was rendered from: the patient's
+ledger version and the catalog version (doctors, services, rooms; owned by
+apps.catalog_cache). The receivers in apps.signals bump those after every commit that changes what a
+receipt shows, so a hit costs two Redis reads and no SQL, and a stale entry
+is simply re-rendered. Versions are read before rendering: a write that
+commits mid-render bumps past the stamp instead of being cached over.
+
+Receipts of open stays accrue by the day and carry ``valid_until``, the next
+tick of their room charge. What differs per request (who prints it, when)
+is rendered as a placeholder and filled in on every hit. Without Redis
+receipts are rendered every time.
+"""
+import json
+import logging
+from datetime import datetime, time, timedelta
+
+import redis
+from django.utils import timezone
+from django.utils.html import escape
+
+from apps import catalog_cache, redis_client
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "receipt"
+CATALOG_VERSION_KEY = catalog_cache.VERSION_KEY
+ENTRY_TTL = redis_client.CACHE_ENTRY_TTL
+
+STAFF_NAME = "[[receipt:staff_name]]"
+PRINTED_AT = "[[receipt:printed_at]]"
+
+
+def _entry_key(kind, pk):
+    return f"{PREFIX}:{kind}:{pk}"
+
+
+def _version_key(patient_id):
+    return f"{PREFIX}:v:{patient_id}"
+
+
+def _stamp(client, patient_id):
+    return client.mget(_version_key(patient_id), CATALOG_VERSION_KEY)
+
+
+def lookup(kind, pk):
+    """The cached HTML of receipt ``kind`` #``pk`` if it is still current, else None."""
+    client = redis_client.client
+    if client is None:
+        return None
+    try:
+        raw = client.get(_entry_key(kind, pk))
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if entry["valid_until"] is not None and timezone.now().timestamp() >= entry["valid_until"]:
+            return None
+        if _stamp(client, entry["patient_id"]) != entry["stamp"]:
+            return None
+    except redis.RedisError as e:
+        logger.warning("Receipt cache unavailable: %s", e)
+        return None
+    return entry["html"]
+
+
+def render(kind, pk, patient_id, build):
+    """
+    Render receipt ``kind`` #``pk`` of ``patient_id`` with ``build()``, which
+    returns ``(html, valid_until)``, and cache it.
+    """
+    client = redis_client.client
+    stamp = None
+    if client is not None:
+        try:
+            stamp = _stamp(client, patient_id)
+        except redis.RedisError as e:
+            logger.warning("Receipt cache unavailable: %s", e)
+    html, valid_until = build()
+    if stamp is not None:
+        entry = {
+            "patient_id": patient_id,
+            "stamp": stamp,
+            "valid_until": valid_until.timestamp() if valid_until else None,
+            "html": html,
+        }
+        try:
+            client.set(_entry_key(kind, pk), json.dumps(entry), ex=ENTRY_TTL)
+        except redis.RedisError as e:
+            logger.warning("Receipt cache unavailable: %s", e)
+    return html
+
+
+def fill(html, staff_name="—", printed_at=None):
+    """Substitute the per-request placeholders of a rendered receipt."""
+    printed_at = printed_at or timezone.localtime()
+    return (
+        html.replace(STAFF_NAME, escape(staff_name))
+        .replace(PRINTED_AT, printed_at.strftime("%Y-%m-%d %H:%M"))
+    )
+
+
+def next_tick(hour, tz, now=None):
+    """The next ``hour``:00 in ``tz`` after ``now``."""
+    now = timezone.localtime(now or timezone.now(), tz)
+    tick = datetime.combine(now.date(), time(hour), tzinfo=tz)
+    return tick if tick > now else tick + timedelta(days=1)
+
+
+# ---- invalidation
+def schedule_invalidate(patient_id):
+    """Outdate ``patient_id``'s cached receipts once the current transaction commits."""
+    if patient_id:
+        redis_client.schedule_bump(_version_key(patient_id))
@@ -0,0 +1,229 @@
+# apps/receipts.py
+"""
+ESC/POS receipt layouts compiled once into byte templates.
+
+A ``Layout`` is a list of ops (``Set``, ``Text``, ``Qr``, ``Cut``, ``When``).
+``compile()`` runs every static op through escpos' Dummy printer once and
+keeps the bytes; ``{field}`` placeholders in ``Text`` (with optional format
+specs) and ``Qr`` contents become slots. ``render(payload)`` only formats the
+slots and joins the parts, so a receipt costs one ``bytes.join`` and goes to
+the printer in a single write (apps.printing).
+
+Text is encoded per segment: ASCII is the same in every ESC/POS code page and
+is emitted as is; anything else goes through escpos' encoder from a fresh
+state, which selects its code page first, so segments never depend on what
+was printed before them. ``Layout.draw()`` renders op by op the old way; it is
+the reference for ``manage.py benchmark_receipts``.
+"""
+import threading
+from functools import lru_cache
+from string import Formatter
+
+from django.conf import settings
+from escpos.printer import Dummy
+
+_formatter = Formatter()
+_local = threading.local()  # one reusable Dummy per thread: building one loads the printer profile
+
+
+def _capture(call):
+    device = getattr(_local, "device", None)
+    if device is None:
+        device = _local.device = Dummy()
+    device.clear()
+    device.magic.encoding = None  # forget the code page, so the output selects its own
+    call(device)
+    return device.output
+
+
+@lru_cache(maxsize=4096)
+def encode_text(text):
+    if text.isascii():
+        return text.encode("ascii")
+    return _capture(lambda d: d.text(text))
+
+
+@lru_cache(maxsize=512)
+def qr_bytes(content, size, native=False):
+    return _capture(lambda d: d.qr(content, size=size, native=native))
+
+
+class Set:
+    def __init__(self, **style):
+        self.style = style
+
+    def compile(self):
+        return [_capture(lambda d: d.set(**self.style))]
+
+    def draw(self, device, payload):
+        device.set(**self.style)
+
+
+class Text:
+    """Text with ``str.format`` placeholders, e.g. ``"Miqdori: {amount:.2f}\\n"``."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def compile(self):
+        parts = []
+        for literal, field, spec, conversion in _formatter.parse(self.template):
+            if literal:
+                parts.append(encode_text(literal))
+            if field is not None:
+                parts.append(_field_slot(field, spec, conversion))
+        return parts
+
+    def draw(self, device, payload):
+        device.text(self.template.format(**payload))
+
+
+def _field_slot(field, spec, conversion):
+    def slot(payload):
+        value = _formatter.convert_field(payload[field], conversion)
+        return encode_text(format(value, spec))
+    return slot
+
+
+class Qr:
+    """
+    QR code of ``payload[field]``. Rasterizing it dominates the cost of a
+    receipt; with ``settings.RECEIPT_NATIVE_QR`` the printer draws it instead.
+    """
+
+    def __init__(self, field, size=3):
+        self.field = field
+        self.size = size
+
+    def compile(self):
+        native = settings.RECEIPT_NATIVE_QR
+        return [lambda payload: qr_bytes(payload[self.field], self.size, native)]
+
+    def draw(self, device, payload):
+        device.qr(payload[self.field], size=self.size, native=settings.RECEIPT_NATIVE_QR)
+
+
+class Cut:
+    def compile(self):
+        return [_capture(lambda d: d.cut())]
+
+    def draw(self, device, payload):
+        device.cut()
+
+
+class When:
+    """Ops printed only when ``payload[field]`` is truthy."""
+
+    def __init__(self, field, *ops):
+        self.field = field
+        self.layout = Layout(*ops)
+
+    def compile(self):
+        template = self.layout.compile()
+        return [lambda payload: template.render(payload) if payload.get(self.field) else b""]
+
+    def draw(self, device, payload):
+        if payload.get(self.field):
+            self.layout.draw(device, payload)
+
+
+class Template:
+    """A compiled layout: static byte strings and slot callables, in order."""
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def render(self, payload):
+        return b"".join(part if isinstance(part, bytes) else part(payload) for part in self.parts)
+
+
+class Layout:
+    def __init__(self, *ops):
+        self.ops = ops
+
+    def compile(self):
+        parts = []
+        for op in self.ops:
+            for part in op.compile():
+                if isinstance(part, bytes) and parts and isinstance(parts[-1], bytes):
+                    parts[-1] += part
+                else:
+                    parts.append(part)
+        return Template(parts)
+
+    def draw(self, device, payload):
+        for op in self.ops:
+            op.draw(device, payload)
+
+
+LAYOUTS = {
+    "cash_receipt": Layout(
+        Set(align='center', bold=True, width=2, height=2),
+        Text("Controllab\n"),
+        Set(align='center', bold=False, width=1, height=1),
+        Text("NAQD TO‘LOV CHEKI \n"),
+        Text("-------------------------------\n"),
+        Set(align='left'),
+        Text("Chek raqami: {receipt_number}\n"),
+        Text("Sana: {date}\n"),
+        Text("Bemor: {patient_name}\n"),
+        When("doctor_name", Text("Shifokor: {doctor_name}\n")),
+        Text("To‘lov turi: {transaction_type}\n"),
+        Text("Miqdori: {amount:.2f} so'm\n"),
+        Text("To‘lov usuli: {payment_method}\n"),
+        When("notes", Text("Izoh: {notes}\n")),
+        Text("-------------------------------\n"),
+        Text("Tashrifingiz uchun rahmat!\n\n\n"),
+        Cut(),
+    ),
+    "room_receipt": Layout(
+        Set(align='center', bold=True, width=2, height=2),
+        Text("🏥 NEURO PULS KLINIKASI\n\n"),
+        Set(align='left', bold=True, width=1, height=1),
+        Text("Chek raqami: {receipt_number}\n"),
+        Text("Sana      : {date}\n"),
+        Text("Bemor     : {patient_name}\n"),
+        Text("Turi      : {transaction_type}\n"),
+        Text("Miqdor    : {amount:.0f}.00 so'm\n"),
+        Text("Usul      : {payment_method}\n"),
+        Text("Qabulchi  : {processed_by}\n"),
+        When("notes", Text("Izoh      : {notes}\n")),
+        Text("-----------------------------\n"),
+        Text("Rahmat! Kuningiz yaxshi o‘tsin!\n"),
+        Text("\n\n"),
+        Qr("qr", size=6),
+        Text("\n\n\n"),
+        Cut(),
+    ),
+    "turn_ticket": Layout(
+        Set(align='center', bold=True, width=2, height=2),
+        Text("Controllab Clinic\n"),
+        Set(align='left', bold=False, width=1, height=1),
+        Text("--------------------------------\n"),
+        Text("Bemor: {patient_name}\n"),
+        Text("Shifokor: {doctor_name}\n"),
+        Text("Sana: {date}\n"),
+        Text("--------------------------------\n"),
+        Set(align='center', bold=True),
+        Text("Iltimos navbatni kuting\n\n"),
+        Set(width=8, height=8, bold=True, custom_size=True),
+        Text("{turn_number}\n\n"),
+        Qr("qr", size=10),
+        Text(" Bemor haqida ma'lumot \n"),
+        Cut(),
+    ),
+}
+
+_templates = {}
+
+
+def template(kind):
+    """The compiled template for ``kind``, built on first use."""
+    if kind not in _templates:
+        _templates[kind] = LAYOUTS[kind].compile()
+    return _templates[kind]
+
+
+def render(kind, payload):
+    """ESC/POS bytes of one ``kind`` receipt for ``payload``."""
+    return template(kind).render(payload)
@@ -0,0 +1,59 @@
+# apps/redis_client.py
+import logging
+from datetime import timedelta
+
+import redis
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- Redis: robust init + tolerate read-only replicas ----------
+def build_redis():
+    """
+    Prefer a writable REDIS_URL; fall back to CACHE_URL or CELERY_BROKER_URL.
+    Use decode_responses so .get() returns str.
+    """
+    url = getattr(settings, 'REDIS_URL', None) \
+          or getattr(settings, 'CACHE_URL', None) \
+          or getattr(settings, 'CELERY_BROKER_URL', None)
+
+    if not url:
+        logger.warning("No REDIS_URL/CACHE_URL/CELERY_BROKER_URL found; Redis features disabled.")
+        return None
+    try:
+        # short timeouts: callers fall back to the database when Redis is down
+        client = redis.Redis.from_url(url, decode_responses=True, socket_connect_timeout=2, socket_timeout=2)
+        return client
+    except Exception as e:
+        logger.error("Failed to init Redis from URL %r: %s", url, e)
+        return None
+
+
+client = build_redis()
+
+
+# ---------- version-stamped caches (apps.catalog_cache, apps.receipt_cache) ----------
+# bounds how long a cached entry can outlive a version bump lost to a Redis
+# outage, or a QuerySet.update() that bypassed the signals
+CACHE_ENTRY_TTL = timedelta(days=1)
+
+
+def bump(*keys):
+    """Increment the version ``keys``, outdating every entry stamped with them."""
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Cache invalidation failed for %s: %s", keys, e)
+
+
+def schedule_bump(*keys):
+    """``bump(*keys)`` once the current transaction commits."""
+    transaction.on_commit(lambda: bump(*keys))
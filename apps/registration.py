@@ -0,0 +1,140 @@
+# apps/registration.py
+"""
+Front-desk registration: a patient, their turn ticket, a queued appointment
+with its services and its Payment row, written in one transaction so a
+failure leaves nothing half-registered.
+
+Every entry is validated before anything is written. Doctors and services
+are looked up once per call (``id__in``) and appointment services and
+payments are inserted in bulk, so ``register_many`` registers several
+patients (a family at the desk) for about the cost of one. Tickets come from
+apps.turn_queue, which issues them atomically; a ticket issued for a
+registration that then rolls back is skipped, never reused.
+
+Errors are raised as DRF exceptions with the ``{"error": ...}`` bodies the
+registration endpoint has always returned.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from rest_framework.exceptions import NotFound, ValidationError
+
+from apps import turn_display, turn_queue
+from apps.models import Appointment, Doctor, Payment, Service, TurnNumber
+from apps.serializers import PatientSerializer
+
+PATIENT_FIELDS = ("first_name", "last_name", "phone", "address", "age")
+TURN_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+MAX_BATCH = 20
+
+
+def _int(value, error):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({"error": error})
+
+
+def _amount(data, field):
+    try:
+        return Decimal(str(data.get(field) or 0))
+    except InvalidOperation:
+        raise ValidationError({"error": f"{field} must be a number."})
+
+
+def _parse(data):
+    if not data.get("doctor_id"):
+        raise ValidationError({"error": "Doctor ID is required."})
+    patient = PatientSerializer(data={field: data.get(field) for field in PATIENT_FIELDS})
+    if not patient.is_valid():
+        raise ValidationError(patient.errors)
+    return {
+        "patient": patient,
+        "doctor_id": _int(data["doctor_id"], "Doctor ID must be a number."),
+        "service_ids": [_int(s, "Service IDs must be numbers.") for s in data.get("services") or []],
+        "reason": data.get("reason"),
+        "amount_paid": _amount(data, "amount_paid"),
+        "amount_owed": _amount(data, "amount_owed"),
+    }
+
+
+def _turn(doctor):
+    turn, created = TurnNumber.objects.get_or_create(doctor=doctor)
+    if created or not turn.letter:
+        used = set(TurnNumber.objects.exclude(letter=None).values_list("letter", flat=True))
+        letter = next((c for c in TURN_LETTERS if c not in used), None)
+        if letter is None:
+            raise ValidationError({"error": "No available letters for doctor turn codes."})
+        turn.letter = letter
+        turn.save(update_fields=["letter"])
+    return turn
+
+
+def register_many(entries):
+    """
+    Register every entry (the register-patient payload) in one transaction.
+    Returns the queued appointments in order. On an invalid entry nothing is
+    written and the error carries its ``index``.
+    """
+    parsed = []
+    for index, data in enumerate(entries):
+        try:
+            if not isinstance(data, dict):
+                raise ValidationError({"error": "Each patient must be an object."})
+            parsed.append(_parse(data))
+        except ValidationError as e:
+            e.detail = {"index": index, **e.detail}
+            raise
+
+    doctors = Doctor.objects.select_related("user").in_bulk({p["doctor_id"] for p in parsed})
+    if len(doctors) < len({p["doctor_id"] for p in parsed}):
+        raise NotFound({"error": "Doctor not found"})
+    services = Service.objects.in_bulk({s for p in parsed for s in p["service_ids"]})
+    missing = sorted({s for p in parsed for s in p["service_ids"]} - services.keys())
+    if missing:
+        raise ValidationError({"error": f"Service(s) not found: {missing}"})
+
+    appointments, service_rows, payments = [], [], []
+    Through = Appointment.services.through
+    with transaction.atomic():
+        for p in parsed:
+            doctor = doctors[p["doctor_id"]]
+            patient = p["patient"].save(patients_doctor=doctor)
+            turn = _turn(doctor)
+            try:
+                turn_code = turn_queue.next_turn(turn)
+            except Exception:
+                raise ValidationError({"error": "Failed to generate turn number."})
+            appointment = Appointment.objects.create(
+                patient=patient,
+                doctor=doctor,
+                reason=p["reason"],
+                status="queued",
+                turn_number=turn_code,
+            )
+            service_rows += [
+                Through(appointment_id=appointment.pk, service_id=s) for s in dict.fromkeys(p["service_ids"])
+            ]
+            payments.append(Payment(
+                appointment=appointment,
+                amount_paid=p["amount_paid"],
+                amount_due=p["amount_owed"],
+                status="partial" if p["amount_owed"] > 0 else "paid",
+            ))
+            appointments.append(appointment)
+        # bulk rows skip m2m_changed: the ledger/receipt refresh scheduled by
+        # each Appointment save runs after commit and sees these services
+        Through.objects.bulk_create(service_rows)
+        Payment.objects.bulk_create(payments)
+        for doctor_id in dict.fromkeys(a.doctor_id for a in appointments):
+            turn_display.broadcast("queue", doctor_id=doctor_id)
+    return appointments
+
+
+def register(data):
+    """Register one patient; returns the queued appointment."""
+    try:
+        return register_many([data])[0]
+    except ValidationError as e:
+        e.detail.pop("index", None)
+        raise
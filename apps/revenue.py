@@ -0,0 +1,222 @@
+# apps/revenue.py
+"""
+DailyRevenue rollup: keeps per-day sums of CashRegister, TreatmentPayment and
+Outcome rows so the admin/accountant dashboards cost O(days), not
+O(transactions).
+
+Inserts and deletes are applied as +/- bumps (apps.signals); edits re-derive
+the affected day. `manage.py rebuild_daily_revenue` rebuilds any range.
+Every rollup key has exactly one row (``DailyRevenue.key`` is unique): a bump
+adds onto it, or inserts it and falls back to the add when a concurrent first
+write got there first.
+"""
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.billing import UZT, filter_local_days
+from apps.models import CashRegister, CashRegisterLine, DailyRevenue, Outcome, TreatmentPayment
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NOTE_PREFIX = "Service Payment:"
+ROOM_NOTE_PREFIX = "Room Payment:"
+
+
+def local_day(dt):
+    return timezone.localtime(dt, UZT).date()
+
+
+def service_names_from_notes(notes):
+    """Service names as written into legacy notes ("Service Payment: a, b")."""
+    if notes and SERVICE_NOTE_PREFIX in notes:
+        return [name.strip() for name in notes.replace(SERVICE_NOTE_PREFIX, "").split(",")]
+    return []
+
+
+def _room_label(transaction_type, notes):
+    if transaction_type == "treatment" and notes and ROOM_NOTE_PREFIX in notes:
+        return notes.replace(ROOM_NOTE_PREFIX, "").strip()
+    return ""
+
+
+def split_amount(amount, weights):
+    """
+    Split ``amount`` across ``weights`` (e.g. service prices) in proportion,
+    to the tiyin; the last share absorbs rounding. Falls back to equal shares
+    when the weights are unusable.
+    """
+    if not weights:
+        return []
+    weights = [Decimal(w) if w is not None else None for w in weights]
+    if any(w is None or w < 0 for w in weights) or not sum(weights):
+        weights = [Decimal("1")] * len(weights)
+    total_weight = sum(weights)
+    shares = [
+        (amount * w / total_weight).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        for w in weights[:-1]
+    ]
+    shares.append(amount - sum(shares, Decimal("0")))
+    return shares
+
+
+# ---- rollup keys: (day, kind, transaction_type, payment_method, doctor_id, room_id, service_id, label)
+def _cash_entry(day, transaction_type, payment_method, doctor_id, room_id, notes, amount):
+    return (
+        (day, "cash", transaction_type or "", payment_method or "", doctor_id, room_id, None,
+         _room_label(transaction_type, notes)),
+        amount,
+    )
+
+
+def _line_entry(day, payment_method, doctor_id, service_id, name, amount):
+    return (
+        (day, "cash_service", "service", payment_method or "", doctor_id, None, service_id, name),
+        amount,
+    )
+
+
+def _entries_for(instance):
+    if isinstance(instance, CashRegister):
+        return [_cash_entry(
+            local_day(instance.created_at), instance.transaction_type, instance.payment_method,
+            instance.doctor_id, instance.room_id, instance.notes, instance.amount,
+        )]
+    if isinstance(instance, CashRegisterLine):
+        cr = instance.cash_register
+        return [_line_entry(
+            local_day(cr.created_at), cr.payment_method, cr.doctor_id,
+            instance.service_id, instance.name, instance.amount,
+        )]
+    if isinstance(instance, TreatmentPayment):
+        return [((local_day(instance.date), "room_payment", instance.status or "",
+                  instance.payment_method or "", None, None, None, ""), instance.amount)]
+    if isinstance(instance, Outcome):
+        return [((local_day(instance.created_at), "outcome", instance.category or "",
+                  instance.payment_method or "", None, None, None, ""), instance.amount)]
+    return []
+
+
+def _key_filter(key):
+    day, kind, transaction_type, payment_method, doctor_id, room_id, service_id, label = key
+    return dict(day=day, kind=kind, transaction_type=transaction_type, payment_method=payment_method,
+                doctor_id=doctor_id, room_id=room_id, service_id=service_id, label=label)
+
+
+def key_digest(key):
+    """``DailyRevenue.key`` of a rollup key tuple."""
+    day, *rest = key
+    return hashlib.sha1(json.dumps([day.isoformat(), *rest]).encode()).hexdigest()
+
+
+def _bump(key, amount, count):
+    digest = key_digest(key)
+    rows = DailyRevenue.objects.filter(key=digest)
+    if rows.update(amount=F("amount") + amount, count=F("count") + count):
+        if count < 0:
+            # the key's last source row is gone; keep dashboards free of empty entries
+            rows.filter(count__lte=0).delete()
+        return
+    try:
+        with transaction.atomic():
+            DailyRevenue.objects.create(key=digest, amount=amount, count=count, **_key_filter(key))
+    except IntegrityError:
+        # a concurrent first write for this key committed in between: add onto its row
+        rows.update(amount=F("amount") + amount, count=F("count") + count)
+
+
+def _apply(entries, sign):
+    for key, amount in entries:
+        _bump(key, (amount or Decimal("0")) * sign, sign)
+
+
+def record(instance, sign=1):
+    """Add (sign=1) or remove (sign=-1) one source row from the rollup."""
+    _apply(_entries_for(instance), sign)
+
+
+def schedule_record(instance, sign=1):
+    # keys are resolved now: on delete the parent CashRegister may be gone by commit time
+    entries = _entries_for(instance)
+    label = f"{type(instance).__name__} id={instance.pk}"
+
+    def _on_commit():
+        try:
+            with transaction.atomic():
+                _apply(entries, sign)
+        except Exception:
+            logger.exception("DailyRevenue update failed for %s", label)
+
+    transaction.on_commit(_on_commit)
+
+
+def schedule_rebuild_day(dt):
+    day = local_day(dt)
+
+    def _apply():
+        try:
+            rebuild(day, day)
+        except Exception:
+            logger.exception("DailyRevenue rebuild failed for %s", day)
+
+    transaction.on_commit(_apply)
+
+
+def rebuild(start=None, end=None, chunk_size=2000):
+    """Recompute rollup rows for local days [start, end] (open-ended when None)."""
+    totals = defaultdict(lambda: [Decimal("0"), 0])
+
+    def _add(entries):
+        for key, amount in entries:
+            acc = totals[key]
+            acc[0] += amount or Decimal("0")
+            acc[1] += 1
+
+    cash = filter_local_days(CashRegister.objects.order_by(), "created_at", start, end).values_list(
+        "created_at", "transaction_type", "payment_method", "doctor_id", "room_id", "notes", "amount",
+    )
+    for created_at, *rest in cash.iterator(chunk_size=chunk_size):
+        _add([_cash_entry(local_day(created_at), *rest)])
+
+    lines = filter_local_days(
+        CashRegisterLine.objects.order_by(), "cash_register__created_at", start, end,
+    ).values_list(
+        "cash_register__created_at", "cash_register__payment_method", "cash_register__doctor_id",
+        "service_id", "name", "amount",
+    )
+    for created_at, *rest in lines.iterator(chunk_size=chunk_size):
+        _add([_line_entry(local_day(created_at), *rest)])
+
+    room = filter_local_days(TreatmentPayment.objects.order_by(), "date", start, end).values_list(
+        "date", "status", "payment_method", "amount",
+    )
+    for date, status, method, amount in room.iterator(chunk_size=chunk_size):
+        _add([((local_day(date), "room_payment", status or "", method or "", None, None, None, ""), amount)])
+
+    outcomes = filter_local_days(Outcome.objects.order_by(), "created_at", start, end).values_list(
+        "created_at", "category", "payment_method", "amount",
+    )
+    for created_at, category, method, amount in outcomes.iterator(chunk_size=chunk_size):
+        _add([((local_day(created_at), "outcome", category or "", method or "", None, None, None, ""), amount)])
+
+    stale = DailyRevenue.objects.all()
+    if start:
+        stale = stale.filter(day__gte=start)
+    if end:
+        stale = stale.filter(day__lte=end)
+
+    with transaction.atomic():
+        stale.delete()
+        # a key bumped in since the delete is overwritten: the scan above is the truth
+        DailyRevenue.objects.bulk_create(
+            [DailyRevenue(key=key_digest(key), amount=amount, count=count, **_key_filter(key))
+             for key, (amount, count) in totals.items()],
+            batch_size=1000, update_conflicts=True, unique_fields=["key"], update_fields=["amount", "count"],
+        )
+    return len(totals)
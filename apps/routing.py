@@ -0,0 +1,8 @@
+# apps/routing.py
+from django.urls import path
+
+from apps.turn_display import TurnDisplayConsumer
+
+websocket_urlpatterns = [
+    path("ws/turn-display/", TurnDisplayConsumer.as_asgi()),
+]
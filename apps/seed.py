@@ -0,0 +1,354 @@
+# apps/seed.py
+"""
+Synthetic clinic data for reproducing production volumes locally
+(``manage.py seed_clinic``; measured by ``manage.py benchmark_endpoints``).
+
+``seed()`` adds doctors (with logins), their services, rooms, and
+``patients`` patients registered over the last ``days`` days in clinic
+hours. Each patient gets a first visit, some come back, and every visit
+brings its appointment services, Payment row and the cash register rows of
+what was paid (service rows with their lines). Some visits lead to a room
+stay: stays start the same day and end mid-day after a number of 09:00
+ticks, like the room charge; stays still open today fit the room's
+capacity, and closed ones carry the charge they accrued. Stays are paid in
+installments, lab registrations reference the services, and the accountant
+records a few outcomes a day. Today's unfinished visits are queued with real
+turn tickets and one patient per doctor is called.
+
+Rows are written with ``bulk_create`` and back-dated with ``bulk_update``,
+which skips the receivers in apps.signals, so the derived state (room
+accruals, PatientBalance ledger, DailyRevenue, turn queue mirror, catalog
+cache) is rebuilt at the end. Nothing existing is changed or deleted.
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import redis
+from django.db import transaction
+from django.utils import timezone
+
+from apps import catalog_cache, revenue, turn_queue
+from apps.billing import UZT, _stay_ticks, accrue_room_charges, refresh_patient_balances
+from apps.models import (
+    Appointment,
+    CashRegister,
+    CashRegisterLine,
+    CurrentCall,
+    Doctor,
+    LabRegistration,
+    Outcome,
+    Patient,
+    Payment,
+    Service,
+    TreatmentPayment,
+    TreatmentRegistration,
+    TreatmentRoom,
+    User,
+)
+from apps.patient_search import normalize_phone
+from apps.registration import _turn
+
+FIRST_NAMES = [
+    "Ali", "Vali", "Aziz", "Sardor", "Jasur", "Bobur", "Dilshod", "Otabek", "Sherzod", "Rustam",
+    "Nodira", "Dilnoza", "Gulnora", "Madina", "Malika", "Shahnoza", "Zarina", "Feruza", "Kamola", "Nigora",
+]
+LAST_NAMES = [
+    "Karimov", "Valiyev", "Rustamov", "Yusupov", "Aliyev", "Tursunov", "Rahimov", "Saidov", "Xolmatov",
+    "Ergashev", "Nazarov", "Qodirov", "Usmonov", "Abdullayev", "Ismoilov", "G‘ulomov", "Mirzayev",
+]
+SPECIALTIES = [
+    "Nevrolog", "Terapevt", "Kardiolog", "Pediatr", "Endokrinolog", "Jarroh", "LOR", "Okulist",
+]
+SERVICE_NAMES = [
+    "EKG", "UZI", "Umumiy qon tahlili", "Biokimyo", "MRT", "Rentgen", "EEG", "Massaj",
+    "Fizioterapiya", "Ukol", "Kapelnitsa", "Konsultatsiya (takroriy)",
+]
+OPERATOR_CODES = ["90", "91", "93", "94", "95", "97", "98", "99", "33", "88", "77"]
+OUTCOME_TITLES = {
+    "salary": ["Hamshiralar maoshi", "Shifokorlar avansi"],
+    "equipment": ["Tonometr", "Printer kartriji"],
+    "rent": ["Bino ijarasi"],
+    "supplies": ["Shprislar", "Dori-darmon", "Qo‘lqoplar"],
+    "other": ["Internet", "Tozalash xizmati"],
+}
+PAYMENT_METHODS = ["cash"] * 6 + ["card"] * 3 + ["transfer", "insurance"]
+
+CLINIC_OPENS, CLINIC_CLOSES = 8, 17
+
+
+def _money(rng, low, high, step=5000):
+    return Decimal(rng.randrange(low, high + 1, step))
+
+
+def _local(day, hour, minute=0):
+    return datetime.combine(day, time(hour, minute), tzinfo=UZT)
+
+
+class _Seeder:
+    def __init__(self, rng, now, batch_size, log):
+        self.rng = rng
+        self.now = now
+        self.today = timezone.localtime(now, UZT).date()
+        self.batch_size = batch_size
+        self.log = log
+        self.counts = {}
+
+    def create(self, model, objs):
+        created = model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(created)
+        self.log(f"{model.__name__}: {len(created)}")
+        return created
+
+    def backdate(self, model, objs, field):
+        """auto_now_add overwrote ``field`` on insert; write the generated times back."""
+        for obj in objs:
+            setattr(obj, field, obj._seed_at)
+        model.objects.bulk_update(objs, [field], batch_size=self.batch_size)
+
+    def moment(self, day, not_before=None):
+        """A random clinic-hours time on ``day``, after ``not_before`` and before now."""
+        start = _local(day, CLINIC_OPENS)
+        if not_before is not None:
+            start = max(start, not_before)
+        end = min(_local(day, CLINIC_CLOSES), self.now)
+        if end <= start:
+            return start if start <= self.now else None
+        return start + timedelta(seconds=self.rng.randrange(int((end - start).total_seconds()) or 1))
+
+    def later(self, when, minutes_low, minutes_high):
+        return min(when + timedelta(minutes=self.rng.randint(minutes_low, minutes_high)), self.now)
+
+
+def seed(*, doctors=12, services_per_doctor=6, rooms=15, patients=2000, days=180,
+         return_rate=0.3, stay_rate=0.15, lab_rate=0.3, outcomes_per_day=3,
+         random_seed=None, batch_size=2000, now=None, log=lambda message: None):
+    """Generate a clinic's worth of rows (see the module docstring); returns counts per model."""
+    rng = random.Random(random_seed)
+    s = _Seeder(rng, now or timezone.now(), batch_size, log)
+    tag = f"{s.now:%Y%m%d%H%M%S}{rng.randrange(1000):03d}"
+    first_day = s.today - timedelta(days=max(0, days - 1))
+    day_span = (s.today - first_day).days
+
+    with transaction.atomic():
+        # ---- staff and catalogs
+        users = [
+            User(email=f"seed-{tag}-doctor{i}@example.com", first_name=rng.choice(FIRST_NAMES),
+                 last_name=rng.choice(LAST_NAMES), is_active=True, is_doctor=True)
+            for i in range(doctors)
+        ]
+        cashier = User(email=f"seed-{tag}-cashier@example.com", first_name="Kassir", last_name="Seed",
+                       is_active=True, is_cashier=True)
+        for user in [*users, cashier]:
+            user.set_unusable_password()
+        users = s.create(User, users + [cashier])
+        cashier = users.pop()
+
+        doctor_rows = s.create(Doctor, [
+            Doctor(user=user, name=f"Dr {user.first_name} {user.last_name}", specialty=rng.choice(SPECIALTIES),
+                   consultation_price=_money(rng, 100000, 300000, 10000))
+            for user in users
+        ])
+        service_rows = s.create(Service, [
+            Service(name=name, price=_money(rng, 30000, 400000), doctor=doctor)
+            for doctor in doctor_rows
+            for name in rng.sample(SERVICE_NAMES, min(services_per_doctor, len(SERVICE_NAMES)))
+        ])
+        services_of = defaultdict(list)
+        for service in service_rows:
+            services_of[service.doctor_id].append(service)
+        room_rows = s.create(TreatmentRoom, [
+            TreatmentRoom(name=f"{100 * (1 + i // 10) + i % 10 + 1}-xona", capacity=rng.choice([1, 2, 2, 3, 4]),
+                          floor=1 + i // 10, price_per_day=_money(rng, 150000, 400000, 25000))
+            for i in range(rooms)
+        ])
+
+        # ---- patients, registered in time order so ids grow with created_at
+        moments = sorted(
+            m for m in (s.moment(first_day + timedelta(days=rng.randint(0, day_span))) for _ in range(patients))
+            if m is not None
+        )
+        patient_rows = []
+        for at in moments:
+            phone = f"+998 {rng.choice(OPERATOR_CODES)} {rng.randrange(10 ** 7):07d}"
+            patient = Patient(first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                              age=rng.randint(1, 90), phone=phone, phone_digits=normalize_phone(phone),
+                              address="Toshkent", patients_doctor=rng.choice(doctor_rows))
+            patient._seed_at = at
+            patient_rows.append(patient)
+        patient_rows = s.create(Patient, patient_rows)
+        s.backdate(Patient, patient_rows, "created_at")
+
+        # ---- visits: first one at registration, some patients come back
+        visits = []
+        for patient in patient_rows:
+            visits.append((patient, patient.patients_doctor, patient._seed_at + timedelta(minutes=rng.randint(1, 20))))
+            if rng.random() < return_rate:
+                day = timezone.localtime(patient._seed_at, UZT).date() + timedelta(days=rng.randint(3, 60))
+                if day <= s.today:
+                    at = s.moment(day)
+                    if at is not None:
+                        visits.append((patient, rng.choice(doctor_rows), at))
+        visits.sort(key=lambda visit: visit[2])
+
+        appointments, queued_today = [], []
+        for patient, doctor, at in visits:
+            at = min(at, s.now)
+            is_today = timezone.localtime(at, UZT).date() == s.today
+            if is_today and rng.random() < 0.6:
+                status = "queued"
+            else:
+                status = rng.choices(["done", "cancelled", "expired"], [95, 3, 2])[0]
+            appointment = Appointment(patient=patient, doctor=doctor, status=status, reason="Ko‘rik")
+            appointment._seed_at = at
+            appointments.append(appointment)
+            if status == "queued":
+                queued_today.append(appointment)
+        appointments = s.create(Appointment, appointments)
+        s.backdate(Appointment, appointments, "created_at")
+
+        Through = Appointment.services.through
+        through_rows, payments, cash_rows, cash_lines = [], [], [], []
+        for appointment in appointments:
+            picked = rng.sample(services_of[appointment.doctor_id],
+                                min(rng.choice([0, 0, 1, 1, 2, 3]), len(services_of[appointment.doctor_id])))
+            through_rows += [Through(appointment_id=appointment.pk, service_id=sv.pk) for sv in picked]
+            consult = appointment.doctor.consultation_price
+            services_total = sum((sv.price for sv in picked), Decimal(0))
+            due = consult + services_total
+            paid_in = rng.choices(["full", "consult", "none"], [75, 15, 10])[0]
+            if appointment.status in ("cancelled", "expired"):
+                paid_in = "none"
+            paid = {"full": due, "consult": consult, "none": Decimal(0)}[paid_in]
+            payment = Payment(appointment=appointment, amount_due=due, amount_paid=paid,
+                              status="paid" if paid >= due else "unpaid")
+            payment._seed_at = appointment._seed_at
+            payments.append(payment)
+            if paid_in == "none":
+                continue
+            at = s.later(appointment._seed_at, 1, 15)
+            method = rng.choice(PAYMENT_METHODS)
+            row = CashRegister(patient=appointment.patient, transaction_type="consultation", amount=consult,
+                               payment_method=method, created_by=cashier, doctor=appointment.doctor)
+            row._seed_at = at
+            cash_rows.append(row)
+            if paid_in == "full" and picked:
+                row = CashRegister(patient=appointment.patient, transaction_type="service", amount=services_total,
+                                   payment_method=method, created_by=cashier, doctor=appointment.doctor,
+                                   notes=revenue.SERVICE_NOTE_PREFIX + " " + ", ".join(sv.name for sv in picked))
+                row._seed_at = at
+                row._seed_lines = picked
+                cash_rows.append(row)
+        s.create(Through, through_rows)
+        payments = s.create(Payment, payments)
+        s.backdate(Payment, payments, "created_at")
+
+        # ---- room stays, from the first visits that lead to one
+        free = {room.pk: room.capacity for room in room_rows}
+        stays = []
+        for appointment in appointments:
+            if appointment.status != "done" or rng.random() >= stay_rate:
+                continue
+            start = s.later(appointment._seed_at, 30, 120)
+            start_day = timezone.localtime(start, UZT).date()
+            end_day = start_day + timedelta(days=rng.randint(1, 12))
+            end = _local(end_day, rng.randint(10, 15), rng.randrange(60))
+            room = rng.choice(room_rows)
+            if end > s.now:
+                open_rooms = [r for r in room_rows if free[r.pk] > 0]
+                if not open_rooms:
+                    continue  # the clinic is full: this patient was treated as an outpatient
+                room = rng.choice(open_rooms)
+                free[room.pk] -= 1
+                end = None
+            stay = TreatmentRegistration(patient=appointment.patient, room=room, appointment=appointment,
+                                         assigned_at=start, discharged_at=end)
+            if end is not None:
+                stay.total_paid = _stay_ticks(start, end) * room.price_per_day
+            stays.append(stay)
+        stays = s.create(TreatmentRegistration, stays)
+
+        room_payments = []
+        for stay in stays:
+            charge = stay.total_paid if stay.discharged_at else (
+                _stay_ticks(stay.assigned_at, s.now) * stay.room.price_per_day)
+            if not charge:
+                continue
+            share = rng.choices([Decimal(1), Decimal("0.5"), Decimal(0)], [80, 15, 5])[0]
+            installments = rng.randint(1, 3)
+            amount = (charge * share / installments).quantize(Decimal(1))
+            last = stay.discharged_at or s.now
+            for _ in range(installments if amount else 0):
+                payment = TreatmentPayment(patient=stay.patient, amount=amount,
+                                           status="paid" if share == 1 else "partial",
+                                           payment_method=rng.choice(["cash", "card"]), created_by=cashier,
+                                           notes=f"{revenue.ROOM_NOTE_PREFIX} {stay.room.name}")
+                payment._seed_at = stay.assigned_at + (last - stay.assigned_at) * rng.random()
+                room_payments.append(payment)
+        room_payments = s.create(TreatmentPayment, room_payments)
+        s.backdate(TreatmentPayment, room_payments, "date")
+
+        cash_rows = s.create(CashRegister, cash_rows)
+        s.backdate(CashRegister, cash_rows, "created_at")
+        s.create(CashRegisterLine, [
+            CashRegisterLine(cash_register=row, service=sv, name=sv.name, amount=sv.price)
+            for row in cash_rows for sv in getattr(row, "_seed_lines", ())
+        ])
+
+        # ---- lab registrations, tied to the stay when there is one
+        stay_of = {stay.appointment_id: stay for stay in stays}
+        labs = []
+        for appointment in appointments:
+            if appointment.status != "done" or rng.random() >= lab_rate:
+                continue
+            for service in rng.sample(service_rows, rng.randint(1, 3)):
+                lab = LabRegistration(patient=appointment.patient, visit=stay_of.get(appointment.pk),
+                                      service=service, status=rng.choices(["completed", "pending"], [85, 15])[0])
+                lab._seed_at = s.later(appointment._seed_at, 20, 240)
+                labs.append(lab)
+        labs = s.create(LabRegistration, labs)
+        s.backdate(LabRegistration, labs, "created_at")
+
+        # ---- the accountant's outcomes
+        outcomes = []
+        for offset in range(day_span + 1):
+            day = first_day + timedelta(days=offset)
+            for _ in range(rng.randint(0, 2 * outcomes_per_day)):
+                at = s.moment(day)
+                if at is None:
+                    continue
+                category = rng.choice(list(OUTCOME_TITLES))
+                outcome = Outcome(title=rng.choice(OUTCOME_TITLES[category]), category=category,
+                                  amount=_money(rng, 50000, 5000000, 50000),
+                                  payment_method=rng.choice(["cash", "card", "transfer"]), created_by=cashier)
+                outcome._seed_at = at
+                outcomes.append(outcome)
+        outcomes = s.create(Outcome, outcomes)
+        s.backdate(Outcome, outcomes, "created_at")
+
+        # ---- today's queue: real tickets, and the first patient of each doctor called
+        called = set()
+        for appointment in queued_today:
+            appointment.turn_number = turn_queue.next_turn(_turn(appointment.doctor))
+        Appointment.objects.bulk_update(queued_today, ["turn_number"], batch_size=batch_size)
+        calls = []
+        for appointment in queued_today:
+            if appointment.doctor_id not in called:
+                called.add(appointment.doctor_id)
+                calls.append(CurrentCall(appointment=appointment))
+        s.create(CurrentCall, calls)
+
+    # ---- derived state the signals would have kept
+    log("Accruing open stays, rebuilding balances and revenue...")
+    accrue_room_charges(now=s.now)
+    ids = [p.pk for p in patient_rows]
+    for i in range(0, len(ids), batch_size):
+        refresh_patient_balances(ids[i:i + batch_size], now=s.now)
+    revenue.rebuild(first_day, s.today)
+    try:
+        turn_queue.rebuild()
+    except redis.RedisError as e:
+        log(f"Turn queue mirror not rebuilt: {e}")
+    catalog_cache.schedule_invalidate()  # outside a transaction: bumps right away
+    return s.counts
@@ -4,7 +4,7 @@ from urllib.parse import urlparse
 import logging
 import os
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import OneToOneField, CASCADE, ForeignKey
 from django.contrib.auth import authenticate
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
@@ -24,32 +24,15 @@ from root import settings
 from apps.models import (
     User, Doctor, Patient, PatientResult, Service, TreatmentPayment,
     CashRegister, TurnNumber, Outcome, TreatmentRegistration, Appointment,
-    Payment, TreatmentRoom, LabRegistration
+    Payment, TreatmentRoom, LabRegistration, CashRegisterLine, PrintJob
 )
+from apps import occupancy, redis_client
+from apps.revenue import service_names_from_notes, split_amount
 
 logger = logging.getLogger(__name__)
 
-# ---------- Redis: robust init + tolerate read-only replicas ----------
-def _build_redis():
-    """
-    Prefer a writable REDIS_URL; fall back to CACHE_URL or CELERY_BROKER_URL.
-    Use decode_responses so .get() returns str.
-    """
-    url = getattr(settings, 'REDIS_URL', None) \
-          or getattr(settings, 'CACHE_URL', None) \
-          or getattr(settings, 'CELERY_BROKER_URL', None)
-
-    if not url:
-        logger.warning("No REDIS_URL/CACHE_URL/CELERY_BROKER_URL found; Redis features disabled.")
-        return None
-    try:
-        client = redis.Redis.from_url(url, decode_responses=True)
-        return client
-    except Exception as e:
-        logger.error("Failed to init Redis from URL %r: %s", url, e)
-        return None
-
-r = _build_redis()
+# Redis client (see apps.redis_client)
+r = redis_client.client
 
 # -------------------- Register / Login / Password --------------------
 class RegisterSerializer(serializers.ModelSerializer):
@@ -404,7 +387,8 @@ class TreatmentRoomSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_patients(self, obj):
-        active_regs = obj.treatmentregistration_set.filter(discharged_at__isnull=True).select_related('patient')
+        # list views prefetch these (apps.occupancy); a single room costs one query
+        active_regs = occupancy.active_registrations(obj)
         out = []
         for reg in active_regs:
             p = reg.patient
@@ -561,8 +545,10 @@ class CashRegisterSerializer(serializers.ModelSerializer):
             'created_at',
             'services',
             'service_ids',
-            'patient'
+            'patient',
+            'turn_number',
         ]
+        read_only_fields = ['turn_number']
 
     def get_patient_name(self, obj):
         if obj.patient:
@@ -571,10 +557,12 @@ class CashRegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         service_ids = validated_data.pop("service_ids", [])
+        services = []
         if validated_data.get('transaction_type') == 'service' and service_ids:
-            services = list(Service.objects.filter(id__in=service_ids))
-            if len(services) != len(service_ids):
+            by_id = Service.objects.in_bulk(service_ids)
+            if len(by_id) != len(set(service_ids)):
                 raise serializers.ValidationError({"service_ids": "One or more service IDs are invalid"})
+            services = [by_id[sid] for sid in dict.fromkeys(service_ids)]
             names = ", ".join(s.name for s in services)
             validated_data["notes"] = f"Service Payment: {names}"
 
@@ -582,12 +570,23 @@ class CashRegisterSerializer(serializers.ModelSerializer):
         if not patient:
             raise serializers.ValidationError({"patient": "This field is required."})
 
-        return super().create(validated_data)
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            shares = split_amount(instance.amount, [s.price for s in services])
+            for service, share in zip(services, shares):
+                # one by one so the revenue rollup sees each line (apps.signals)
+                CashRegisterLine.objects.create(
+                    cash_register=instance, service=service, name=service.name, amount=share,
+                )
+        return instance
 
     def get_services(self, obj):
-        if obj.transaction_type == 'service' and obj.notes and obj.notes.startswith("Service Payment:"):
-            names = obj.notes.replace("Service Payment:", "").strip()
-            return [name.strip() for name in names.split(",")]
+        # views prefetch "lines"; rows predating lines fall back to the notes
+        lines = obj.lines.all()
+        if lines:
+            return [line.name for line in lines]
+        if obj.transaction_type == 'service':
+            return service_names_from_notes(obj.notes)
         return []
 
 
@@ -743,6 +742,9 @@ class LabRegistrationSerializer(serializers.ModelSerializer):
         return None
 
     def get_repeat_count(self, obj):
+        # annotated as ``repeats`` by the list views (apps.views.with_repeat_count)
+        if hasattr(obj, 'repeats'):
+            return obj.repeats
         try:
             return LabRegistration.objects.filter(patient=obj.patient, service=obj.service).count()
         except Exception:
@@ -753,6 +755,11 @@ from apps.models import Patient, Appointment, TreatmentRegistration, LabRegistra
 from django.db import models
 
 class PatientArchiveSerializer(serializers.ModelSerializer):
+    """
+    Reads the relations prefetched by ``apps.views.patient_archive_queryset`` and
+    its ``payments_total`` annotation, so a page costs a fixed number of
+    queries however many patients it holds.
+    """
     appointments = serializers.SerializerMethodField()
     treatment_history = serializers.SerializerMethodField()
     total_payments = serializers.SerializerMethodField()
@@ -776,24 +783,24 @@ class PatientArchiveSerializer(serializers.ModelSerializer):
 
     def get_doctor(self, obj):
         if obj.patients_doctor:
+            user = obj.patients_doctor.user  # nullable: doctors can exist without a login
             return {
                 'id': obj.patients_doctor.id,
-                'first_name': obj.patients_doctor.user.first_name,
-                'last_name': obj.patients_doctor.user.last_name
+                'first_name': user.first_name if user else obj.patients_doctor.name,
+                'last_name': user.last_name if user else "",
             }
         return None
 
     def get_appointments(self, obj):
-        appointments = Appointment.objects.filter(patient=obj)
         return [{
             'date': appt.created_at.strftime('%Y-%m-%d %H:%M'),
             'status': appt.status,
             'doctor': appt.doctor.name if appt.doctor else None,
-        } for appt in appointments]
+        } for appt in obj.appointment_set.all()]
 
     def get_treatment_history(self, obj):
-        registrations = TreatmentRegistration.objects.filter(patient=obj).select_related('room')
-        if not registrations.exists():
+        registrations = obj.treatmentregistration_set.all()
+        if not registrations:
             return [{"room": "Noma'lum", "assigned_at": obj.created_at.strftime('%Y-%m-%d %H:%M'), "discharged_at": None, "total_paid": "0"}]
         return [{
             'room': reg.room.name if reg.room else "Noma'lum",
@@ -803,14 +810,33 @@ class PatientArchiveSerializer(serializers.ModelSerializer):
         } for reg in registrations]
 
     def get_lab_services(self, obj):
-        registrations = LabRegistration.objects.filter(patient=obj).select_related('service')
         return [{
             'service': lab.service.name,
             'price': str(lab.service.price),
             'registered_at': lab.created_at.strftime('%Y-%m-%d %H:%M'),
             'status': lab.status
-        } for lab in registrations]
+        } for lab in obj.labregistration_set.all()]
 
     def get_total_payments(self, obj):
-        total = TreatmentPayment.objects.filter(patient=obj).aggregate(total=models.Sum('amount'))['total'] or 0
-        return str(total)
+        if hasattr(obj, 'payments_total'):
+            total = obj.payments_total
+        else:
+            total = TreatmentPayment.objects.filter(patient=obj).aggregate(total=models.Sum('amount'))['total']
+        return str(total or 0)
+
+
+class PatientSearchSerializer(serializers.ModelSerializer):
+    """A lookup hit (apps.patient_search); select_related('patients_doctor')."""
+    doctor_name = serializers.CharField(source='patients_doctor.name', default=None, read_only=True)
+    rank = serializers.IntegerField(source='search_rank', read_only=True)
+
+    class Meta:
+        model = Patient
+        fields = ['id', 'first_name', 'last_name', 'phone', 'age', 'patients_doctor', 'doctor_name',
+                  'created_at', 'rank']
+
+
+class PrintJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PrintJob
+        fields = ['id', 'kind', 'printer', 'status', 'attempts', 'error', 'created_at', 'printed_at']
@@ -0,0 +1,149 @@
+# apps/signals.py
+"""
+Keep the PatientBalance ledger and the DailyRevenue rollup in step with every
+write that changes what a patient owes or has paid (including a new doctor,
+service or room price), outdate the cached receipts (apps.receipt_cache) of
+those patients and the cached catalog lists (apps.catalog_cache), and mirror
+queue/call changes into apps.turn_queue. Bulk ``QuerySet.update()`` calls
+bypass these receivers; call ``schedule_balance_refresh`` /
+``revenue.rebuild`` explicitly after those (the turn queue mirror re-derives
+itself every few minutes, and cached receipts and catalogs expire within a
+day).
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apps import catalog_cache, receipt_cache, revenue, turn_queue
+from apps.billing import patients_billed_by, schedule_balance_refresh
+from apps.models import (
+    Appointment,
+    CashRegister,
+    CashRegisterLine,
+    CurrentCall,
+    Doctor,
+    LabRegistration,
+    Outcome,
+    Patient,
+    Service,
+    TreatmentPayment,
+    TreatmentRegistration,
+    TreatmentRoom,
+    User,
+)
+
+_LEDGER_SOURCES = (Appointment, CashRegister, LabRegistration, TreatmentPayment, TreatmentRegistration)
+# priced or named on every receipt and catalog list
+_CATALOG_SOURCES = (Doctor, Service, TreatmentRoom)
+
+
+def _ledger_changed(patient_id):
+    schedule_balance_refresh(patient_id)
+    receipt_cache.schedule_invalidate(patient_id)
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, **kwargs):
+    _ledger_changed(instance.pk)
+    if not created:
+        # room lists show occupants by name
+        catalog_cache.schedule_invalidate_occupancy()
+
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, instance, **kwargs):
+    receipt_cache.schedule_invalidate(instance.pk)
+
+
+def _ledger_source_changed(sender, instance, **kwargs):
+    _ledger_changed(instance.patient_id)
+    if sender is TreatmentRegistration:
+        catalog_cache.schedule_invalidate_occupancy()
+
+
+for _model in _LEDGER_SOURCES:
+    post_save.connect(_ledger_source_changed, sender=_model, dispatch_uid=f"ledger-save-{_model.__name__}")
+    post_delete.connect(_ledger_source_changed, sender=_model, dispatch_uid=f"ledger-delete-{_model.__name__}")
+
+
+@receiver(m2m_changed, sender=Appointment.services.through)
+def appointment_services_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        _ledger_changed(instance.patient_id)
+        return
+    # service.appointment_set.add/remove(...): pk_set holds appointment ids
+    if pk_set:
+        patient_ids = Appointment.objects.filter(pk__in=pk_set).values_list("patient_id", flat=True).distinct()
+        for patient_id in patient_ids:
+            _ledger_changed(patient_id)
+
+
+def _catalog_saved(sender, instance, created, **kwargs):
+    catalog_cache.schedule_invalidate()
+    if not created:
+        # a new price or name re-prices everyone already billed with it
+        schedule_balance_refresh(*patients_billed_by(instance))
+
+
+def _catalog_deleting(sender, instance, **kwargs):
+    # pre_delete: SET_NULL and through-table cleanup send no signals, so the
+    # patients are looked up while the relations still exist
+    catalog_cache.schedule_invalidate()
+    schedule_balance_refresh(*patients_billed_by(instance))
+
+
+for _model in _CATALOG_SOURCES:
+    post_save.connect(_catalog_saved, sender=_model, dispatch_uid=f"catalog-save-{_model.__name__}")
+    pre_delete.connect(_catalog_deleting, sender=_model, dispatch_uid=f"catalog-delete-{_model.__name__}")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # a doctor's account name is shown instead of Doctor.name on receipts and
+    # in the ledger; logins (update_fields={"last_login"}) leave it alone
+    if created or (update_fields is not None and not {"first_name", "last_name"} & set(update_fields)):
+        return
+    doctor = Doctor.objects.filter(user=instance).first()
+    if doctor is not None:
+        catalog_cache.schedule_invalidate()
+        schedule_balance_refresh(*patients_billed_by(doctor))
+
+
+# ------------------------ DailyRevenue rollup ------------------------
+def _revenue_timestamp(sender, instance):
+    if sender is TreatmentPayment:
+        return instance.date
+    if sender is CashRegisterLine:
+        return instance.cash_register.created_at
+    return instance.created_at
+
+
+def _revenue_row_saved(sender, instance, created, **kwargs):
+    if created:
+        revenue.schedule_record(instance)
+    else:
+        revenue.schedule_rebuild_day(_revenue_timestamp(sender, instance))
+
+
+def _revenue_row_deleted(sender, instance, origin=None, **kwargs):
+    if sender is CashRegisterLine and isinstance(origin, CashRegister) and origin.pk == instance.cash_register_id:
+        # deleted with its receipt: the cascade loads the lines without their
+        # parent, which the rollup key reads; reuse it rather than a query per line
+        instance.cash_register = origin
+    revenue.schedule_record(instance, sign=-1)
+
+
+for _model in (CashRegister, CashRegisterLine, TreatmentPayment, Outcome):
+    post_save.connect(_revenue_row_saved, sender=_model, dispatch_uid=f"revenue-save-{_model.__name__}")
+    post_delete.connect(_revenue_row_deleted, sender=_model, dispatch_uid=f"revenue-delete-{_model.__name__}")
+
+
+# ------------------------ Turn queue mirror ------------------------
+def _turn_queue_changed(sender, instance, **kwargs):
+    turn_queue.schedule_sync(instance.pk if sender is Appointment else instance.appointment_id)
+
+
+for _model in (Appointment, CurrentCall):
+    post_save.connect(_turn_queue_changed, sender=_model, dispatch_uid=f"turnq-save-{_model.__name__}")
+    post_delete.connect(_turn_queue_changed, sender=_model, dispatch_uid=f"turnq-delete-{_model.__name__}")
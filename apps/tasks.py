@@ -12,71 +12,112 @@ def send_verification_email(email, verification_code):
     return f"Verification email sent to {email}"
 
 
-from celery import shared_task
-from django.utils import timezone
-from datetime import timedelta
-from apps.models import Patient, TreatmentRegistration, TreatmentPayment
-import pandas as pd
-from django.core.mail import EmailMessage
-import os
+import logging
+import time
+
+from apps.models import TreatmentRegistration
+
+logger = logging.getLogger(__name__)
 
 @shared_task
 def archive_old_patients_task():
-    one_year_ago = timezone.now() - timedelta(days=365)
-    patients = Patient.objects.filter(created_at__lte=one_year_ago)
+    """Export patients registered over a year ago, email the file and delete them (see apps.archive)."""
+    from apps import archive
 
-    if not patients.exists():
-        print("✅ No patients to archive.")
+    run = archive.run()
+    if run is None:
         return "No patients to archive"
+    return f"{run.exported} patients archived and emailed, {run.deleted} deleted."
 
-    df = pd.DataFrame.from_records(
-        patients.values('first_name', 'last_name', 'phone', 'address', 'created_at')
-    )
 
-    # Fix timezone-aware datetime
-    df["created_at"] = df["created_at"].apply(lambda dt: dt.replace(tzinfo=None))
+@shared_task
+def apply_daily_room_charges():
+    """Accrue room charges on open stays up to the latest 09:00 tick."""
+    from apps.billing import accrue_room_charges
+
+    started = time.monotonic()
+    updated = accrue_room_charges()
+    elapsed = time.monotonic() - started
+    logger.info("Daily room charges: %s stays updated in %.2fs", updated, elapsed)
+    return f"{updated} stays updated in {elapsed:.2f}s."
 
-    filename = f"patients_archive_{timezone.now().strftime('%Y-%m')}.xlsx"
-    filepath = os.path.join("/tmp", filename)
-    df.to_excel(filepath, index=False)
+@shared_task
+def refresh_open_stay_balances():
+    """Re-price the PatientBalance ledger for patients still in a room (room charges tick at 09:00)."""
+    from apps.billing import refresh_patient_balances
 
-    # Send email
-    email = EmailMessage(
-        subject="📁 Monthly Patient Archive",
-        body="Attached is the archive of patients registered over 1 year ago.",
-        from_email="sulaymonovabdulaziz1@gmail.com",
-        to=["sulaymonovabdulaziz1@gmail.com"],
+    patient_ids = list(
+        TreatmentRegistration.objects.filter(discharged_at__isnull=True)
+        .values_list("patient_id", flat=True).distinct()
     )
-    email.attach_file(filepath)
-    email.send()
+    updated = refresh_patient_balances(patient_ids)
+    return f"{updated} patient balances refreshed."
 
-    # Delete patients after archiving
-    patients.delete()
 
-    return f"{len(df)} patients archived and emailed."
+@shared_task
+def sweep_turn_queue():
+    """End of the clinic day: expire leftover queued appointments and stale calls."""
+    from apps import turn_display, turn_queue
 
+    expired, cleared = turn_queue.sweep()
+    turn_display.broadcast("queue")
+    return f"{expired} appointments expired, {cleared} calls cleared."
 
-@shared_task
-def apply_daily_room_charges():
-    from apps.models import TreatmentRegistration
+
+@shared_task(bind=True, max_retries=None)  # bounded by printing.MAX_ATTEMPTS
+def run_print_job(self, job_id):
+    """Print one PrintJob (apps.printing), retrying with backoff up to printing.MAX_ATTEMPTS times."""
+    from django.db.models import F
     from django.utils import timezone
+    from apps import printing
+    from apps.models import PrintJob
 
-    now = timezone.now()
-    today = now.date()
+    claimed = PrintJob.objects.filter(pk=job_id, status="queued").update(
+        status="printing", attempts=F("attempts") + 1, updated_at=timezone.now(),
+    )
+    if not claimed:
+        return f"Print job {job_id} is not queued."
+    job = PrintJob.objects.get(pk=job_id)
+    try:
+        printing.send(job)
+    except Exception as e:
+        failed = job.attempts >= printing.MAX_ATTEMPTS
+        logger.warning("Print job %s on %s failed (attempt %s): %s", job_id, job.printer, job.attempts, e)
+        PrintJob.objects.filter(pk=job_id).update(
+            status="failed" if failed else "queued", error=str(e) or type(e).__name__, updated_at=timezone.now(),
+        )
+        if failed:
+            return f"Print job {job_id} failed after {job.attempts} attempts."
+        raise self.retry(exc=e, countdown=printing.retry_delay(job.attempts))
 
-    print("🕒 Running apply_daily_room_charges task...")
+    now = timezone.now()
+    PrintJob.objects.filter(pk=job_id).update(status="done", error="", printed_at=now, updated_at=now)
+    return f"Print job {job_id} printed."
 
-    for reg in TreatmentRegistration.objects.filter(discharged_at__isnull=True).select_related("room"):
-        room = reg.room
-        if not room:
-            continue
 
-        days_since = (today - reg.assigned_at.date()).days + 1
-        expected_total = days_since * room.price_per_day
+@shared_task
+def requeue_print_jobs():
+    """
+    Dispatch print jobs again whose message was lost (broker down at enqueue, worker restart),
+    and release jobs left "printing" by a worker that died after claiming them.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from apps import printing
+    from apps.models import PrintJob
 
-        if reg.total_paid < expected_total:
-            print(f"➡️ Updating {reg.patient.first_name} {reg.patient.last_name}: {reg.total_paid} → {expected_total}")
-            reg.total_paid = expected_total
-            reg.save()
-        else:
-            print(f"✅ No update needed for {reg.patient.first_name}")
\ No newline at end of file
+    now = timezone.now()
+    stuck = PrintJob.objects.filter(status="printing", updated_at__lt=now - printing.STUCK_AFTER)
+    lost = "Print worker stopped while printing"
+    failed = stuck.filter(attempts__gte=printing.MAX_ATTEMPTS).update(status="failed", error=lost, updated_at=now)
+    released = stuck.update(status="queued", error=lost)  # old updated_at: dispatched below
+    if failed or released:
+        logger.warning("Print jobs left printing: %s requeued, %s failed", released, failed)
+    ids = list(
+        PrintJob.objects.filter(status="queued", updated_at__lt=now - timedelta(minutes=2))
+        .order_by("pk").values_list("pk", flat=True)[:100]
+    )
+    PrintJob.objects.filter(pk__in=ids).update(updated_at=now)
+    for job_id in ids:
+        printing.dispatch(job_id)
+    return f"{len(ids)} print jobs requeued."
@@ -1,3 +1,1456 @@
-from django.test import TestCase
-
-# Create your tests here.
+import io
+import json
+import random
+import re
+import unittest
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import redis
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+from escpos.printer import Dummy
+from rest_framework.mixins import ListModelMixin
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from apps import (
+    catalog_cache, metrics, patient_search, printing, receipt_cache, receipts, redis_client, registration, revenue,
+    tasks, turn_queue, views,
+)
+from apps.billing import (
+    LEDGER_FIELDS, UZT, _BillingMath, _room_charge, filter_local_days, refresh_patient_balances,
+)
+from apps.management.commands.benchmark_receipts import SAMPLES as RECEIPT_SAMPLES
+from apps.models import (
+    Appointment,
+    CashRegister,
+    CashRegisterLine,
+    CurrentCall,
+    DailyRevenue,
+    Doctor,
+    LabRegistration,
+    Outcome,
+    Patient,
+    PatientBalance,
+    Payment,
+    PrintJob,
+    ReceiptSequence,
+    Service,
+    TreatmentPayment,
+    TreatmentRegistration,
+    TreatmentRoom,
+    TurnNumber,
+    User,
+)
+from apps.pagination import CursorPagination
+from apps.serializers import CashRegisterSerializer
+from apps.seed import seed
+
+
+def local(day, hour=0, minute=0):
+    """Aware Asia/Tashkent datetime on March ``day``, 2025."""
+    return datetime(2025, 3, day, hour, minute, tzinfo=UZT)
+
+
+def api_client(**flags):
+    client = APIClient()
+    client.force_authenticate(User.objects.create(email=f"staff{User.objects.count()}@clinic.uz", **flags))
+    return client
+
+
+def run_concurrently(fn, calls, workers=8):
+    """``fn(i)`` for i in range(calls) on a thread pool; each call closes its thread's connection."""
+    def call(i):
+        try:
+            return fn(i)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    """Threads writing through their own connections, so rows must really be committed."""
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite fails concurrent writers instead of queueing them")
+
+
+def redis_or_skip(test):
+    """The shared Redis client, or skip ``test`` when Redis is not reachable."""
+    client = redis_client.client
+    try:
+        if client is None or not client.ping():
+            raise redis.RedisError("no client")
+    except redis.RedisError:
+        test.skipTest("Redis is not reachable")
+    return client
+
+
+def make_patient(name="Test", doctor=None):
+    return Patient.objects.create(first_name=name, last_name="Bemor", phone="+998901234567",
+                                  address="Toshkent", patients_doctor=doctor)
+
+
+# ------------------------ apps.billing ------------------------
+class BillingEquivalenceTests(TestCase):
+    """``compute_for_patients`` must give exactly what ``compute_for_patient`` gives."""
+
+    NOW = local(10, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog",
+                                           consultation_price=Decimal("75000.50"))
+        cls.room = TreatmentRoom.objects.create(name="1-xona", price_per_day=Decimal("100000"))
+        cls.cheap_room = TreatmentRoom.objects.create(name="2-xona", price_per_day=Decimal("55555.55"))
+
+    def stay(self, patient, start, end=None, room=None):
+        return TreatmentRegistration.objects.create(patient=patient, room=room or self.room,
+                                                    assigned_at=start, discharged_at=end)
+
+    def assertEquivalent(self, patients):
+        patients = list(patients)
+        with mock.patch("apps.billing.timezone.now", return_value=self.NOW):
+            reference = {p.pk: _BillingMath.compute_for_patient(Patient.objects.get(pk=p.pk)) for p in patients}
+        batch = _BillingMath.compute_for_patients(patients, now=self.NOW)
+        self.assertEqual(batch.keys(), reference.keys())
+        for pid, math in reference.items():
+            with self.subTest(patient=pid):
+                self.assertEqual(json.dumps(batch[pid], sort_keys=True), json.dumps(math, sort_keys=True))
+        return batch
+
+    def room_expected(self, *stays):
+        patient = make_patient(doctor=self.doctor)
+        for stay in stays:
+            self.stay(patient, *stay)
+        return self.assertEquivalent([patient])[patient.pk]["room_expected"]
+
+    def test_stay_crossing_09_00_boundaries(self):
+        # 07 10:00 is day 1; the 08 and 09 09:00 ticks add days 2 and 3
+        self.assertEqual(self.room_expected((local(7, 10), local(9, 9, 30))), 300000)
+
+    def test_discharge_exactly_at_09_00_belongs_to_previous_day(self):
+        self.assertEqual(self.room_expected((local(8, 10), local(9, 9))), 100000)
+        self.assertEqual(self.room_expected((local(8, 10), local(9, 9, 1))), 200000)
+
+    def test_discharge_before_and_after_first_09_00(self):
+        # arriving before 09:00: nothing until 09:00 is reached, one day at
+        # exactly 09:00, and the early morning counts as a day of its own past it
+        self.assertEqual(self.room_expected((local(9, 7), local(9, 8, 59))), 0)
+        self.assertEqual(self.room_expected((local(9, 7), local(9, 9))), 100000)
+        self.assertEqual(self.room_expected((local(9, 7), local(9, 17))), 200000)
+
+    def test_open_stay_is_charged_up_to_now(self):
+        # early morning of the 8th, then the 08, 09 and 10 09:00 ticks (NOW is 12:00)
+        self.assertEqual(self.room_expected((local(8, 8),)), 400000)
+
+    def test_next_stay_on_the_same_local_day_is_not_charged_twice(self):
+        # 00:10 and 00:20 local are 19:10 and 19:20 UTC of the day before
+        self.assertEqual(self.room_expected((local(8, 10), local(9, 0, 10)), (local(9, 0, 20), local(9, 10))), 200000)
+
+    def test_next_stay_after_local_midnight_is_a_new_day(self):
+        # 23:50 and 00:10 local fall on the same UTC day (18:50, 19:10 UTC) but on
+        # two local days, so the second stay keeps its first day
+        self.assertEqual(self.room_expected((local(7, 10), local(7, 23, 50)), (local(8, 0, 10), local(8, 10))), 300000)
+
+    def test_stays_without_room_and_mixed_prices(self):
+        patient = make_patient(doctor=self.doctor)
+        self.stay(patient, local(5, 10), local(6, 9, 30), room=self.cheap_room)
+        TreatmentRegistration.objects.create(patient=patient, room=None, assigned_at=local(6, 9, 30),
+                                             discharged_at=local(6, 12))
+        self.stay(patient, local(6, 12), local(8, 8))
+        self.assertEquivalent([patient])
+
+    def test_doctor_falls_back_to_latest_appointment_then_stay(self):
+        other = Doctor.objects.create(name="Aliyev", specialty="Terapevt", consultation_price=Decimal("50000"))
+        by_appointment = make_patient("Appointment")
+        earlier = Appointment.objects.create(patient=by_appointment, doctor=self.doctor)
+        Appointment.objects.create(patient=by_appointment, doctor=other)
+        Appointment.objects.filter(pk=earlier.pk).update(created_at=local(1))
+        by_stay = make_patient("Stay")
+        appointment = Appointment.objects.create(patient=by_stay, doctor=other)
+        TreatmentRegistration.objects.create(patient=by_stay, room=None, appointment=appointment)
+        batch = self.assertEquivalent([by_appointment, by_stay, make_patient("Nobody")])
+        self.assertEqual(batch[by_appointment.pk]["doctor_id"], other.pk)
+
+    def test_services_payments_and_rounding(self):
+        services = [Service.objects.create(name=f"Xizmat {i}", price=Decimal(price), doctor=self.doctor)
+                    for i, price in enumerate(("10000", "15000.25", "0.10", "0.20"))]
+        with_labs = make_patient("Lab", self.doctor)
+        for service, status in zip(services, ("pending", "Cancelled", "bekor", "completed")):
+            LabRegistration.objects.create(patient=with_labs, service=service, status=status)
+        without_labs = make_patient("Appointment", self.doctor)
+        for chosen in (services[:3], services[1:]):
+            Appointment.objects.create(patient=without_labs, doctor=self.doctor).services.set(chosen)
+        for patient in (with_labs, without_labs):
+            for kind, amount in (("consultation", "0.10"), ("service", "0.20"), ("room", "0.30"), ("other", "100")):
+                CashRegister.objects.create(patient=patient, transaction_type=kind, amount=Decimal(amount),
+                                            payment_method="cash")
+            for status, amount in (("paid", "0.25"), ("partial", "0.10"), ("unpaid", "100")):
+                TreatmentPayment.objects.create(patient=patient, status=status, amount=Decimal(amount),
+                                                payment_method="cash")
+        self.assertEquivalent([with_labs, without_labs])
+
+    def test_random_patients_across_batches(self):
+        rng = random.Random(20250310)
+        doctors = [self.doctor] + [
+            Doctor.objects.create(user=User.objects.create(email=f"d{i}@clinic.uz", first_name=rng.choice(["", "Ali"])),
+                                  name=rng.choice(["", "Dr"]), specialty="-",
+                                  consultation_price=Decimal(rng.choice(["0", "50000", "75000.50"])))
+            for i in range(3)
+        ]
+        services = [Service.objects.create(name=f"s{i}", price=Decimal(rng.choice(["10000", "15000.25", "0.10"])),
+                                           doctor=rng.choice(doctors)) for i in range(5)]
+        rooms = [self.room, self.cheap_room, TreatmentRoom.objects.create(name="Bepul", price_per_day=0)]
+        patients = []
+        for i in range(30):
+            patient = make_patient(f"P{i}", rng.choice(doctors + [None, None]))
+            appointments = [Appointment.objects.create(patient=patient, doctor=rng.choice(doctors))
+                            for _ in range(rng.randint(0, 2))]
+            for appointment in appointments:
+                appointment.services.set(rng.sample(services, rng.randint(0, 3)))
+            if rng.random() < 0.5:
+                LabRegistration.objects.create(patient=patient, service=rng.choice(services),
+                                               status=rng.choice(["pending", "Cancelled"]))
+            start = self.NOW - timedelta(minutes=rng.randint(0, 60 * 24 * 10))
+            for _ in range(rng.randint(0, 3)):
+                end = start + timedelta(minutes=rng.choice([0, 60, 60 * 24, 60 * 30])) if rng.random() < 0.7 else None
+                TreatmentRegistration.objects.create(patient=patient, room=rng.choice(rooms + [None]),
+                                                     appointment=rng.choice(appointments + [None]),
+                                                     assigned_at=start, discharged_at=end)
+                if end is None:
+                    break
+                start = end + timedelta(minutes=rng.choice([0, 5, 600]))
+            patients.append(patient)
+        with mock.patch.object(_BillingMath, "BATCH_SIZE", 7):
+            self.assertEquivalent(patients)
+
+
+class LedgerRepricingTests(TestCase):
+    """Editing a catalog price re-prices the ledger rows that use it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog", consultation_price=50000)
+        cls.service = Service.objects.create(name="MRT", price=300000, doctor=cls.doctor)
+        cls.room = TreatmentRoom.objects.create(name="1-xona", price_per_day=100000)
+        cls.patient = make_patient(doctor=cls.doctor)
+        Appointment.objects.create(patient=cls.patient, doctor=cls.doctor).services.add(cls.service)
+        TreatmentRegistration.objects.create(patient=cls.patient, room=cls.room, assigned_at=local(1, 10),
+                                             discharged_at=local(2, 10))
+        cls.bystander = make_patient("Bystander")
+        refresh_patient_balances([cls.patient.pk, cls.bystander.pk])
+
+    def assertLedgerCurrent(self):
+        expected = _BillingMath.compute_for_patients([self.patient])[self.patient.pk]
+        row = PatientBalance.objects.get(pk=self.patient.pk)
+        self.assertEqual({f: getattr(row, f) for f in LEDGER_FIELDS}, {f: expected[f] for f in LEDGER_FIELDS})
+        return row
+
+    def reprice(self, instance, **changes):
+        stale = PatientBalance.objects.get(pk=self.bystander.pk).updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            for field, value in changes.items():
+                setattr(instance, field, value)
+            instance.save()
+        self.assertEqual(PatientBalance.objects.get(pk=self.bystander.pk).updated_at, stale)
+        return self.assertLedgerCurrent()
+
+    def test_doctor_price(self):
+        self.assertEqual(self.reprice(self.doctor, consultation_price=80000).consult_expected, 80000)
+
+    def test_service_price(self):
+        self.assertEqual(self.reprice(self.service, price=350000).services_expected, 350000)
+
+    def test_room_price(self):
+        self.assertEqual(self.reprice(self.room, price_per_day=120000).room_expected, 240000)
+
+    def test_deleted_room_is_no_longer_charged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+        self.assertEqual(self.assertLedgerCurrent().room_expected, 0)
+
+
+class RoomAccrualTests(TestCase):
+    """The daily accrual task charges open stays what ``_BillingMath`` bills for them."""
+
+    NOW = local(10, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = TreatmentRoom.objects.create(name="1-xona", price_per_day=100000)
+
+    def stays(self, *spans):
+        """One patient's stays, (start, end, room) each; returns the patient and the open stay."""
+        patient = make_patient()
+        for start, end, room in spans:
+            stay = TreatmentRegistration.objects.create(patient=patient, room=room, assigned_at=start,
+                                                        discharged_at=end)
+        return patient, stay
+
+    def accrue(self):
+        with mock.patch("apps.billing.timezone.now", return_value=self.NOW):
+            return tasks.apply_daily_room_charges()
+
+    def assertAccruedAsBilled(self, patient, open_stay):
+        closed = TreatmentRegistration.objects.filter(patient=patient, room__isnull=False,
+                                                      discharged_at__isnull=False).first()
+        closed_charge = _room_charge([(closed.assigned_at, closed.discharged_at, self.room.price_per_day)], self.NOW)
+        billed = _BillingMath.compute_for_patients([patient], now=self.NOW)[patient.pk]["room_expected"]
+        open_stay.refresh_from_db()
+        self.assertEqual(float(open_stay.total_paid), billed - closed_charge)
+
+    def test_consecutive_stays(self):
+        # moved rooms on the 3rd: the 3rd is charged once
+        same_day = self.stays((local(1, 10), local(3, 14), self.room), (local(3, 16), None, self.room))
+        # a roomless stay in between does not count as the previous stay
+        roomless = self.stays((local(1, 10), local(3, 14), self.room), (local(4, 10), local(5, 8), None),
+                              (local(5, 10), None, self.room))
+        self.accrue()
+        self.assertAccruedAsBilled(*same_day)
+        self.assertAccruedAsBilled(*roomless)
+        self.assertEqual(same_day[1].total_paid, 700000)
+        self.assertEqual(roomless[1].total_paid, 600000)
+
+    def test_second_run_changes_nothing(self):
+        patient, stay = self.stays((local(1, 10), local(3, 14), self.room), (local(3, 16), None, self.room))
+        self.assertIn("1 stays updated", self.accrue())
+        self.assertIn("0 stays updated", self.accrue())
+        self.assertAccruedAsBilled(patient, stay)
+
+
+class LocalDayFilterTests(TestCase):
+    """Date filters compare the bare column so the composite indexes (migration 0012) apply."""
+
+    def test_filter_keeps_the_column_bare(self):
+        sql = str(filter_local_days(CashRegister.objects.all(), "created_at", local(1).date(), local(31).date()).query)
+        self.assertIn('"apps_cashregister"."created_at" >=', sql)
+        self.assertIn('"apps_cashregister"."created_at" <', sql)
+        for wrapped in ("cast(", "::date", "at time zone"):
+            self.assertNotIn(wrapped, sql.lower())
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "EXPLAIN output is PostgreSQL's")
+    def test_dashboard_and_queue_filters_use_the_new_indexes(self):
+        doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog")
+        room = TreatmentRoom.objects.create(name="1-xona")
+        start, end = local(1).date(), local(31).date()
+        cases = (
+            (filter_local_days(CashRegister.objects.filter(transaction_type="consultation"), "created_at", start, end),
+             "cashregister_created_type_idx"),
+            (Appointment.objects.filter(status="queued", doctor=doctor, created_at__gte=local(10)),
+             "appointment_status_doc_idx"),
+            (TreatmentRegistration.objects.filter(room=room, discharged_at__isnull=True),
+             "treatmentreg_room_disch_idx"),
+        )
+        with connection.cursor() as cursor:
+            # the test tables are nearly empty; make the planner show what it would use at scale
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for qs, index in cases:
+            with self.subTest(index=index):
+                self.assertIn(index, qs.explain())
+
+
+# ------------------------ room occupancy ------------------------
+class RoomOccupancyTests(TestCase):
+    """Room pages load rooms, occupants and payments in a fixed number of queries (apps.occupancy)."""
+
+    NOW = local(10, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="hamshira@clinic.uz")
+        cls.rooms = [TreatmentRoom.objects.create(name=f"{i}-xona", capacity=2, price_per_day=100000)
+                     for i in range(1, 4)]
+        cls.patient = make_patient("Malika")
+        TreatmentRegistration.objects.create(patient=cls.patient, room=cls.rooms[0], assigned_at=local(8, 10))
+        TreatmentPayment.objects.create(patient=cls.patient, amount=150000, status="partial", payment_method="cash")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_rooms(self, per_room):
+        for room in self.rooms:
+            for i in range(per_room):
+                patient = make_patient(f"Bemor {room.pk}-{i}")
+                TreatmentRegistration.objects.create(patient=patient, room=room, assigned_at=local(9, 10))
+                TreatmentPayment.objects.create(patient=patient, amount=50000, status="partial",
+                                                payment_method="cash")
+        # a discharged stay is not an occupant
+        TreatmentRegistration.objects.create(patient=make_patient("Ketgan"), room=self.rooms[1],
+                                             assigned_at=local(1), discharged_at=local(2))
+
+    def room_payment(self):
+        # TreatmentRoomPaymentView has no route of its own
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, self.user)
+        return views.TreatmentRoomPaymentView.as_view()(request)
+
+    def test_occupied_room_payment_summary(self):
+        # used to read reg.payments / reg.created_at and fail for any occupied room
+        with mock.patch("django.utils.timezone.now", return_value=self.NOW):
+            response = self.room_payment()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["patients"], [{
+            "patient_id": self.patient.pk, "patient_name": "Malika Bemor",
+            "amount_due": 200000, "amount_paid": 150000, "status": "partial",
+        }])
+        self.assertEqual([room["patients"] for room in response.data[1:]], [[], []])
+
+    def test_queries_do_not_grow_with_occupants(self):
+        pages = {
+            "/api/v1/room-status/": 2,
+            "/api/v1/treatment-room-payments/": 3,
+            "/api/v1/treatment-rooms/list/": 2,
+        }
+        for per_room in (0, 4):
+            self.fill_rooms(per_room)
+            with mock.patch.object(redis_client, "client", None):  # no cached room lists
+                for url, queries in pages.items():
+                    with self.assertNumQueries(queries, msg=url):
+                        self.assertEqual(self.client.get(url).status_code, 200)
+            with self.assertNumQueries(3):
+                self.room_payment()
+        occupants = self.client.get("/api/v1/room-status/").json()
+        self.assertEqual([len(room["patients"]) for room in occupants], [5, 4, 4])
+
+
+# ------------------------ DailyRevenue rollup ------------------------
+def total(qs):
+    return qs.aggregate(total=Sum("amount"))["total"] or Decimal("0")
+
+
+class DailyRevenueDashboardTests(TestCase):
+    """The three money dashboards read the rollup; they must agree with a scan of the source rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog")
+        cls.room = TreatmentRoom.objects.create(name="1-xona")
+        cls.service = Service.objects.create(name="MRT", price=300000, doctor=cls.doctor)
+        cls.patient = make_patient(doctor=cls.doctor)
+
+    def setUp(self):
+        self.client = api_client(is_staff=True)
+
+    def pay(self, transaction_type, amount, method="cash", **fields):
+        return CashRegister.objects.create(patient=self.patient, transaction_type=transaction_type, amount=amount,
+                                           payment_method=method, **fields)
+
+    def write_day(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pay("consultation", 100000, doctor=self.doctor)
+            self.pay("consultation", 50000, "card", doctor=self.doctor)
+            service = self.pay("service", 300000, doctor=self.doctor, notes="Service Payment: MRT")
+            CashRegisterLine.objects.create(cash_register=service, service=self.service, name="MRT", amount=300000)
+            self.pay("treatment", 200000, room=self.room, notes="Room Payment: 1-xona")
+            TreatmentPayment.objects.create(patient=self.patient, amount=150000, status="paid", payment_method="cash")
+            TreatmentPayment.objects.create(patient=self.patient, amount=40000, status="partial",
+                                            payment_method="card")
+            Outcome.objects.create(title="Ijara", category="rent", amount=70000, payment_method="transfer")
+        return service
+
+    def assertDashboardsMatchSources(self):
+        cash, room = CashRegister.objects.all(), TreatmentPayment.objects.all()
+        consultation, services = cash.filter(transaction_type="consultation"), cash.filter(transaction_type="service")
+        paid_room = room.filter(status="paid")
+
+        stats = self.client.get("/api/v1/admin-statistics/").json()
+        self.assertEqual(Decimal(str(stats["total_profit"])), total(cash) + total(room))
+        self.assertEqual(Decimal(str(stats["treatment_room_profit"])), total(room))
+        self.assertEqual(Decimal(str(stats["doctor_profit"])), total(consultation))
+        self.assertEqual(Decimal(str(stats["service_profit"])), total(services))
+
+        chart = self.client.get("/api/v1/admin-chart-data/").json()
+        self.assertEqual({d["name"]: Decimal(str(d["profit"])) for d in chart["doctors"]},
+                         {"Karimov": total(consultation)} if consultation.exists() else {})
+        lines = CashRegisterLine.objects.values("name").annotate(total=Sum("amount"))
+        self.assertEqual({s["name"]: Decimal(str(s["profit"])) for s in chart["services"]},
+                         {line["name"]: line["total"] for line in lines})
+        rooms = cash.filter(transaction_type="treatment")
+        self.assertEqual({r["name"]: Decimal(str(r["profit"])) for r in chart["rooms"]},
+                         {"1-xona": total(rooms)} if rooms.exists() else {})
+
+        dashboard = self.client.get("/api/v1/accounting-dashboard/").json()
+        income = total(cash) + total(paid_room)
+        self.assertEqual(Decimal(str(dashboard["total_income"])), income)
+        self.assertEqual(Decimal(str(dashboard["room_income"])), total(paid_room))
+        self.assertEqual(Decimal(str(dashboard["total_outcome"])), total(Outcome.objects.all()))
+        by_method = {}
+        for row in list(cash.values("payment_method", "amount")) + list(paid_room.values("payment_method", "amount")):
+            by_method[row["payment_method"]] = by_method.get(row["payment_method"], 0) + row["amount"]
+        self.assertEqual({m["payment_method"]: Decimal(str(m["total"])) for m in dashboard["incomes_by_method"]},
+                         by_method)
+
+    def test_dashboards_follow_inserts_edits_and_deletes(self):
+        service = self.write_day()
+        self.assertDashboardsMatchSources()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            consultation = CashRegister.objects.filter(transaction_type="consultation").first()
+            consultation.amount = 120000
+            consultation.save()
+            payment = TreatmentPayment.objects.get(status="partial")
+            payment.status = "paid"
+            payment.save()
+        self.assertDashboardsMatchSources()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            service.delete()
+            Outcome.objects.all().delete()
+            TreatmentPayment.objects.filter(status="paid").first().delete()
+        self.assertDashboardsMatchSources()
+
+    def test_second_write_of_a_key_adds_onto_its_row(self):
+        self.write_day()
+        self.write_day()
+        self.assertEqual(DailyRevenue.objects.values("key").distinct().count(), DailyRevenue.objects.count())
+        self.assertEqual(DailyRevenue.objects.get(kind="outcome").count, 2)
+        self.assertDashboardsMatchSources()
+
+    def test_rebuild_matches_the_incremental_rollup(self):
+        self.write_day()
+        with self.captureOnCommitCallbacks(execute=True):
+            CashRegister.objects.filter(transaction_type="treatment").delete()
+        rows = lambda: sorted(DailyRevenue.objects.values_list("key", "amount", "count"))
+        incremental = rows()
+        call_command("rebuild_daily_revenue", stdout=io.StringIO())
+        self.assertEqual(rows(), incremental)
+        self.assertDashboardsMatchSources()
+
+
+class DailyRevenueConcurrencyTests(ConcurrencyTestCase):
+    """First writes of one rollup key racing each other end up on a single row."""
+
+    def test_parallel_first_writes_share_one_row(self):
+        day = timezone.now()
+        run_concurrently(lambda i: revenue.record(Outcome(category="rent", amount=1000, payment_method="cash",
+                                                          created_at=day)), 200, workers=16)
+        row = DailyRevenue.objects.get()
+        self.assertEqual((row.amount, row.count), (200000, 200))
+
+
+# ------------------------ cash register lines ------------------------
+class CashRegisterLineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog")
+        cls.mrt = Service.objects.create(name="MRT", price=300000, doctor=cls.doctor)
+        cls.uzi = Service.objects.create(name="UZI", price=100000, doctor=cls.doctor)
+        cls.patient = make_patient(doctor=cls.doctor)
+
+    def pay_services(self, amount, services):
+        serializer = CashRegisterSerializer(data={
+            "patient": self.patient.pk, "transaction_type": "service", "amount": amount,
+            "payment_method": "cash", "service_ids": [s.pk for s in services],
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def parent_reads(self, queries):
+        """Queries loading a line's CashRegister by id."""
+        lookup = 'FROM "apps_cashregister" WHERE "apps_cashregister"."id" = '
+        return [q["sql"] for q in queries if lookup in q["sql"]]
+
+    def test_split_amount(self):
+        self.assertEqual(revenue.split_amount(Decimal("100"), [1, 1, 1]),
+                         [Decimal("33.33"), Decimal("33.33"), Decimal("33.34")])
+        self.assertEqual(revenue.split_amount(Decimal("400000"), [300000, 100000]), [300000, 100000])
+        # a discount is shared in proportion
+        self.assertEqual(revenue.split_amount(Decimal("200000"), [300000, 100000]), [150000, 50000])
+        # unknown or zero prices: equal shares
+        self.assertEqual(revenue.split_amount(Decimal("10"), [None, 5]), [5, 5])
+        self.assertEqual(revenue.split_amount(Decimal("10"), [0, 0, 0]),
+                         [Decimal("3.33"), Decimal("3.33"), Decimal("3.34")])
+        self.assertEqual(revenue.split_amount(Decimal("10"), []), [])
+
+    def test_payment_gets_a_line_per_service(self):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+            payment = self.pay_services("200000.01", [self.mrt, self.uzi, self.mrt])
+        lines = list(payment.lines.order_by("pk").values_list("service", "name", "amount"))
+        self.assertEqual(lines, [(self.mrt.pk, "MRT", Decimal("150000.01")), (self.uzi.pk, "UZI", Decimal("50000.00"))])
+        self.assertEqual(payment.notes, "Service Payment: MRT, UZI")
+        # the rollup keys of the lines are built from the payment in hand
+        self.assertEqual(self.parent_reads(ctx.captured_queries), [])
+        self.assertEqual(dict(DailyRevenue.objects.filter(kind="cash_service").values_list("label", "amount")),
+                         {"MRT": Decimal("150000.01"), "UZI": Decimal("50000.00")})
+
+    def test_lines_are_written_with_the_payment(self):
+        real_create = CashRegisterLine.objects.create
+
+        def create(**fields):
+            if fields["service"] == self.uzi:
+                raise IntegrityError("line rejected")
+            return real_create(**fields)
+
+        with mock.patch.object(CashRegisterLine.objects, "create", create), self.assertRaises(IntegrityError):
+            self.pay_services(400000, [self.mrt, self.uzi])
+        self.assertFalse(CashRegister.objects.exists())
+        self.assertFalse(CashRegisterLine.objects.exists())
+
+    def test_deleting_a_payment_reads_no_parent_per_line(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = self.pay_services(400000, [self.mrt, self.uzi])
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+            payment.delete()
+        self.assertEqual(self.parent_reads(ctx.captured_queries), [])
+        self.assertFalse(DailyRevenue.objects.filter(kind="cash_service").exists())
+
+    def test_backfill_from_notes(self):
+        legacy = CashRegister.objects.create(patient=self.patient, transaction_type="service", amount=200000,
+                                             payment_method="cash", doctor=self.doctor,
+                                             notes="Service Payment: MRT, UZI, Rentgen")
+        CashRegister.objects.create(patient=self.patient, transaction_type="consultation", amount=50000,
+                                    payment_method="cash", notes="Service Payment: MRT")
+        lined = self.pay_services(400000, [self.mrt, self.uzi])
+
+        out = io.StringIO()
+        call_command("backfill_cash_register_lines", "--dry-run", stdout=out)
+        self.assertIn("Would create 3 line(s) for 1 payment(s); 1 name(s)", out.getvalue())
+        self.assertFalse(legacy.lines.exists())
+
+        call_command("backfill_cash_register_lines", stdout=io.StringIO())
+        # priced services split in proportion; an unknown name weighs like them all equally
+        self.assertEqual(list(legacy.lines.order_by("pk").values_list("service", "name", "amount")),
+                         [(self.mrt.pk, "MRT", Decimal("66666.67")), (self.uzi.pk, "UZI", Decimal("66666.67")),
+                          (None, "Rentgen", Decimal("66666.66"))])
+        self.assertEqual(lined.lines.count(), 2)
+        self.assertEqual(sum(legacy.lines.values_list("amount", flat=True)), legacy.amount)
+        self.assertEqual(total(DailyRevenue.objects.filter(kind="cash_service")), Decimal("600000"))
+
+        out = io.StringIO()
+        call_command("backfill_cash_register_lines", stdout=out)
+        self.assertIn("Created 0 line(s) for 0 payment(s)", out.getvalue())
+
+
+# ------------------------ live turn display ------------------------
+class TurnDisplayStreamTests(TransactionTestCase):
+    # not a TestCase: the stream reads through channels' database_sync_to_async,
+    # which closes a connection it finds inside the test's atomic block
+    URL = "/api/v1/current-calls/stream/"
+
+    def test_wsgi_request_gets_no_stream(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+
+    async def test_asgi_request_streams_a_snapshot_first(self):
+        response = await self.async_client.get(self.URL)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b"event: snapshot\n"))
+        await events.aclose()
+
+
+class TurnNumberConcurrencyTests(ConcurrencyTestCase):
+    """Tickets issued in parallel for one doctor are unique and contiguous."""
+
+    ISSUES = 200
+
+    def setUp(self):
+        super().setUp()
+        doctor = Doctor.objects.create(name="Karimov", specialty="Nevrolog")
+        self.turn = TurnNumber.objects.create(doctor=doctor, letter="A")
+
+    def assertIssuedInParallel(self):
+        tickets = run_concurrently(lambda i: turn_queue.next_turn(TurnNumber.objects.get(pk=self.turn.pk)),
+                                   self.ISSUES)
+        self.assertTrue(all(ticket.startswith("A") for ticket in tickets))
+        self.assertEqual(sorted(int(ticket[1:]) for ticket in tickets), list(range(1, self.ISSUES + 1)))
+        self.turn.refresh_from_db()
+        self.assertEqual(self.turn.current_number, self.ISSUES)
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_database_counter(self):
+        with mock.patch.object(redis_client, "client", None):
+            self.assertIssuedInParallel()
+
+    def test_redis_counter(self):
+        client = redis_or_skip(self)
+        # keep clear of the live counters of a real doctor with the same id
+        prefix = f"test-{turn_queue.PREFIX}-{self.turn.pk}"
+        self.addCleanup(lambda: [client.delete(key) for key in client.scan_iter(f"{prefix}:*")])
+        with mock.patch.object(turn_queue, "PREFIX", prefix):
+            self.assertIssuedInParallel()
+
+
+class TurnQueueTests(TestCase):
+    URL = "/api/v1/current-calls/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Dr. Aliyev", specialty="Terapevt", consultation_price=50000)
+
+    def use_redis(self):
+        client = redis_or_skip(self)
+        # keep clear of the live mirror
+        prefix = f"test-{turn_queue.PREFIX}"
+        keys = {"PREFIX": prefix, "DOCTORS_KEY": f"{prefix}:doctors", "CALLS_KEY": f"{prefix}:calls",
+                "VERSION_KEY": f"{prefix}:version"}
+        self.addCleanup(lambda: [client.delete(key) for key in client.scan_iter(f"{prefix}:*")])
+        for name, value in keys.items():
+            patcher = mock.patch.object(turn_queue, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return client
+
+    def queue(self, name, turn, created_at=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = Appointment.objects.create(patient=make_patient(name, self.doctor), doctor=self.doctor,
+                                                     status="queued", turn_number=turn)
+        if created_at:
+            Appointment.objects.filter(pk=appointment.pk).update(created_at=created_at)
+        return appointment
+
+    def call(self, appointment):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/v1/call-turn/", {"appointment_id": appointment.pk})
+        self.assertEqual(response.status_code, 200)
+
+    def assertEtagAnswers304UntilCalled(self, queries):
+        appointment = self.queue("Malika", "A001")
+        first = self.client.get(self.URL)
+        self.assertEqual([row["turn_number"] for row in first.json()["queued"]], ["A001"])
+        with self.assertNumQueries(queries):
+            unchanged = self.client.get(self.URL, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(unchanged.status_code, 304)
+        self.call(appointment)
+        changed = self.client.get(self.URL, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+        self.assertEqual([row["turn_number"] for row in changed.json()["doctor_calls"]], ["A001"])
+        self.assertEqual(changed.json()["queued"], [])
+
+    def test_etag_from_the_redis_mirror(self):
+        self.use_redis()
+        turn_queue.rebuild()
+        # an unchanged poll is answered from the mirror's change counter alone
+        self.assertEtagAnswers304UntilCalled(queries=0)
+
+    def test_etag_without_redis(self):
+        with mock.patch.object(redis_client, "client", None):
+            # the payload is built from the database and hashed
+            self.assertEtagAnswers304UntilCalled(queries=2)
+
+    def assertSweepExpiresEarlierDays(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        stale = self.queue("Malika", "A001", created_at=yesterday)
+        called = self.queue("Lola", "A002", created_at=yesterday)
+        CurrentCall.objects.filter(pk=CurrentCall.objects.create(appointment=called).pk).update(called_at=yesterday)
+        today = self.queue("Dilnoza", "A003")
+
+        self.assertEqual(turn_queue.sweep(), (2, 1))
+        self.assertEqual(dict(Appointment.objects.values_list("pk", "status")),
+                         {stale.pk: "expired", called.pk: "expired", today.pk: "queued"})
+        self.assertFalse(CurrentCall.objects.exists())
+        payload = self.client.get(self.URL).json()
+        self.assertEqual([row["turn_number"] for row in payload["queued"]], ["A003"])
+        self.assertEqual(payload["doctor_calls"], [])
+
+    def test_sweep(self):
+        client = self.use_redis()
+        self.assertSweepExpiresEarlierDays()
+        self.assertTrue(client.exists(turn_queue._ready_key()))
+
+    def test_sweep_without_redis(self):
+        with mock.patch.object(redis_client, "client", None):
+            self.assertSweepExpiresEarlierDays()
+
+
+# ------------------------ printing ------------------------
+@override_settings(PRINTERS={"receipt": {"backend": "fake"}, "turn": {"backend": "fake"}})
+class PrintJobTests(TestCase):
+    def setUp(self):
+        printing.FAKE_OUTPUT.clear()
+        self.addCleanup(printing._connections.clear)
+
+    def enqueue(self, kind):
+        with mock.patch.object(printing, "dispatch") as dispatch, self.captureOnCommitCallbacks(execute=True):
+            job = printing.enqueue(kind, RECEIPT_SAMPLES[kind](1))
+        dispatch.assert_called_once_with(job.pk)
+        return job
+
+    def run_job(self, job):
+        from apps.tasks import run_print_job
+
+        run_print_job.apply(args=[job.pk])
+        job.refresh_from_db()
+        return job
+
+    def test_receipt_and_turn_ticket_print_on_their_printers(self):
+        for kind, printer in (("cash_receipt", "receipt"), ("turn_ticket", "turn")):
+            with self.subTest(kind=kind):
+                job = self.run_job(self.enqueue(kind))
+                self.assertEqual((job.status, job.attempts, job.error), ("done", 1, ""))
+                self.assertIsNotNone(job.printed_at)
+                self.assertEqual(printing.FAKE_OUTPUT[printer], [receipts.render(kind, job.payload)])
+
+    def test_failed_print_is_retried_on_a_new_connection(self):
+        job = self.enqueue("cash_receipt")
+        broken = mock.Mock(**{"_raw.side_effect": OSError("paper out")})
+        opened = [broken]
+        real_open = printing._open
+        with mock.patch.object(printing, "_open", lambda name: opened.pop() if opened else real_open(name)), \
+                mock.patch.object(printing, "retry_delay", return_value=0), \
+                self.assertLogs("apps.tasks", "WARNING") as logs:
+            job = self.run_job(job)
+        self.assertEqual(len(logs.records), 1)
+        broken.close.assert_called_once()
+        self.assertEqual((job.status, job.attempts), ("done", 2))
+        self.assertEqual(len(printing.FAKE_OUTPUT["receipt"]), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        job = self.enqueue("turn_ticket")
+        broken = mock.Mock(**{"_raw.side_effect": OSError("paper out")})
+        with mock.patch.object(printing, "_open", return_value=broken), \
+                mock.patch.object(printing, "retry_delay", return_value=0), \
+                self.assertLogs("apps.tasks", "WARNING"):
+            job = self.run_job(job)
+        self.assertEqual((job.status, job.attempts, job.error), ("failed", printing.MAX_ATTEMPTS, "paper out"))
+        self.assertEqual(broken._raw.call_count, printing.MAX_ATTEMPTS)
+
+    def test_duplicate_message_does_not_print_twice(self):
+        job = self.run_job(self.enqueue("cash_receipt"))
+        job = self.run_job(job)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(len(printing.FAKE_OUTPUT["receipt"]), 1)
+
+
+    def test_job_left_printing_by_a_dead_worker_is_requeued(self):
+        from apps.tasks import requeue_print_jobs, run_print_job
+
+        jobs = [self.enqueue("cash_receipt") for _ in range(3)]
+        stuck, dead, busy = jobs
+        ago = timezone.now() - printing.STUCK_AFTER - timedelta(minutes=1)
+        # claimed, then the worker died mid-print
+        PrintJob.objects.filter(pk__in=[stuck.pk, dead.pk]).update(status="printing", attempts=1, updated_at=ago)
+        PrintJob.objects.filter(pk=dead.pk).update(attempts=printing.MAX_ATTEMPTS)
+        PrintJob.objects.filter(pk=busy.pk).update(status="printing", attempts=1)
+
+        with mock.patch.object(printing, "dispatch", lambda job_id: run_print_job.apply(args=[job_id])), \
+                self.assertLogs("apps.tasks", "WARNING"):
+            self.assertEqual(requeue_print_jobs.apply().get(), "1 print jobs requeued.")
+        for job in jobs:
+            job.refresh_from_db()
+        self.assertEqual((stuck.status, stuck.attempts, stuck.error), ("done", 2, ""))
+        self.assertEqual((dead.status, dead.error), ("failed", "Print worker stopped while printing"))
+        self.assertEqual(busy.status, "printing")
+        self.assertEqual(len(printing.FAKE_OUTPUT["receipt"]), 1)
+
+class ReceiptTemplateTests(TestCase):
+    """Compiled templates print what drawing the layout op by op on the device prints."""
+
+    # ESC t n: compiled segments each select their code page, the device only on a change
+    CODE_PAGE_SELECT = re.compile(rb"\x1bt.", re.DOTALL)
+
+    def drawn(self, kind, payload):
+        device = Dummy()
+        receipts.LAYOUTS[kind].draw(device, payload)
+        return device.output
+
+    def assertSameReceipt(self, kind, payload):
+        compiled, drawn = receipts.render(kind, payload), self.drawn(kind, payload)
+        self.assertEqual(self.CODE_PAGE_SELECT.sub(b"", compiled), self.CODE_PAGE_SELECT.sub(b"", drawn))
+
+    def test_cash_receipt(self):
+        self.assertSameReceipt("cash_receipt", RECEIPT_SAMPLES["cash_receipt"](1))
+        self.assertSameReceipt("cash_receipt", {**RECEIPT_SAMPLES["cash_receipt"](2),
+                                                "doctor_name": "", "notes": "Qarz ‘to‘landi’ ✅"})
+
+    def test_turn_ticket(self):
+        for native_qr in (False, True):
+            with self.subTest(native_qr=native_qr), override_settings(RECEIPT_NATIVE_QR=native_qr):
+                receipts._templates.clear()
+                self.addCleanup(receipts._templates.clear)
+                self.assertSameReceipt("turn_ticket", RECEIPT_SAMPLES["turn_ticket"](7))
+                self.assertSameReceipt("turn_ticket", {**RECEIPT_SAMPLES["turn_ticket"](8),
+                                                       "patient_name": "G‘ulomov Ёркин"})
+
+
+# ------------------------ catalog and receipt caches ------------------------
+class CatalogCacheTests(TestCase):
+    URL = "/api/v1/doctor-list/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Dr. Aliyev", specialty="Terapevt", consultation_price=50000)
+
+    def setUp(self):
+        self.redis = redis_or_skip(self)
+        # a fresh version: nothing cached by an earlier test matches it
+        self.redis.delete(catalog_cache.VERSION_KEY, catalog_cache.OCCUPANCY_VERSION_KEY)
+        catalog_cache._local.clear()
+        self.addCleanup(catalog_cache._local.clear)
+        self.client = APIClient()
+
+    def outcomes(self):
+        return catalog_cache.stats().get("doctors", {})
+
+    def rename(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.name = name
+            self.doctor.save()
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get(self.URL)
+        hits = self.outcomes().get("local_hit", 0)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.URL)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.outcomes()["local_hit"], hits + 1)
+
+    def test_saved_doctor_outdates_the_cached_list(self):
+        self.client.get(self.URL)
+        self.rename("Dr. Karimov")
+        names = [row["name"] for row in self.client.get(self.URL).json()["results"]]
+        self.assertEqual(names, ["Dr. Karimov"])
+
+    def test_etag_answers_304_until_the_catalog_changes(self):
+        etag = self.client.get(self.URL)["ETag"]
+        unchanged = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.content, b"")
+        self.rename("Dr. Karimov")
+        changed = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+
+class ReceiptCacheTests(TestCase):
+    NOW = local(10, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="aliyev@clinic.uz", first_name="Anvar", last_name="Aliyev")
+        doctor = Doctor.objects.create(user=cls.user, name="Dr. Aliyev", specialty="Terapevt",
+                                       consultation_price=50000)
+        cls.room = TreatmentRoom.objects.create(name="1-xona", price_per_day=100000)
+        cls.patient = make_patient(doctor=doctor)
+
+    def setUp(self):
+        self.redis = redis_or_skip(self)
+        # keep clear of the receipts cached for real patients with the same ids
+        prefix = f"test-{receipt_cache.PREFIX}"
+        self.addCleanup(lambda: [self.redis.delete(key) for key in self.redis.scan_iter(f"{prefix}:*")])
+        patcher = mock.patch.object(receipt_cache, "PREFIX", prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = api_client()
+
+    def print_receipt(self, now=NOW):
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            response = self.client.get(f"/api/v1/patient-billing/{self.patient.pk}/print/")
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def cached(self, now=NOW):
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            return receipt_cache.lookup("patient-billing", self.patient.pk)
+
+    def entry(self):
+        return json.loads(self.redis.get(receipt_cache._entry_key("patient-billing", self.patient.pk)))
+
+    def test_open_stay_is_cached_until_the_next_room_charge(self):
+        TreatmentRegistration.objects.create(patient=self.patient, room=self.room, assigned_at=local(8, 10))
+        self.print_receipt()
+        self.assertEqual(self.entry()["valid_until"], local(11, 9).timestamp())
+        self.assertIsNotNone(self.cached(local(11, 8, 59)))
+        self.assertIsNone(self.cached(local(11, 9)))
+
+    def test_closed_stays_do_not_expire(self):
+        TreatmentRegistration.objects.create(patient=self.patient, room=self.room, assigned_at=local(8, 10),
+                                             discharged_at=local(9, 10))
+        self.print_receipt()
+        self.assertIsNone(self.entry()["valid_until"])
+        self.assertIsNotNone(self.cached(local(20)))
+
+    def test_ledger_change_outdates_the_receipt(self):
+        self.print_receipt()
+        self.assertIsNotNone(self.cached())
+        with self.captureOnCommitCallbacks(execute=True):
+            TreatmentPayment.objects.create(patient=self.patient, amount=100000, status="paid",
+                                            payment_method="cash")
+        self.assertIsNone(self.cached())
+
+    def test_renamed_doctor_account_outdates_receipt_and_ledger(self):
+        self.assertIn("Anvar Aliyev", self.print_receipt())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Bobur"
+            self.user.save()
+        self.assertIn("Bobur Aliyev", self.print_receipt())
+        self.assertEqual(PatientBalance.objects.get(patient=self.patient).doctor_name, "Bobur Aliyev")
+
+    def test_login_does_not_outdate_receipts(self):
+        self.print_receipt()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.last_login = self.NOW
+            self.user.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+        self.assertIsNotNone(self.cached())
+
+
+# ------------------------ metrics ------------------------
+class MetricsTests(TestCase):
+    URL = "/api/v1/metrics/"
+
+    def setUp(self):
+        # a clean slate of this process's request metrics
+        for name, value in (("_routes", defaultdict(metrics._Route)), ("_worst", deque(maxlen=3)),
+                            ("_slow_queries", deque(maxlen=metrics.SLOW_QUERY_SAMPLES))):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.admin = api_client(is_staff=True)
+
+    def test_admins_only(self):
+        self.assertIn(APIClient().get(self.URL).status_code, (401, 403))
+        self.assertEqual(api_client().get(self.URL).status_code, 403)
+        self.assertEqual(api_client().get(f"{self.URL}requests/").status_code, 403)
+        response = self.admin.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+    def test_render_counts_requests_per_route(self):
+        for _ in range(2):
+            self.admin.get("/api/v1/room-status/")
+        self.admin.get("/api/v1/patients/999999/")
+        text = metrics.render()
+        labels = 'route="api/v1/room-status/",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2\n', text)
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}} 2\n", text)
+        self.assertIn(f'http_responses_total{{{labels},status="200"}} 2\n', text)
+        self.assertIn('status="404"} 1\n', text)
+        self.assertIn("# TYPE http_request_db_queries histogram\n", text)
+        # every sample line is "<name>{<labels>} <number>"
+        for line in text.splitlines():
+            if not line.startswith("#"):
+                self.assertRegex(line, r'^[a-z_]+\{[^}]*\} -?[0-9.e+-]+$')
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_worst_requests_keep_the_newest(self):
+        for i in range(5):
+            self.admin.get("/api/v1/room-status/", {"n": i})
+        worst = metrics.recent()["worst_requests"]
+        self.assertEqual([row["path"] for row in worst],
+                         [f"/api/v1/room-status/?n={i}" for i in (4, 3, 2)])
+        self.assertEqual({row["route"] for row in worst}, {"api/v1/room-status/"})
+        # the listing is taken before its own request is recorded
+        self.assertEqual(self.admin.get(f"{self.URL}requests/").json()["worst_requests"], worst)
+
+    def test_task_runs_are_timed(self):
+        with mock.patch.object(metrics, "_task_add") as add:
+            tasks.requeue_print_jobs.apply()
+        add.assert_called_once_with(tasks.requeue_print_jobs.name, "duration", mock.ANY, "SUCCESS")
+        self.assertGreaterEqual(add.call_args.args[2], 0)
+
+
+# ------------------------ patient archive list ------------------------
+class PatientArchiveListTests(TestCase):
+    URL = "/api/v1/patients/archive/"
+    # patients + appointments + stays, rooms + lab work, services (doctors and payments are joined in)
+    QUERIES = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(user=User.objects.create(email="dr@clinic.uz", first_name="Ali"),
+                                           name="Karimov", specialty="Nevrolog")
+        cls.room = TreatmentRoom.objects.create(name="1-xona")
+        cls.service = Service.objects.create(name="MRT", price=300000, doctor=cls.doctor)
+
+    def setUp(self):
+        self.client = api_client()
+
+    def add_patients(self, count):
+        for i in range(count):
+            patient = make_patient(f"Arxiv{i}", self.doctor)
+            Appointment.objects.create(patient=patient, doctor=self.doctor)
+            TreatmentRegistration.objects.create(patient=patient, room=self.room)
+            LabRegistration.objects.create(patient=patient, service=Service.objects.create(
+                name=f"Tahlil {i}", price=50000, doctor=self.doctor))
+            TreatmentPayment.objects.create(patient=patient, amount=100000, status="paid", payment_method="cash")
+
+    def fetch(self):
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_query_count_does_not_grow_with_patients(self):
+        self.add_patients(1)
+        self.assertEqual(len(self.fetch()), 1)
+        self.add_patients(30)
+        results = self.fetch()
+        self.assertEqual(len(results), 31)
+        self.assertEqual(Decimal(results[0]["total_payments"]), 100000)
+        self.assertEqual(len(results[0]["lab_services"]), 1)
+
+    def export(self, queries=QUERIES):
+        with self.assertNumQueries(queries):
+            response = self.client.get(self.URL + "export/")
+            self.assertTrue(response.streaming)
+            return json.loads(b"".join(response.streaming_content))
+
+    def test_export_streams_the_whole_archive_in_constant_queries(self):
+        self.assertEqual(self.export(queries=1), [])
+        self.add_patients(1)
+        self.assertEqual(len(self.export()), 1)
+        self.add_patients(30)
+        exported = self.export()
+        self.assertEqual(exported[:5], self.client.get(self.URL, {"page_size": 5}).json()["results"])
+        self.assertEqual(len(exported), 31)
+
+
+class ReceiptNumberConcurrencyTests(ConcurrencyTestCase):
+    """Cashiers posting receipts at once never share a number (CashRegisterListCreateAPIView.perform_create)."""
+
+    RECEIPTS = 200
+
+    def test_parallel_receipts_get_unique_numbers(self):
+        patient = make_patient()
+        cashier = User.objects.create(email="kassa@clinic.uz", first_name="Kassa")
+
+        def post_receipt(i):
+            client = APIClient()
+            client.force_authenticate(cashier)
+            kind = "consultation" if i % 2 else "service"
+            response = client.post("/api/v1/cash-register/", {
+                "patient": patient.pk, "transaction_type": kind, "amount": 1000, "payment_method": "cash",
+            }, format="json")
+            self.assertEqual(response.status_code, 201, response.content)
+            return response.json()["turn_number"]
+
+        with mock.patch.object(printing, "dispatch"):
+            numbers = run_concurrently(post_receipt, self.RECEIPTS, workers=16)
+        self.assertEqual(len(set(numbers)), self.RECEIPTS)
+        for prefix in ("A", "B"):
+            issued = sorted(int(n[1:]) for n in numbers if n.startswith(prefix))
+            self.assertEqual(issued, list(range(1, self.RECEIPTS // 2 + 1)))
+        self.assertEqual(CashRegister.objects.values("turn_number").distinct().count(), self.RECEIPTS)
+
+
+# ------------------------ list pagination ------------------------
+def list_routes(patterns=None, prefix=""):
+    """``(route, view class)`` of every list view in the URLconf."""
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            yield from list_routes(pattern.url_patterns, prefix + str(pattern.pattern))
+            continue
+        view = getattr(pattern.callback, "cls", None)
+        if view is not None and issubclass(view, ListModelMixin):
+            yield prefix + str(pattern.pattern), view
+
+
+class ListPaginationTests(TestCase):
+    """Every list endpoint answers in bounded pages, following the view's own order."""
+
+    # one user's or one patient's rows
+    UNPAGINATED = {"UserInfoListCreateAPIView", "CashRegistrationView"}
+    PAGE = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        with mock.patch.object(redis_client, "client", None):
+            seed(doctors=2, services_per_doctor=2, rooms=3, patients=15, days=3, random_seed=21)
+        cls.patient = Appointment.objects.order_by("pk").first().patient
+        cls.doctor = LabRegistration.objects.order_by("pk").first().service.doctor
+
+    def setUp(self):
+        self.client = api_client(is_staff=True, is_superuser=True)
+        redis = mock.patch.object(redis_client, "client", None)  # no cached catalog pages
+        redis.start()
+        self.addCleanup(redis.stop)
+
+    def url(self, route):
+        route = route.replace("<int:patient_id>", str(self.patient.pk))
+        return "/" + route.replace("<int:doctor_id>", str(self.doctor.pk))
+
+    def paginated_routes(self):
+        routes = [(route, view) for route, view in list_routes() if view.__name__ not in self.UNPAGINATED]
+        self.assertGreater(len(routes), 10)
+        return routes
+
+    def test_every_list_view_pages_through_the_cursor_class(self):
+        for route, view in list_routes():
+            if view.__name__ in self.UNPAGINATED:
+                self.assertIsNone(view.pagination_class, route)
+        for route, view in self.paginated_routes():
+            with self.subTest(route):
+                self.assertTrue(issubclass(view.pagination_class, CursorPagination))
+                self.assertLessEqual(view.pagination_class.max_page_size, settings.API_MAX_PAGE_SIZE)
+                self.assertLessEqual(view.pagination_class.legacy_page_size, settings.API_LEGACY_PAGE_SIZE)
+
+    @mock.patch.object(CursorPagination, "legacy_page_size", PAGE)
+    @mock.patch.object(CursorPagination, "max_page_size", PAGE)
+    def test_every_list_endpoint_is_bounded(self):
+        for route, view in self.paginated_routes():
+            with self.subTest(route):
+                response = self.client.get(self.url(route), {"page_size": 1000})
+                self.assertEqual(response.status_code, 200)
+                ids, page = [], response.json()
+                while True:
+                    self.assertLessEqual(len(page["results"]), self.PAGE)
+                    ids += [row["id"] for row in page["results"]]
+                    if not page["next"]:
+                        break
+                    page = self.client.get(page["next"]).json()
+                self.assertEqual(len(ids), len(set(ids)))
+
+                legacy = self.client.get(self.url(route), {"legacy": 1})
+                self.assertIsInstance(legacy.json(), list)
+                self.assertLessEqual(len(legacy.json()), self.PAGE)
+                self.assertEqual('rel="next"' in legacy.get("Link", ""), len(ids) > self.PAGE)
+
+    def test_pages_follow_the_view_ordering(self):
+        ordering = CursorPagination.queryset_ordering
+        self.assertEqual(ordering(Patient.objects.order_by("-created_at", "-id")), ("-created_at", "-id"))
+        self.assertEqual(ordering(Patient.objects.order_by("-created_at")), ("-created_at", "-pk"))
+        self.assertEqual(ordering(CashRegister.objects.all()), ("-created_at", "-pk"))
+        self.assertEqual(ordering(Service.objects.order_by("name")), ("name", "pk"))
+        self.assertIsNone(ordering(Patient.objects.all()))
+        self.assertIsNone(ordering(Appointment.objects.order_by("patient__last_name")))
+
+        response = self.client.get("/api/v1/patients/archive/", {"page_size": 5}).json()
+        expected = Patient.objects.order_by("-created_at", "-id").values_list("id", flat=True)[:5]
+        self.assertEqual([row["id"] for row in response["results"]], list(expected))
+
+
+# ------------------------ front-desk registration ------------------------
+class BatchRegistrationTests(TestCase):
+    URL = "/api/v1/register-patients/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Dr. Aliyev", specialty="Terapevt", consultation_price=50000)
+        cls.other_doctor = Doctor.objects.create(name="Dr. Karimova", specialty="Pediatr", consultation_price=40000)
+        cls.services = [Service.objects.create(name=f"Tahlil {i}", price=30000, doctor=cls.doctor) for i in range(2)]
+
+    def setUp(self):
+        self.client = api_client()
+
+    def entry(self, name, doctor=None, services=(), paid=0, owed=0):
+        return {"first_name": name, "last_name": "Aliyeva", "phone": "+998901234567", "address": "Toshkent",
+                "doctor_id": (doctor or self.doctor).pk, "services": [s.pk for s in services],
+                "amount_paid": paid, "amount_owed": owed}
+
+    def assertNothingWritten(self):
+        self.assertFalse(Patient.objects.exists())
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_family_is_registered_with_services_and_payments(self):
+        response = self.client.post(self.URL, {"patients": [
+            self.entry("Malika", services=self.services, paid=60000),
+            self.entry("Lola", doctor=self.other_doctor, services=[self.services[0], self.services[0]],
+                       paid=10000, owed=20000),
+        ]}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        malika, lola = (Appointment.objects.get(pk=row["id"]) for row in response.json())
+        self.assertEqual(set(malika.services.all()), set(self.services))
+        # a service listed twice is booked once
+        self.assertEqual(list(lola.services.all()), [self.services[0]])
+        self.assertEqual((malika.payment.amount_paid, malika.payment.amount_due, malika.payment.status),
+                         (60000, 0, "paid"))
+        self.assertEqual((lola.payment.amount_paid, lola.payment.amount_due, lola.payment.status),
+                         (10000, 20000, "partial"))
+        self.assertEqual([malika.status, lola.status], ["queued", "queued"])
+        self.assertEqual([malika.patient.patients_doctor, lola.patient.patients_doctor],
+                         [self.doctor, self.other_doctor])
+
+    def test_unknown_service_rejects_the_whole_batch(self):
+        response = self.client.post(self.URL, {"patients": [
+            self.entry("Malika", services=self.services), self.entry("Lola", services=[self.services[0]]),
+        ] + [{**self.entry("Dilnoza"), "services": [self.services[0].pk, 999999]}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("999999", response.json()["error"])
+        self.assertNothingWritten()
+
+    def test_invalid_entry_is_reported_by_index(self):
+        response = self.client.post(self.URL, {"patients": [
+            self.entry("Malika"), {**self.entry("Lola"), "amount_paid": "ko'p"},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["index"], 1)
+        self.assertNothingWritten()
+
+    def test_failure_midway_rolls_back_earlier_patients(self):
+        issued = []
+
+        def next_turn(turn):
+            if issued:
+                raise redis.RedisError("turn counter lost")
+            issued.append(turn)
+            return f"{turn.letter}001"
+
+        with mock.patch.object(turn_queue, "next_turn", next_turn):
+            response = self.client.post(self.URL, {"patients": [self.entry("Malika"), self.entry("Lola")]},
+                                        format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(issued), 1)
+        self.assertNothingWritten()
+
+    def test_batch_size_is_capped(self):
+        entries = [self.entry(f"Bemor {i}") for i in range(registration.MAX_BATCH + 1)]
+        response = self.client.post(self.URL, {"patients": entries}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(registration.MAX_BATCH), response.json()["error"])
+        self.assertNothingWritten()
+
+
+# ------------------------ patient search ------------------------
+class PatientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.exact = Patient.objects.create(first_name="Karim", last_name="Aliyev", phone="+998 90 111-22-33",
+                                           address="Toshkent")
+        cls.prefix = Patient.objects.create(first_name="Karimjon", last_name="Aliyev", phone="8 90 111-22-34",
+                                            address="Toshkent")
+        cls.substring = Patient.objects.create(first_name="Abdukarim", last_name="Aliyev", phone="998901112235",
+                                               address="Toshkent")
+        cls.other = Patient.objects.create(first_name="Bobur", last_name="Karimov", phone="91 555 66 77",
+                                           address="Toshkent")
+
+    def search(self, q):
+        return [p.pk for p in patient_search.search(Patient.objects.all(), q)]
+
+    def test_normalize_phone(self):
+        for raw in ("+998 90 123-45-67", "998901234567", "8 (90) 123 45 67", "90 123 45 67", "901234567"):
+            self.assertEqual(patient_search.normalize_phone(raw), "901234567", raw)
+        # a national number that happens to start with 8 keeps it
+        self.assertEqual(patient_search.normalize_phone("88 123 45 67"), "881234567")
+        self.assertEqual(patient_search.normalize_phone(None), "")
+
+    def test_stored_numbers_are_national(self):
+        self.assertEqual([self.exact.phone_digits, self.prefix.phone_digits, self.substring.phone_digits],
+                         ["901112233", "901112234", "901112235"])
+
+    def test_phone_search_ignores_prefixes(self):
+        every = {self.exact.pk, self.prefix.pk, self.substring.pk}
+        for q in ("90111", "+998 90 111", "998 90111", "8 90 111"):
+            self.assertEqual(set(self.search(q)), every, q)
+        # the exact number first
+        self.assertEqual(self.search("8 90 111 22 33"), [self.exact.pk])
+        self.assertEqual(self.search("90111223")[0], self.substring.pk)
+
+    def test_names_rank_exact_then_prefix_then_substring(self):
+        self.assertEqual(self.search("karim"), [self.exact.pk, self.other.pk, self.prefix.pk, self.substring.pk])
+        self.assertEqual(self.search("karim aliyev"), [self.exact.pk, self.prefix.pk, self.substring.pk])
+
+    def test_short_query_runs_no_sql(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search("k"), [])
+
+    def test_without_trigrams_names_match_by_substring(self):
+        # SQLite (and any database without pg_trgm): no typo tolerance
+        with mock.patch.object(patient_search, "_fuzzy", return_value=False):
+            self.assertNotIn("SIMILAR", str(patient_search.matches("Karimof")).upper())
+            self.assertEqual(self.search("arimo"), [self.other.pk])
+            self.assertEqual(self.search("Karimof"), [])
+
+    def test_endpoint(self):
+        response = api_client().get("/api/v1/patients/search/", {"q": "karim 90", "limit": 2})
+        self.assertEqual([hit["id"] for hit in response.json()["results"]], [self.exact.pk, self.prefix.pk])
+
+
+# ------------------------ lab worklist ------------------------
+class LabRepeatCountTests(TestCase):
+    """Repeat counts come from one subquery (apps.views.with_repeat_count), not a COUNT per row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(name="Dr. Aliyev", specialty="Laborant", consultation_price=0)
+        cls.services = [Service.objects.create(name=f"Tahlil {i}", price=30000, doctor=cls.doctor) for i in range(3)]
+        cls.patients = [make_patient(f"Bemor {i}", cls.doctor) for i in range(4)]
+
+    def setUp(self):
+        self.client = api_client()
+
+    def add_history(self, rows):
+        LabRegistration.objects.bulk_create(
+            LabRegistration(patient=self.patients[i % 4], service=self.services[i % 3]) for i in range(rows)
+        )
+
+    def queries(self, request):
+        with CaptureQueriesContext(connection) as ctx:
+            response = request()
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return len(ctx), response.json()
+
+    def worklist(self):
+        return self.queries(lambda: self.client.get(f"/api/v1/services/doctor/{self.doctor.pk}/"))
+
+    def register(self):
+        return self.queries(lambda: self.client.post("/api/v1/lab-registrations/", {
+            "patient_id": self.patients[0].pk, "service_id": self.services[0].pk,
+        }, format="json"))
+
+    def test_worklist_queries_do_not_grow_with_history(self):
+        self.add_history(12)
+        few, page = self.worklist()
+        self.add_history(48)
+        many, page = self.worklist()
+        self.assertEqual(many, few)
+        self.assertEqual(len(page["results"]), 60)
+        # 60 rows over 12 (patient, service) pairs: 5 each
+        self.assertEqual({row["repeat_count"] for row in page["results"]}, {5})
+
+    def test_create_response_counts_repeats_once(self):
+        self.add_history(12)
+        few, created = self.register()
+        self.assertEqual(created["repeat_count"], 2)
+        self.add_history(48)
+        many, created = self.register()
+        self.assertEqual(many, few)
+        self.assertEqual(created["repeat_count"], 7)
+
+
+# ------------------------ unpaid patients list ------------------------
+class UnpaidPatientsDataTests(TestCase):
+    URL = "/api/v1/unpaid-patients/data/"
+
+    @classmethod
+    def setUpTestData(cls):
+        patients = Patient.objects.bulk_create(
+            Patient(first_name="Qarzdor", last_name=str(i), phone="+998901234567", address="-") for i in range(1005)
+        )
+        PatientBalance.objects.bulk_create(
+            PatientBalance(patient=p, expected_due=1000 + i % 7, balance=1000 + i % 7) for i, p in enumerate(patients)
+        )
+
+    def setUp(self):
+        self.client = api_client()
+
+    def test_cursor_pages_cover_every_row_once(self):
+        seen, cursor, counts = [], None, []
+        while True:
+            params = {"limit": 300, **({"cursor": cursor} if cursor else {})}
+            # a keyset page is one query; the first page also counts the rows
+            with self.assertNumQueries(1 if cursor else 2):
+                data = self.client.get(self.URL, params).json()
+            self.assertLessEqual(len(data["results"]), 300)
+            seen += [row["id"] for row in data["results"]]
+            counts.append(data["count"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(counts, [1005, None, None, None])
+        self.assertEqual(sorted(seen), sorted(PatientBalance.objects.values_list("patient_id", flat=True)))
+
+    def test_limit_is_capped(self):
+        for params in ({"limit": 5000}, {"limit": 5000, "legacy": 1}):
+            with self.subTest(**params):
+                capped = self.client.get(self.URL, params).json()
+                self.assertEqual(len(capped["results"]), 1000)
+                self.assertIsNotNone(capped["next_cursor"])
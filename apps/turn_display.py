@@ -0,0 +1,162 @@
+# apps/turn_display.py
+"""
+Live turn display: lobby screens and doctor pages subscribe once instead of
+polling ``/api/v1/current-calls/``.
+
+Views call ``broadcast()`` after a call, clear or queue change; on commit the
+current-calls snapshot (apps.turn_queue's Redis mirror, or SQL without Redis)
+is built once and pushed to the ``turn-display`` channel-layer group. Clients
+receive it over the WebSocket consumer (``/ws/turn-display/``, see
+apps.routing) or the Server-Sent Events fallback
+(``/api/v1/current-calls/stream/``). Both need the ASGI app in root.asgi
+(daphne, also behind ``runserver``); under WSGI the stream answers 204 and
+displays fall back to polling.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from apps import turn_queue
+from apps.models import Appointment, CurrentCall
+
+logger = logging.getLogger(__name__)
+
+GROUP = "turn-display"
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def current_calls():
+    """Payload of CurrentCallsView: called turns split by prefix, plus the waiting queue."""
+    live = turn_queue.snapshot()
+    return live if live is not None else current_calls_from_db()
+
+
+def current_calls_from_db():
+    day_start = turn_queue.queue_day_start()
+    doctor_calls = []
+    service_calls = []
+    queued = []
+
+    calls = (
+        CurrentCall.objects.filter(called_at__gte=day_start)
+        .select_related('appointment__patient').order_by('id')
+    )
+    for call in calls:
+        appointment = call.appointment
+        patient = appointment.patient
+        turn = getattr(appointment, "turn_number", None)
+        if not turn:
+            continue
+        entry = {
+            "id": appointment.id,
+            "turn_number": turn,
+            "patient_name": f"{patient.first_name} {patient.last_name}"
+        }
+        if turn.startswith("A"):
+            doctor_calls.append(entry)
+        elif turn.startswith("B"):
+            service_calls.append(entry)
+
+    # today's queue only; stale calls from earlier days do not hide anyone
+    called_today = Q(currentcall__isnull=False, currentcall__called_at__gte=day_start)
+    queued_apps = (
+        Appointment.objects.filter(status="queued", created_at__gte=day_start).exclude(called_today)
+        .exclude(turn_number__isnull=True).exclude(turn_number="")
+        .select_related("patient").order_by("id")
+    )
+
+    for app in queued_apps:
+        queued.append({
+            "turn_number": app.turn_number,
+            "patient_name": f"{app.patient.first_name} {app.patient.last_name}"
+        })
+
+    return {
+        "doctor_calls": doctor_calls,
+        "service_calls": service_calls,
+        "queued": queued
+    }
+
+
+def _message(event, data, doctor_id=None):
+    return {"type": "turn.event", "event": event, "doctor_id": doctor_id, "data": data}
+
+
+def broadcast(event, doctor_id=None):
+    """
+    Push ``event`` ("call", "clear" or "queue") with a fresh snapshot to every
+    subscriber once the current transaction commits. Never raises: a missing
+    or unreachable channel layer only costs the live update.
+    """
+    def _send():
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        try:
+            async_to_sync(layer.group_send)(GROUP, _message(event, current_calls(), doctor_id))
+        except Exception:
+            logger.exception("Turn display broadcast failed (%s)", event)
+
+    transaction.on_commit(_send)
+
+
+class TurnDisplayConsumer(AsyncJsonWebsocketConsumer):
+    """Sends a snapshot on connect, then every broadcast event."""
+
+    async def connect(self):
+        await self.channel_layer.group_add(GROUP, self.channel_name)
+        await self.accept()
+        await self.send_json({"event": "snapshot", "doctor_id": None,
+                              "data": await database_sync_to_async(current_calls)()})
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(GROUP, self.channel_name)
+
+    async def turn_event(self, message):
+        await self.send_json({k: message[k] for k in ("event", "doctor_id", "data")})
+
+
+def _sse(message):
+    return f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+
+
+async def _sse_stream():
+    layer = get_channel_layer()
+    channel = await layer.new_channel()
+    await layer.group_add(GROUP, channel)
+    try:
+        snapshot = await database_sync_to_async(current_calls)()
+        yield _sse({"event": "snapshot", "doctor_id": None, "data": snapshot})
+        while True:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield _sse({k: message[k] for k in ("event", "doctor_id", "data")})
+    finally:
+        await layer.group_discard(GROUP, channel)
+
+
+async def turn_display_stream(request):
+    """
+    Server-Sent Events fallback for clients that cannot open a WebSocket.
+    Under WSGI the endless stream would hold a worker for as long as the
+    screen stays open, so it answers 204 instead: EventSource stops
+    reconnecting and the display polls.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_sse_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # let nginx flush each event
+    return response
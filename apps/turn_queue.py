@@ -0,0 +1,298 @@
+# apps/turn_queue.py
+"""
+Live queue state: turn numbers, per-doctor queues and current calls.
+
+Turn numbers come from a per-doctor, per-local-day Redis counter (INCR) that
+is seeded from ``TurnNumber`` and written through to it, so a flushed Redis
+never re-issues a ticket. Without Redis, ``TurnNumber.get_next_turn`` issues
+them under a row lock.
+
+Only the current queue day counts: the local date on which the counters
+reset. ``sweep()`` marks earlier leftovers ``expired`` and drops stale calls.
+
+Queued appointments and current calls are mirrored into Redis sorted sets
+(apps.signals, after commit); the database stays the source of truth.
+``snapshot()`` serves the turn display from the mirror, and ``rebuild()``
+re-derives it from the database whenever the ready marker has expired.
+"""
+import json
+import logging
+from datetime import timedelta
+
+import redis
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from apps import redis_client
+from apps.billing import local_day_bounds
+from apps.models import Appointment, CurrentCall, TurnNumber
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "turnq"
+DOCTORS_KEY = f"{PREFIX}:doctors"
+CALLS_KEY = f"{PREFIX}:calls"
+VERSION_KEY = f"{PREFIX}:version"
+COUNTER_TTL = timedelta(days=2)
+ENTRY_TTL = timedelta(days=2)
+# the mirror is re-derived at least this often, which bounds drift from
+# writes that bypass signals (QuerySet.update) or missed a Redis outage
+READY_TTL = timedelta(minutes=5)
+
+
+def _queue_key(doctor_id):
+    return f"{PREFIX}:queue:{doctor_id}"
+
+
+def _entry_key(appointment_id):
+    return f"{PREFIX}:entry:{appointment_id}"
+
+
+def _ready_key():
+    # per queue day, so the mirror is re-derived when the day rolls over
+    return f"{PREFIX}:ready:{queue_day().isoformat()}"
+
+
+def _counter_key(doctor_id, day):
+    return f"{PREFIX}:counter:{doctor_id}:{day.isoformat()}"
+
+
+def queue_day():
+    """The clinic day tickets are issued for; TurnNumber.last_reset tracks it."""
+    return timezone.localdate()
+
+
+def queue_day_start():
+    return local_day_bounds(queue_day())[0]
+
+
+# ---- turn numbers
+def next_turn(turn):
+    """Issue the next ticket (e.g. "A007") for ``turn``'s doctor."""
+    client = redis_client.client
+    if client is not None:
+        today = queue_day()
+        try:
+            number = _incr(client, turn, today)
+        except redis.RedisError as e:
+            logger.warning("Redis turn counter unavailable, using the database: %s", e)
+        else:
+            TurnNumber.objects.filter(pk=turn.pk).update(
+                current_number=Case(
+                    When(last_reset=today, then=Greatest(F("current_number"), Value(number))),
+                    default=Value(number),
+                ),
+                last_reset=today,
+            )
+            turn.current_number, turn.last_reset = number, today
+            return turn.format_turn(number)
+    return turn.get_next_turn()
+
+
+def _incr(client, turn, today):
+    key = _counter_key(turn.doctor_id, today)
+    issued = (
+        TurnNumber.objects.filter(pk=turn.pk, last_reset=today)
+        .values_list("current_number", flat=True).first() or 0
+    )
+    client.set(key, issued, nx=True, ex=COUNTER_TTL)
+    number = client.incr(key)
+    if number <= issued:
+        # tickets were issued from the database while Redis was away; jump past them
+        number = client.incr(key, issued - number + 1)
+    return number
+
+
+# ---- queue / call mirror
+def _entry(appointment):
+    patient = appointment.patient
+    return json.dumps({
+        "id": appointment.id,
+        "doctor_id": appointment.doctor_id,
+        "turn_number": appointment.turn_number,
+        "patient_name": f"{patient.first_name} {patient.last_name}",
+    })
+
+
+def _is_queued(appointment, day_start):
+    return (
+        appointment.status == "queued" and bool(appointment.turn_number)
+        and appointment.created_at >= day_start
+    )
+
+
+def sync_appointment(appointment_id):
+    """Mirror one appointment's queue position and call state into Redis."""
+    client = redis_client.client
+    if client is None:
+        return
+    day_start = queue_day_start()
+    appointment = Appointment.objects.select_related("patient").filter(pk=appointment_id).first()
+    call_pk = (
+        CurrentCall.objects.filter(appointment_id=appointment_id, called_at__gte=day_start)
+        .values_list("pk", flat=True).first()
+    )
+    try:
+        previous = client.get(_entry_key(appointment_id))
+        pipe = client.pipeline(transaction=True)
+        if previous:
+            old_doctor = json.loads(previous)["doctor_id"]
+            if appointment is None or old_doctor != appointment.doctor_id:
+                pipe.zrem(_queue_key(old_doctor), appointment_id)
+        if appointment is None:
+            pipe.delete(_entry_key(appointment_id))
+            pipe.zrem(CALLS_KEY, appointment_id)
+        else:
+            pipe.set(_entry_key(appointment_id), _entry(appointment), ex=ENTRY_TTL)
+            if _is_queued(appointment, day_start):
+                pipe.zadd(_queue_key(appointment.doctor_id), {appointment_id: appointment_id})
+                pipe.sadd(DOCTORS_KEY, appointment.doctor_id)
+            else:
+                pipe.zrem(_queue_key(appointment.doctor_id), appointment_id)
+            if call_pk:
+                pipe.zadd(CALLS_KEY, {appointment_id: call_pk})
+            else:
+                pipe.zrem(CALLS_KEY, appointment_id)
+        pipe.incr(VERSION_KEY)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception("Turn queue mirror update failed for appointment id=%s", appointment_id)
+
+
+def schedule_sync(appointment_id):
+    transaction.on_commit(lambda: sync_appointment(appointment_id))
+
+
+def rebuild(client=None):
+    """Re-derive the whole mirror from the database."""
+    client = client or redis_client.client
+    if client is None:
+        return
+    day_start = queue_day_start()
+    queued = (
+        Appointment.objects.filter(status="queued", created_at__gte=day_start)
+        .exclude(turn_number__isnull=True).exclude(turn_number="")
+        .select_related("patient").order_by("id")
+    )
+    calls = CurrentCall.objects.filter(called_at__gte=day_start).select_related("appointment__patient").order_by("id")
+
+    pipe = client.pipeline(transaction=True)
+    for doctor_id in client.smembers(DOCTORS_KEY):
+        pipe.delete(_queue_key(doctor_id))
+    pipe.delete(DOCTORS_KEY, CALLS_KEY)
+    for appointment in queued.iterator(chunk_size=1000):
+        pipe.set(_entry_key(appointment.id), _entry(appointment), ex=ENTRY_TTL)
+        pipe.zadd(_queue_key(appointment.doctor_id), {appointment.id: appointment.id})
+        pipe.sadd(DOCTORS_KEY, appointment.doctor_id)
+    for call in calls:
+        pipe.set(_entry_key(call.appointment_id), _entry(call.appointment), ex=ENTRY_TTL)
+        pipe.zadd(CALLS_KEY, {call.appointment_id: call.pk})
+    pipe.set(_ready_key(), 1, ex=READY_TTL)
+    pipe.incr(VERSION_KEY)
+    pipe.execute()
+
+
+def _entries(client, ids):
+    if not ids:
+        return {}
+    raw = client.mget([_entry_key(i) for i in ids])
+    entries = {i: json.loads(value) for i, value in zip(ids, raw) if value}
+    missing = [i for i in ids if i not in entries]
+    if missing:
+        # expired entries of long-standing calls: reload from the database
+        pipe = client.pipeline(transaction=False)
+        for appointment in Appointment.objects.select_related("patient").filter(pk__in=missing):
+            value = _entry(appointment)
+            entries[appointment.id] = json.loads(value)
+            pipe.set(_entry_key(appointment.id), value, ex=ENTRY_TTL)
+        pipe.execute()
+    return entries
+
+
+def snapshot():
+    """
+    The CurrentCallsView payload read from the Redis mirror, or None when Redis
+    is unavailable (callers then query the database).
+    """
+    client = redis_client.client
+    if client is None:
+        return None
+    try:
+        if not client.exists(_ready_key()):
+            rebuild(client)
+        pipe = client.pipeline(transaction=False)
+        pipe.zrange(CALLS_KEY, 0, -1)
+        pipe.smembers(DOCTORS_KEY)
+        called, doctors = pipe.execute()
+        pipe = client.pipeline(transaction=False)
+        for doctor_id in doctors:
+            pipe.zrange(_queue_key(doctor_id), 0, -1)
+        per_doctor = pipe.execute() if doctors else []
+
+        called = [int(i) for i in called]
+        called_set = set(called)
+        queued = sorted({int(i) for ids in per_doctor for i in ids} - called_set)
+        entries = _entries(client, called + queued)
+    except redis.RedisError as e:
+        logger.warning("Turn queue mirror unavailable, using the database: %s", e)
+        return None
+
+    doctor_calls = []
+    service_calls = []
+    for appointment_id in called:
+        entry = entries.get(appointment_id)
+        turn = entry and entry["turn_number"]
+        if not turn:
+            continue
+        item = {"id": appointment_id, "turn_number": turn, "patient_name": entry["patient_name"]}
+        if turn.startswith("A"):
+            doctor_calls.append(item)
+        elif turn.startswith("B"):
+            service_calls.append(item)
+
+    return {
+        "doctor_calls": doctor_calls,
+        "service_calls": service_calls,
+        "queued": [
+            {"turn_number": entries[i]["turn_number"], "patient_name": entries[i]["patient_name"]}
+            for i in queued if i in entries
+        ],
+    }
+
+
+def etag():
+    """
+    ETag for the current snapshot without building it: the queue day plus the
+    mirror's change counter. None when Redis is unavailable.
+    """
+    client = redis_client.client
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.exists(_ready_key())
+        pipe.get(VERSION_KEY)
+        ready, version = pipe.execute()
+    except redis.RedisError:
+        return None
+    if not ready:
+        return None
+    return f'"{queue_day().isoformat()}-{version or 0}"'
+
+
+def sweep():
+    """
+    End of a clinic day: mark appointments still queued from earlier days as
+    ``expired`` and drop calls made before today, then re-derive the mirror.
+    Returns (expired, cleared).
+    """
+    day_start = queue_day_start()
+    expired = Appointment.objects.filter(status="queued", created_at__lt=day_start).update(status="expired")
+    cleared = CurrentCall.objects.filter(called_at__lt=day_start).delete()[0]
+    try:
+        rebuild()
+    except redis.RedisError:
+        logger.exception("Turn queue mirror rebuild failed after sweep")
+    return expired, cleared
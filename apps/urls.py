@@ -2,6 +2,7 @@
 from django.urls import path
 from django.views.generic import TemplateView
 
+from apps.turn_display import turn_display_stream
 from apps.views import UnpaidPatientsDataView  # add this import
 from apps.views import AdminResetDoctorPasswordView  # ADD THIS IMPORT
 
@@ -19,7 +20,7 @@ from apps.views import (
     PasswordResetConfirmView, ActivateUserView,
 
     # Patients
-    PatientRegistrationAPIView, PatientDetailAPIView, PatientListAPIView, RecentPatientsView, RecentPatientsByDaysView,
+    PatientRegistrationAPIView, PatientBatchRegistrationAPIView, PatientDetailAPIView, PatientListAPIView, PatientSearchAPIView, RecentPatientsView, RecentPatientsByDaysView,
 
     # Doctors
     DoctorListCreateAPIView, DoctorRegistrationAPIView, DoctorDetailView,
@@ -34,7 +35,7 @@ from apps.views import (
     PaymentListCreateAPIView, TreatmentRoomPaymentsView, DoctorPaymentsAPIView, DoctorPaymentListView,
 
     # Treatment Rooms
-    TreatmentRoomListCreateAPIView, TreatmentRoomDetailAPIView, TreatmentRoomList,
+    TreatmentRoomListCreateAPIView, TreatmentRoomDetailAPIView, TreatmentRoomList, CatalogCacheStatsView, MetricsView, MetricsRequestsView,
     AssignRoomAPIView, RoomStatusAPIView,
 
     # Treatment Registrations
@@ -47,12 +48,12 @@ from apps.views import (
     CashRegistrationListView, CashRegistrationView, CashRegisterReceiptView,
     CashRegisterListAPIView, CashRegisterListCreateAPIView, RecentPatientsAPIView, TreatmentRegistrationListCreateView,
     TreatmentDischargeView, TreatmentMoveView, DoctorPatientRoomView, GenerateTurnView, CallPatientView,
-    CurrentCallsView, PrintTurnView, ClearCallView, AdminStatisticsView, RecentTransactionsView, AdminChartDataView,
+    CurrentCallsView, PrintTurnView, PrintJobStatusView, ClearCallView, AdminStatisticsView, RecentTransactionsView, AdminChartDataView,
     TreatmentPaymentReceiptView, PrintTreatmentReceiptView, PrintTreatmentRoomReceiptView, TreatmentRoomStatsView,
     AccountantDashboardView, OutcomeListCreateView, UserProfileAPIView,
     LabRegistrationListCreateAPIView, LabRegistrationDetailAPIView, PublicDoctorServiceAPI,
     PatientArchiveView, RoomHistoryView, PatientBalancesAPIView, PatientBillingAPIView, PatientBillingReceiptHTMLView,
-    DischargeReceiptHTMLView, DischargeReceiptAPIView, PatientBalancesDataView,
+    DischargeReceiptHTMLView, DischargeReceiptAPIView, PatientBalancesDataView, PatientArchiveExportView,
     CallTurnView,  # ← use the view from apps.views
 )
 
@@ -72,8 +73,10 @@ urlpatterns = [
 
     # --- Patients ---
     path('register-patient/', PatientRegistrationAPIView.as_view(), name='register-patient'),
+    path('register-patients/', PatientBatchRegistrationAPIView.as_view(), name='register-patients'),
     path('patients/', PatientListAPIView.as_view(), name='patient-list'),
     path('patients/<int:pk>/', PatientDetailAPIView.as_view(), name='patient-detail'),
+    path('patients/search/', PatientSearchAPIView.as_view(), name='patient-search'),
     path('recent-patients/', RecentPatientsView.as_view(), name='recent-patients'),
     path('recent-patients-by-days/', RecentPatientsByDaysView.as_view(), name='recent-patients-by-days'),
 
@@ -100,6 +103,7 @@ urlpatterns = [
     # --- Treatment Rooms ---
     path('treatment-rooms/', TreatmentRoomListCreateAPIView.as_view(), name='treatment-room-list-create'),
     path('treatment-rooms/list/', TreatmentRoomList.as_view(), name='treatment-room-list-only'),
+    path('catalog-cache/stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
     path('treatment-rooms/<int:pk>/', TreatmentRoomDetailAPIView.as_view(), name='treatment-room-detail'),
     path('room-status/', RoomStatusAPIView.as_view(), name='room-status'),
     path('assign-room/', AssignRoomAPIView.as_view(), name='assign-room'),
@@ -129,7 +133,9 @@ urlpatterns = [
     path("call-turn/", CallTurnView.as_view(), name="call-turn"),
     path("call-patient/<int:appointment_id>/", CallPatientView.as_view(), name="call-patient"),
     path("current-calls/", CurrentCallsView.as_view(), name="current-calls"),
+    path("current-calls/stream/", turn_display_stream, name="current-calls-stream"),
     path("print-turn/", PrintTurnView.as_view()),
+    path("print-jobs/<int:pk>/", PrintJobStatusView.as_view(), name="print-job-status"),
     path("clear-call/<int:appointment_id>/", ClearCallView.as_view()),
 
     path('admin-statistics/', AdminStatisticsView.as_view(), name='admin-statistics'),
@@ -139,6 +145,8 @@ urlpatterns = [
     path("treatment-room-payments/print/", PrintTreatmentReceiptView.as_view(), name="treatment-room-print"),
     path("treatment-room-payments/room-print/", PrintTreatmentRoomReceiptView.as_view(), name="treatment-room-direct-print"),
     path("admin/treatment-room-stats/", TreatmentRoomStatsView.as_view()),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/requests/', MetricsRequestsView.as_view(), name='metrics-requests'),
 
     path("accounting-dashboard/", AccountantDashboardView.as_view(), name="accounting-dashboard"),
     path("incomes/", AccountantDashboardView.as_view(), name="income-list"),
@@ -154,6 +162,7 @@ urlpatterns = [
     path("services/doctor/<int:doctor_id>/", PublicDoctorServiceAPI.as_view(), name="public-doctor-service-api"),
 
     path('patients/archive/', PatientArchiveView.as_view(), name='patient-archive'),
+    path('patients/archive/export/', PatientArchiveExportView.as_view(), name='patient-archive-export'),
     path('room-history/', RoomHistoryView.as_view(), name='room-history'),
 
     path('treatment-registrations/<int:pk>/receipt/', DischargeReceiptHTMLView.as_view(), name='discharge-receipt'),
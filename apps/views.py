@@ -1,15 +1,18 @@
 # apps/views.py
+import hashlib
 import random
 import string
 import json
 from decimal import Decimal
 
-from escpos.printer import Win32Raw, Usb
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.db.models import (
     DecimalField,
     ExpressionWrapper,
     F,
+    OuterRef,
+    Prefetch,
+    Subquery,
     Sum,
     Count,
     Q,
@@ -21,11 +24,11 @@ from django.db.models.functions import (
 )
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.utils.http import urlsafe_base64_decode
+from django.utils.http import parse_etags, quote_etag, urlsafe_base64_decode
 from django.utils.timezone import localtime
 from django.utils.dateparse import parse_date
 from django.utils.timezone import now
-from datetime import timedelta
+from datetime import timedelta, timezone as dt_timezone
 from django.apps import apps as django_apps
 
 from drf_spectacular.utils import extend_schema
@@ -41,14 +44,15 @@ from rest_framework.generics import (
     ListAPIView,
 )
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.status import HTTP_201_CREATED
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
 # ➕ For HTML receipt rendering / URL reversing
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views import View
-from django.shortcuts import render
 from django.urls import reverse
 
 from apps.models import (
@@ -57,6 +61,7 @@ from apps.models import (
     Patient,
     Appointment,
     Payment,
+    ReceiptSequence,
     TreatmentRoom,
     TreatmentRegistration,
     PatientResult,
@@ -67,6 +72,9 @@ from apps.models import (
     CurrentCall,
     Outcome,
     LabRegistration,
+    PatientBalance,
+    DailyRevenue,
+    PrintJob,
 )
 from apps.serializers import (
     ForgotPasswordSerializer,
@@ -95,10 +103,14 @@ from apps.serializers import (
     RoomHistorySerializer,
     PatientArchiveSerializer, 
     OutcomeSerializer,   
+    PrintJobSerializer,
+    PatientSearchSerializer,
 )
 
+from apps import catalog_cache, metrics, occupancy, patient_search, printing, receipt_cache, registration, turn_display, turn_queue
+from apps.billing import filter_local_days
+from apps.permissions import IsAdmin
 from apps.tasks import send_verification_email
-from utils.receipt_printer import ReceiptPrinter
 
 import logging
 logger = logging.getLogger(__name__)
@@ -212,12 +224,21 @@ class UserInfoListCreateAPIView(ListCreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserInfoSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = None  # only ever the caller's own row
 
     def get_queryset(self):
         return super().get_queryset().filter(id=self.request.user.id)
 
 
 # ------------------------------- Patients / Doctors / Appointments / Payments --------------
+def _registration_response(appointment):
+    data = AppointmentSerializer(appointment).data
+    data["turn_number"] = appointment.turn_number
+    doctor = appointment.doctor
+    data["doctor_name"] = doctor.user.get_full_name() if doctor.user else doctor.name
+    return data
+
+
 @extend_schema(tags=['Patient'])
 class PatientRegistrationAPIView(APIView):
     @extend_schema(
@@ -226,92 +247,34 @@ class PatientRegistrationAPIView(APIView):
         responses={201: AppointmentSerializer}
     )
     def post(self, request):
-        print("✅ Received patient data:", request.data)
-
-        doctor_id = request.data.get("doctor_id")
-        if not doctor_id:
-            return Response({"error": "Doctor ID is required."}, status=400)
-
-        try:
-            doctor = Doctor.objects.get(id=doctor_id)
-        except Doctor.DoesNotExist:
-            return Response({"error": "Doctor not found"}, status=404)
-
-        patient_data = {
-            "first_name": request.data.get("first_name"),
-            "last_name": request.data.get("last_name"),
-            "phone": request.data.get("phone"),
-            "address": request.data.get("address"),
-            "age": request.data.get("age"),
-        }
-
-        services = request.data.get("services", [])
-        reason = request.data.get("reason")
-        amount_paid = float(request.data.get("amount_paid", 0))
-        amount_owed = float(request.data.get("amount_owed", 0))
+        appointment = registration.register(request.data)
+        return Response(_registration_response(appointment), status=HTTP_201_CREATED)
 
-        patient_serializer = PatientSerializer(data=patient_data)
 
-        if patient_serializer.is_valid():
-            patient = patient_serializer.save(patients_doctor=doctor)
-            print("✅ Patient saved:", patient)
-
-            turn_instance, created = TurnNumber.objects.get_or_create(doctor=doctor)
-            if created or not turn_instance.letter:
-                used_letters = set(TurnNumber.objects.exclude(letter=None).values_list("letter", flat=True))
-                for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
-                    if letter not in used_letters:
-                        turn_instance.letter = letter
-                        break
-                else:
-                    return Response({"error": "No available letters for doctor turn codes."}, status=400)
-                turn_instance.save()
-
-            try:
-                turn_code = turn_instance.get_next_turn()
-            except Exception as e:
-                print("❌ Turn number generation failed:", e)
-                return Response({"error": "Failed to generate turn number."}, status=400)
-
-            appointment = Appointment.objects.create(
-                patient=patient,
-                doctor=doctor,
-                reason=reason,
-                status='queued',
-                turn_number=turn_code
-            )
-            print("✅ Appointment created:", appointment)
-
-            for service_id in services:
-                try:
-                    service = Service.objects.get(id=service_id)
-                    appointment.services.add(service)
-                except Service.DoesNotExist:
-                    print(f"⚠️ Service ID {service_id} not found")
-
-            Payment.objects.create(
-                appointment=appointment,
-                amount_paid=amount_paid,
-                amount_due=amount_owed,
-                status='partial' if amount_owed > 0 else 'paid'
-            )
-
-            response_data = AppointmentSerializer(appointment).data
-            response_data["turn_number"] = appointment.turn_number
-            response_data["doctor_name"] = doctor.user.get_full_name()
-
-            return Response(response_data, status=HTTP_201_CREATED)
+@extend_schema(tags=['Patient'])
+class PatientBatchRegistrationAPIView(APIView):
+    """
+    POST /api/v1/register-patients/ {"patients": [<register-patient payload>, ...]}
+    Registers everyone (e.g. a family) in one transaction: all or nothing.
+    """
 
-        else:
-            print("❌ Patient serializer errors:", patient_serializer.errors)
-            return Response(patient_serializer.errors, status=400)
+    @extend_schema(tags=["Registration"], responses={201: AppointmentSerializer(many=True)})
+    def post(self, request):
+        entries = request.data.get("patients") if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "patients must be a non-empty list."}, status=400)
+        if len(entries) > registration.MAX_BATCH:
+            return Response({"error": f"At most {registration.MAX_BATCH} patients per request."}, status=400)
+        appointments = registration.register_many(entries)
+        return Response([_registration_response(a) for a in appointments], status=HTTP_201_CREATED)
 
 
 @extend_schema(tags=['Doctor'])
-class DoctorListCreateAPIView(ListCreateAPIView):
+class DoctorListCreateAPIView(catalog_cache.CachedListMixin, ListCreateAPIView):
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
     permission_classes = [AllowAny]
+    catalog = "doctors"
 
     def get_queryset(self):
         return super().get_queryset()
@@ -330,9 +293,11 @@ class PaymentListCreateAPIView(ListCreateAPIView):
 
 
 @extend_schema(tags=['Treatment'])
-class TreatmentRoomListCreateAPIView(ListCreateAPIView):
-    queryset = TreatmentRoom.objects.all()
+class TreatmentRoomListCreateAPIView(catalog_cache.CachedListMixin, ListCreateAPIView):
+    queryset = TreatmentRoom.objects.prefetch_related(occupancy.active_registrations_prefetch())
     serializer_class = TreatmentRoomSerializer
+    catalog = "rooms"
+    catalog_versions = (catalog_cache.VERSION_KEY, catalog_cache.OCCUPANCY_VERSION_KEY)
 
 
 @extend_schema(tags=['Treatment-register'])
@@ -474,10 +439,29 @@ class PatientListAPIView(ListAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class ServiceListCreateAPIView(ListCreateAPIView):
+class PatientSearchAPIView(APIView):
+    """
+    GET /api/v1/patients/search/?q=&limit=
+
+    Ranked patient lookup by name words and/or phone digits (see
+    apps.patient_search), for the as-you-type boxes of the registration and
+    billing pages. At most ``limit`` (default 20, up to 50) hits, best first;
+    a query under two characters returns none without a database query.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        q = (request.query_params.get("q") or "").strip()
+        limit = patient_search.parse_limit(request.query_params.get("limit"))
+        hits = patient_search.search(Patient.objects.select_related("patients_doctor"), q, limit)
+        return Response({"q": q, "results": PatientSearchSerializer(hits, many=True).data})
+
+
+class ServiceListCreateAPIView(catalog_cache.CachedListMixin, ListCreateAPIView):
     queryset = Service.objects.select_related('doctor').all()
     serializer_class = ServiceSerializer
     permission_classes = [IsAuthenticated]
+    catalog = "services"
 
 
 class ServiceDetailAPIView(RetrieveUpdateDestroyAPIView):
@@ -518,9 +502,8 @@ class RoomStatusAPIView(APIView):
 
     def get(self, request):
         data = []
-        rooms = TreatmentRoom.objects.all()
-        for room in rooms:
-            active_regs = TreatmentRegistration.objects.filter(room=room, discharged_at__isnull=True)
+        for room in occupancy.rooms_with_occupants():
+            active_regs = occupancy.active_registrations(room)
             patient_names = [f"{reg.patient.first_name} {reg.patient.last_name}" for reg in active_regs]
             data.append({
                 "room_id": room.id,
@@ -536,10 +519,36 @@ def is_active(self):
     return self.discharged_at is None
 
 
-class TreatmentRoomList(ListAPIView):
-    queryset = TreatmentRoom.objects.all()
+class TreatmentRoomList(catalog_cache.CachedListMixin, ListAPIView):
+    queryset = TreatmentRoom.objects.prefetch_related(occupancy.active_registrations_prefetch())
     serializer_class = TreatmentRoomSerializer
     permission_classes = [IsAuthenticated]
+    catalog = "rooms"
+    catalog_versions = (catalog_cache.VERSION_KEY, catalog_cache.OCCUPANCY_VERSION_KEY)
+
+
+class CatalogCacheStatsView(APIView):
+    """GET: hits, misses and hit rate per cached catalog list, for this worker process."""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(catalog_cache.stats())
+
+
+class MetricsView(APIView):
+    """GET: request, catalog cache and Celery task metrics in the Prometheus text format (apps.metrics)."""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class MetricsRequestsView(APIView):
+    """GET: the slowest / heaviest recent requests and slow query samples of this process."""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(metrics.recent())
 
 
 # --------------------- Treatment Payments & Receipts ---------------------
@@ -548,16 +557,17 @@ class TreatmentRoomPaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        rooms = TreatmentRoom.objects.all()
+        rooms = occupancy.rooms_with_occupants()
+        totals = occupancy.paid_totals(occupancy.occupant_ids(rooms))
+        today = timezone.localdate()
         data = []
 
         for room in rooms:
-            registrations = TreatmentRegistration.objects.filter(room=room, discharged_at__isnull=True)
             patients_data = []
-            for reg in registrations:
-                total_paid = reg.payments.aggregate(total=Sum('amount_paid'))['total'] or 0
+            for reg in occupancy.active_registrations(room):
+                total_paid = totals.get(reg.patient_id, 0)
                 daily_price = room.price_per_day or 0
-                days = (timezone.now().date() - reg.created_at.date()).days or 1
+                days = (today - timezone.localtime(reg.assigned_at).date()).days or 1
                 amount_due = days * daily_price
 
                 if total_paid >= amount_due:
@@ -593,18 +603,15 @@ class TreatmentRoomPaymentsView(GenericAPIView):
     def get(self, request):
         rooms_data = []
 
-        rooms = TreatmentRoom.objects.all()
+        rooms = occupancy.rooms_with_occupants()
+        payments_by_patient = occupancy.payments_by_patient(occupancy.occupant_ids(rooms))
         for room in rooms:
-            active_regs = TreatmentRegistration.objects.filter(
-                room=room, discharged_at__isnull=True
-            ).select_related("patient")
-
             patients_data = []
-            for reg in active_regs:
+            for reg in occupancy.active_registrations(room):
                 patient = reg.patient
 
-                payments = TreatmentPayment.objects.filter(patient=patient).order_by("date")
-                total_paid = sum(p.amount for p in payments)
+                payments = payments_by_patient.get(patient.id, [])
+                total_paid = sum((p.amount for p in payments), Decimal("0"))
                 expected = reg.total_paid
 
                 if total_paid == 0:
@@ -714,12 +721,13 @@ class CashRegistrationListView(APIView):
 class CashRegistrationView(ListCreateAPIView):
     serializer_class = CashRegisterSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = None  # one patient's receipts, next to their summary
 
     def get_queryset(self):
         patient_id = self.kwargs.get('patient_id')
         return CashRegister.objects.filter(
             patient_id=patient_id
-        ).select_related('patient', 'created_by')
+        ).select_related('patient', 'created_by').prefetch_related('lines')
 
     def list(self, request, *args, **kwargs):
         patient_id = self.kwargs.get('patient_id')
@@ -786,7 +794,7 @@ class CashRegistrationView(ListCreateAPIView):
 
 
 class CashRegisterReceiptView(RetrieveAPIView):
-    queryset = CashRegister.objects.all()
+    queryset = CashRegister.objects.prefetch_related('lines')
     serializer_class = CashRegisterSerializer
     permission_classes = [IsAuthenticated]
 
@@ -823,37 +831,30 @@ class RecentPatientsByDaysView(APIView):
 
 
 class CashRegisterListAPIView(ListAPIView):
-    queryset = CashRegister.objects.select_related("patient", "created_by").all()
+    queryset = CashRegister.objects.select_related("patient", "created_by").prefetch_related("lines")
     serializer_class = CashRegisterSerializer
     permission_classes = [IsAuthenticated]
 
 
 class CashRegisterListCreateAPIView(ListCreateAPIView):
-    queryset = CashRegister.objects.all().order_by('-created_at')
+    queryset = CashRegister.objects.select_related("patient").prefetch_related("lines").order_by('-created_at')
     serializer_class = CashRegisterSerializer
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        transaction_type = self.request.data.get("transaction_type")
-        prefix = "A" if transaction_type == "consultation" else "B"
-        last = CashRegister.objects.filter(reference__startswith=prefix).order_by("-id").first()
-
-        if last and last.turn_number:
-            last_number = int(last.turn_number[1:])
-        else:
-            last_number = 0
-
-        new_turn_number = f"{prefix}{last_number + 1:03d}"
-        serializer.save(created_by=self.request.user, turn_number=new_turn_number)
+        prefix = "A" if serializer.validated_data.get("transaction_type") == "consultation" else "B"
+        number = ReceiptSequence.allocate(prefix)
+        serializer.save(created_by=self.request.user, turn_number=ReceiptSequence.format(prefix, number))
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=400)
 
-        instance = serializer.save(created_by=self.request.user)
+        self.perform_create(serializer)
+        instance = serializer.instance
 
-        receipt_data = {
+        job = printing.enqueue("cash_receipt", {
             'receipt_number': instance.reference or f"CR-{instance.id}",
             'date': localtime(instance.created_at).strftime("%Y-%m-%d %H:%M"),
             'patient_name': f"{instance.patient.first_name} {instance.patient.last_name}",
@@ -862,15 +863,11 @@ class CashRegisterListCreateAPIView(ListCreateAPIView):
             'payment_method': instance.get_payment_method_display(),
             'processed_by': instance.created_by.get_full_name(),
             'notes': instance.notes or ""
-        }
-
-        try:
-            printer = ReceiptPrinter()
-            printer.print_receipt(receipt_data)
-        except Exception as e:
-            print("🖨️ Error printing receipt:", e)
+        }, user=request.user)
 
-        return Response(self.get_serializer(instance).data, status=201)
+        data = self.get_serializer(instance).data
+        data["print_job_id"] = job.id
+        return Response(data, status=201)
 
 
 class RecentPatientsAPIView(APIView):
@@ -903,82 +900,6 @@ class TreatmentRegistrationListCreateView(ListCreateAPIView):
         serializer.save()
 
 
-# ➕ A4 DISCHARGE RECEIPT SUMMARY + HTML VIEW
-def _discharge_summary(reg):
-    patient = reg.patient
-    appointment = reg.appointment
-    doctor = getattr(appointment, "doctor", None)
-
-    # costs
-    consultation_cost = getattr(doctor, "consultation_price", 0) or 0
-    services_cost = 0
-    if appointment:
-        try:
-            services_cost = sum((s.price or 0) for s in appointment.services.all())
-        except Exception:
-            services_cost = 0
-
-    end_dt = reg.discharged_at or timezone.now()
-    days = (end_dt.date() - reg.assigned_at.date()).days + 1
-    room_rate = (reg.room.price_per_day or 0) if reg.room else 0
-    room_cost = days * room_rate
-
-    # payments history
-    cash_qs = CashRegister.objects.filter(patient=patient).order_by('created_at')
-    room_qs = TreatmentPayment.objects.filter(patient=patient).order_by('date')
-
-    cash_total = sum((p.amount or 0) for p in cash_qs) if cash_qs else 0
-    room_total = sum((p.amount or 0) for p in room_qs) if room_qs else 0
-    paid_total = cash_total + room_total
-
-    due_total = (consultation_cost or 0) + (services_cost or 0) + (room_cost or 0)
-    balance = due_total - paid_total
-
-    return {
-        "clinic_name": "Controllab",
-        "patient": patient,
-        "doctor": doctor,
-        "registration": reg,
-        "room": reg.room,
-        "assigned_at": reg.assigned_at,
-        "discharged_at": reg.discharged_at,
-        "days": days,
-        "room_rate": float(room_rate),
-        "room_cost": float(room_cost),
-        "consultation_cost": float(consultation_cost),
-        "services_cost": float(services_cost),
-        "due_total": float(due_total),
-        "paid_total": float(paid_total),
-        "balance": float(balance),
-        "cash_payments": cash_qs,    # queryset of CashRegister
-        "room_payments": room_qs,    # queryset of TreatmentPayment
-    }
-
-
-class DischargeReceiptHTMLView(View):
-    template_name = "receipts/discharge.html"
-
-    def get(self, request, pk):
-        reg = get_object_or_404(TreatmentRegistration, pk=pk)
-        ctx = _discharge_summary(reg)
-        return render(request, self.template_name, ctx)
-
-
-# SAFE CHANGE: keep only one final TreatmentDischargeView definition (with permissions)
-class TreatmentDischargeView(APIView):
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, pk):
-        registration = get_object_or_404(TreatmentRegistration, pk=pk, discharged_at__isnull=True)
-        registration.discharged_at = now()
-        registration.save()
-        try:
-            url = reverse('discharge-receipt', args=[pk])
-        except Exception:
-            url = f"/api/v1/treatment-registrations/{pk}/receipt/"
-        return Response({"detail": "✅ Patient discharged.", "receipt_url": url}, status=status.HTTP_200_OK)
-
-
 # -------------------- Move patient between rooms --------------------
 from django.db import transaction  # safe local import
 from django.utils.timezone import now as tz_now  # SAFE CHANGE: alias to avoid confusion with function name
@@ -1077,7 +998,7 @@ class GenerateTurnView(APIView):
             "letter": self.assign_letter(),
         })
 
-        next_turn = turn_number_obj.get_next_turn()
+        next_turn = turn_queue.next_turn(turn_number_obj)
         return Response({
             "doctor": doctor.user.get_full_name(),
             "turn_number": next_turn
@@ -1104,48 +1025,27 @@ class CallPatientView(APIView):
             appointment=appointment,
             defaults={"called_at": timezone.now()}
         )
+        turn_display.broadcast("call", doctor_id=appointment.doctor_id)
 
         return Response({"message": "Patient called (or recalled)"})
 
 
 class CurrentCallsView(APIView):
     def get(self, request):
-        doctor_calls = []
-        service_calls = []
-        queued = []
-
-        for call in CurrentCall.objects.select_related('appointment__patient', 'appointment__doctor'):
-            appointment = call.appointment
-            patient = appointment.patient
-            turn = getattr(appointment, "turn_number", None)
-            if not turn:
-                continue
-            entry = {
-                "id": appointment.id,
-                "turn_number": turn,
-                "patient_name": f"{patient.first_name} {patient.last_name}"
-            }
-            if turn.startswith("A"):
-                doctor_calls.append(entry)
-            elif turn.startswith("B"):
-                service_calls.append(entry)
-
-        called_ids = CurrentCall.objects.values_list("appointment_id", flat=True)
-        queued_apps = Appointment.objects.filter(status="queued").exclude(id__in=called_ids).select_related("patient", "doctor")
-
-        for app in queued_apps:
-            if not app.turn_number:
-                continue
-            queued.append({
-                "turn_number": app.turn_number,
-                "patient_name": f"{app.patient.first_name} {app.patient.last_name}"
-            })
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        headers = {"Cache-Control": "no-cache"}
 
-        return Response({
-            "doctor_calls": doctor_calls,
-            "service_calls": service_calls,
-            "queued": queued
-        })
+        # the Redis mirror's change counter answers unchanged polls without building the payload
+        etag = turn_queue.etag()
+        if etag and etag in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": etag})
+
+        payload = turn_display.current_calls()
+        if etag is None:
+            etag = quote_etag(hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest())
+            if etag in if_none_match:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": etag})
+        return Response(payload, headers={**headers, "ETag": etag})
 
 
 @extend_schema(request=CallTurnSerializer, tags=["Turn"])
@@ -1164,6 +1064,7 @@ class CallTurnView(APIView):
             appointment=appointment,
             defaults={"called_at": timezone.now()}
         )
+        turn_display.broadcast("call", doctor_id=appointment.doctor_id)
 
         return Response({"success": True, "message": "Patient called"})
 
@@ -1180,33 +1081,14 @@ class PrintTurnView(APIView):
         if not all([patient_name, doctor_name, turn_number, patient_id]):
             return Response({"error": "Missing fields"}, status=400)
 
-        try:
-            p = Win32Raw("ReceiptPrinter")
-
-            p.set(align='center', bold=True, width=2, height=2)
-            p.text("Controllab Clinic\n")
-
-            p.set(align='left', bold=False, width=1, height=1)
-            p.text("--------------------------------\n")
-            p.text(f"Bemor: {patient_name}\n")
-            p.text(f"Shifokor: {doctor_name}\n")
-            p.text(f"Sana: {timezone.now().strftime('%Y-%m-%d %H:%M')}\n")
-            p.text("--------------------------------\n")
-
-            p.set(align='center', bold=True)
-            p.text("Iltimos navbatni kuting\n\n")
-
-            p.set(width=8, height=8, bold=True)
-            p.text(f"{turn_number}\n\n")
-
-            location_url = f"http://yourdomain.com/patient/detail/{patient_id}/"
-            p.qr(location_url, size=10)
-            p.text(" Bemor haqida ma'lumot \n")
-            p.cut()
-
-            return Response({"message": "Printed ✅"})
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
+        job = printing.enqueue("turn_ticket", {
+            'patient_name': patient_name,
+            'doctor_name': doctor_name,
+            'turn_number': turn_number,
+            'date': timezone.now().strftime('%Y-%m-%d %H:%M'),
+            'qr': f"http://yourdomain.com/patient/detail/{patient_id}/",
+        }, user=request.user)
+        return Response({"message": "Navbatga qo‘yildi 🖨️", "print_job_id": job.id}, status=202)
 
 
 class ClearCallView(APIView):
@@ -1214,8 +1096,9 @@ class ClearCallView(APIView):
 
     def post(self, request, appointment_id):
         try:
-            call = CurrentCall.objects.get(appointment_id=appointment_id)
+            call = CurrentCall.objects.select_related("appointment").get(appointment_id=appointment_id)
             call.delete()
+            turn_display.broadcast("clear", doctor_id=call.appointment.doctor_id)
             return Response({"message": "Call cleared"})
         except CurrentCall.DoesNotExist:
             return Response({"error": "Call not found"}, status=404)
@@ -1229,18 +1112,20 @@ class AdminStatisticsView(APIView):
         start_date = parse_date(start_date_raw) if start_date_raw else None
         end_date = parse_date(end_date_raw) if end_date_raw else None
 
-        cash_qs = CashRegister.objects.all()
-        if start_date and end_date:
-            cash_qs = cash_qs.filter(created_at__date__range=(start_date, end_date))
-
-        room_qs = TreatmentPayment.objects.all()
+        rollup = DailyRevenue.objects.all()
         if start_date and end_date:
-            room_qs = room_qs.filter(date__date__range=(start_date, end_date))
+            rollup = rollup.filter(day__range=(start_date, end_date))
 
-        total_profit = cash_qs.aggregate(total=Sum('amount'))['total'] or 0
-        treatment_room_profit = room_qs.aggregate(total=Sum('amount'))['total'] or 0
-        doctor_profit = cash_qs.filter(transaction_type='consultation').aggregate(total=Sum('amount'))['total'] or 0
-        service_profit = cash_qs.filter(transaction_type='service').aggregate(total=Sum('amount'))['total'] or 0
+        totals = rollup.aggregate(
+            cash=Sum('amount', filter=Q(kind='cash')),
+            room=Sum('amount', filter=Q(kind='room_payment')),
+            doctor=Sum('amount', filter=Q(kind='cash', transaction_type='consultation')),
+            service=Sum('amount', filter=Q(kind='cash', transaction_type='service')),
+        )
+        total_profit = totals['cash'] or 0
+        treatment_room_profit = totals['room'] or 0
+        doctor_profit = totals['doctor'] or 0
+        service_profit = totals['service'] or 0
 
         return Response({
             "total_profit": total_profit + treatment_room_profit,
@@ -1255,12 +1140,13 @@ class RecentTransactionsView(APIView):
         start_date_raw = request.GET.get('start_date')
         end_date_raw = request.GET.get('end_date')
 
-        start_date = parse_date(start_date_raw) if start_date_raw else now().date() - timedelta(days=30)
-        end_date = parse_date(end_date_raw) if end_date_raw else now().date()
+        today = timezone.localdate()
+        start_date = parse_date(start_date_raw) if start_date_raw else today - timedelta(days=30)
+        end_date = parse_date(end_date_raw) if end_date_raw else today
 
-        qs = CashRegister.objects.all()
+        qs = CashRegister.objects.select_related('patient').prefetch_related('lines')
         if start_date and end_date:
-            qs = qs.filter(created_at__date__range=(start_date, end_date))
+            qs = filter_local_days(qs, 'created_at', start_date, end_date)
 
         qs = qs.order_by('-created_at')[:100]
 
@@ -1281,51 +1167,49 @@ class AdminChartDataView(APIView):
             "rooms": []
         }
 
-        qs = CashRegister.objects.all()
+        qs = DailyRevenue.objects.all()
         if start and end:
-            qs = qs.filter(created_at__date__range=(start, end))
+            qs = qs.filter(day__range=(start, end))
 
-        doctor_qs = qs.filter(transaction_type='consultation')
-        doctors = doctor_qs.values('doctor__name').annotate(profit=Sum('amount'))
+        doctors = (
+            qs.filter(kind='cash', transaction_type='consultation')
+            .values('doctor__name').annotate(profit=Sum('amount')).order_by('-profit')
+        )
         data['doctors'] = [{"name": d['doctor__name'] or "—", "profit": d['profit']} for d in doctors]
 
-        service_qs = qs.filter(transaction_type='service')
-        for s in service_qs:
-            if s.notes and "Service Payment:" in s.notes:
-                names = s.notes.replace("Service Payment:", "").split(",")
-                for name in names:
-                    clean = name.strip()
-                    match = next((i for i in data["services"] if i["name"] == clean), None)
-                    if match:
-                        match["profit"] += s.amount
-                    else:
-                        data["services"].append({"name": clean, "profit": s.amount})
-
-        room_qs = qs.filter(transaction_type='treatment')
-        for r in room_qs:
-            if r.notes and "Room Payment:" in r.notes:
-                room_name = r.notes.replace("Room Payment:", "").strip()
-                match = next((i for i in data["rooms"] if i["name"] == room_name), None)
-                if match:
-                    match["profit"] += r.amount
-                else:
-                    data["rooms"].append({"name": room_name, "profit": r.amount})
+        services = qs.filter(kind='cash_service').values('label').annotate(profit=Sum('amount')).order_by('-profit')
+        data['services'] = [{"name": s['label'], "profit": s['profit']} for s in services]
 
-        today = now().date()
+        rooms = (
+            qs.filter(kind='cash', transaction_type='treatment').exclude(label='')
+            .values('label').annotate(profit=Sum('amount')).order_by('-profit')
+        )
+        data['rooms'] = [{"name": r['label'], "profit": r['profit']} for r in rooms]
+
+        today = timezone.localdate()
         first_day_this_month = today.replace(day=1)
         first_day_last_month = (first_day_this_month - timedelta(days=1)).replace(day=1)
-        last_day_last_month = first_day_this_month - timedelta(days=1)
 
-        def get_month_data(s, e):
-            base_qs = CashRegister.objects.filter(created_at__date__range=(s, e))
-            return {
-                "doctor_profit": base_qs.filter(transaction_type='consultation').aggregate(total=Sum('amount'))['total'] or 0,
-                "service_profit": base_qs.filter(transaction_type='service').aggregate(total=Sum('amount'))['total'] or 0,
-            }
+        this_month = Q(day__gte=first_day_this_month)
+        last_month = Q(day__lt=first_day_this_month)
+        monthly = DailyRevenue.objects.filter(
+            kind='cash', day__range=(first_day_last_month, today)
+        ).aggregate(
+            this_doctor=Sum('amount', filter=this_month & Q(transaction_type='consultation')),
+            this_service=Sum('amount', filter=this_month & Q(transaction_type='service')),
+            last_doctor=Sum('amount', filter=last_month & Q(transaction_type='consultation')),
+            last_service=Sum('amount', filter=last_month & Q(transaction_type='service')),
+        )
 
         data["monthly_comparison"] = {
-            "this_month": get_month_data(first_day_this_month, today),
-            "last_month": get_month_data(first_day_last_month, last_day_last_month)
+            "this_month": {
+                "doctor_profit": monthly['this_doctor'] or 0,
+                "service_profit": monthly['this_service'] or 0,
+            },
+            "last_month": {
+                "doctor_profit": monthly['last_doctor'] or 0,
+                "service_profit": monthly['last_service'] or 0,
+            },
         }
 
         return Response(data)
@@ -1416,59 +1300,51 @@ class PrintTreatmentRoomReceiptView(APIView):
             logger.error(f"Error fetching registration for payment_id={payment_id}: {str(e)}")
             doctor = None
 
-        try:
-            p = Usb(0x0483, 0x070b)
-            p.set(align='center', text_type='B', width=2, height=2)
-            p.text("🏥 NEURO PULS KLINIKASI\n\n")
-
-            p.set(align='left', text_type='B', width=1, height=1)
-            p.text(f"Chek raqami: TP-{payment.id}\n")
-            p.text(f"Sana      : {payment.date.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            p.text(f"Bemor     : {payment.patient.first_name} {payment.patient.last_name}\n")
-            p.text(f"Turi      : {payment.transaction_type or 'Davolash'}\n")
-            p.text(f"Miqdor    : {float(payment.amount):.0f}.00 so'm\n")
-            p.text(f"Usul      : {payment.payment_method or 'N/A'}\n")
-            p.text(f"Qabulchi  : {payment.created_by.get_full_name() if payment.created_by else 'N/A'}\n")
-            if payment.notes:
-                p.text(f"Izoh      : {payment.notes}\n")
-            p.text("-----------------------------\n")  # SAFE CHANGE: ensure newline
-            p.text("Rahmat! Kuningiz yaxshi o‘tsin!\n")
-
-            qr_data = json.dumps({
-                "name": f"{payment.patient.first_name} {payment.patient.last_name}",
-                "amount": str(payment.amount),
-                "payment_method": payment.payment_method,
-                "status": payment.status,
-                "doctor": doctor.get_full_name() if doctor else "-",
-                "note": payment.notes or "",
-                "date": payment.date.strftime('%Y-%m-%d %H:%M:%S')
-            }, ensure_ascii=False)
-
-            p.text("\n\n")
-            p.qr(qr_data, size=6)
-            p.text("\n\n\n")
-            p.cut()
-
-            return Response({"success": True}, status=200)
-        except Exception as e:
-            logger.exception(f"❌ USB printerda xatolik for payment_id={payment_id}: {str(e)}")
-            return Response({"error": str(e)}, status=500)
+        patient_name = f"{payment.patient.first_name} {payment.patient.last_name}"
+        date = payment.date.strftime('%Y-%m-%d %H:%M:%S')
+        qr_data = json.dumps({
+            "name": patient_name,
+            "amount": str(payment.amount),
+            "payment_method": payment.payment_method,
+            "status": payment.status,
+            "doctor": doctor.name if doctor else "-",
+            "note": payment.notes or "",
+            "date": date
+        }, ensure_ascii=False)
+
+        job = printing.enqueue("room_receipt", {
+            'receipt_number': f"TP-{payment.id}",
+            'date': date,
+            'patient_name': patient_name,
+            'transaction_type': 'Davolash',
+            'amount': float(payment.amount),
+            'payment_method': payment.payment_method or 'N/A',
+            'processed_by': payment.created_by.get_full_name() if payment.created_by else 'N/A',
+            'notes': payment.notes,
+            'qr': qr_data,
+        }, user=request.user)
+        return Response({"success": True, "print_job_id": job.id}, status=202)
+
+
+class PrintJobStatusView(RetrieveAPIView):
+    """Poll a queued print: ``status`` is queued, printing, done or failed."""
+    queryset = PrintJob.objects.all()
+    serializer_class = PrintJobSerializer
+    permission_classes = [IsAuthenticated]
 
 
 class TreatmentRoomStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        today = now().date()
-        current_month = today.month
-        current_year = today.year
+        today = timezone.localdate()
 
-        daily_total = TreatmentPayment.objects.filter(date__date=today).aggregate(
+        daily_total = filter_local_days(TreatmentPayment.objects, "date", today, today).aggregate(
             total=Sum("amount")
         )["total"] or 0
 
-        monthly_total = TreatmentPayment.objects.filter(
-            date__year=current_year, date__month=current_month
+        monthly_total = filter_local_days(
+            TreatmentPayment.objects, "date", today.replace(day=1), today
         ).aggregate(total=Sum("amount"))["total"] or 0
 
         total_all = TreatmentPayment.objects.aggregate(
@@ -1489,37 +1365,32 @@ class AccountantDashboardView(APIView):
         start_date = request.GET.get('start_date')
         end_date = request.GET.get('end_date')
 
-        cash_qs = CashRegister.objects.all()
-        outcome_qs = Outcome.objects.all()
-        treatment_qs = TreatmentPayment.objects.filter(status='paid')
-
+        rollup = DailyRevenue.objects.all()
         if start_date and end_date:
             start = parse_date(start_date)
             end = parse_date(end_date)
-            cash_qs = cash_qs.filter(created_at__date__range=(start, end))
-            outcome_qs = outcome_qs.filter(created_at__date__range=(start, end))
-            treatment_qs = treatment_qs.filter(date__date__range=(start, end))
-
-        room_income = treatment_qs.aggregate(total=Sum('amount'))['total'] or 0
+            rollup = rollup.filter(day__range=(start, end))
 
-        income_summary = {}
-        for item in cash_qs.values('payment_method').annotate(total=Sum('amount')):
-            method = item['payment_method']
-            income_summary[method] = income_summary.get(method, 0) + item['total']
+        # room income only counts fully paid TreatmentPayments
+        income = Q(kind='cash') | Q(kind='room_payment', transaction_type='paid')
 
-        for item in treatment_qs.values('payment_method').annotate(total=Sum('amount')):
-            method = item['payment_method']
-            income_summary[method] = income_summary.get(method, 0) + item['total']
-
-        income_summary_list = [{"payment_method": k, "total": v} for k, v in income_summary.items()]
-
-        cash_total = cash_qs.aggregate(total=Sum('amount'))['total'] or 0
+        totals = rollup.aggregate(
+            cash=Sum('amount', filter=Q(kind='cash')),
+            room=Sum('amount', filter=Q(kind='room_payment', transaction_type='paid')),
+            outcome=Sum('amount', filter=Q(kind='outcome')),
+        )
+        cash_total = totals['cash'] or 0
+        room_income = totals['room'] or 0
         total_income = cash_total + room_income
-        total_outcome = outcome_qs.aggregate(total=Sum('amount'))['total'] or 0
+        total_outcome = totals['outcome'] or 0
+
+        income_summary_list = [
+            {"payment_method": item['payment_method'], "total": item['total']}
+            for item in rollup.filter(income).values('payment_method').annotate(total=Sum('amount'))
+        ]
 
         doctor_income = (
-            cash_qs.filter(transaction_type='consultation')
-            .select_related('doctor__user')
+            rollup.filter(kind='cash', transaction_type='consultation')
             .values('doctor__id', 'doctor__user__first_name', 'doctor__user__last_name')
             .annotate(total=Sum('amount'))
         )
@@ -1536,18 +1407,10 @@ class AccountantDashboardView(APIView):
             for item in doctor_income
         ]
 
-        service_income = []
-        service_qs = cash_qs.filter(transaction_type='service')
-        for s in service_qs:
-            if s.notes and "Service Payment:" in s.notes:
-                names = s.notes.replace("Service Payment:", "").split(",")
-                for name in names:
-                    clean = name.strip()
-                    match = next((i for i in service_income if i["name"] == clean), None)
-                    if match:
-                        match["amount"] += s.amount
-                    else:
-                        service_income.append({"name": clean, "amount": s.amount})
+        service_income = [
+            {"name": item['label'], "amount": item['total']}
+            for item in rollup.filter(kind='cash_service').values('label').annotate(total=Sum('amount'))
+        ]
 
         return Response({
             "total_income": float(total_income),
@@ -1567,10 +1430,10 @@ class OutcomeListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        start = self.request.query_params.get('start_date')
-        end = self.request.query_params.get('end_date')
+        start = parse_date(self.request.query_params.get('start_date') or '')
+        end = parse_date(self.request.query_params.get('end_date') or '')
         if start and end:
-            qs = qs.filter(created_at__date__range=[start, end])
+            qs = filter_local_days(qs, 'created_at', start, end)
         return qs
 
 
@@ -1608,6 +1471,22 @@ def _guess_doctor_from_service(service):
     return None
 
 
+def with_repeat_count(qs):
+    """
+    Annotate lab registrations with ``repeats``: how many times the patient
+    has had the service, one subquery on the (patient, service) index
+    instead of a COUNT per row. Also joins what LabRegistrationSerializer
+    reads.
+    """
+    repeats = (
+        LabRegistration.objects.filter(patient=OuterRef('patient'), service=OuterRef('service'))
+        .values('patient').annotate(n=Count('pk')).values('n')
+    )
+    return qs.select_related(
+        'patient__patients_doctor__user', 'service', 'visit__appointment__doctor'
+    ).annotate(repeats=Subquery(repeats))
+
+
 class LabRegistrationListCreateAPIView(generics.ListCreateAPIView):
     """
     List + create lab registrations safely.
@@ -1689,7 +1568,7 @@ class LabRegistrationListCreateAPIView(generics.ListCreateAPIView):
         return None
 
     def get_queryset(self):
-        qs = self._LabReg.objects.select_related(*self._rel).order_by('-created_at')
+        qs = with_repeat_count(self._LabReg.objects.select_related(*self._rel)).order_by('-created_at')
         raw_patient = self.request.query_params.get('patient')
         pid = self._to_int_or_none(raw_patient)
         if pid is not None:
@@ -1731,15 +1610,12 @@ class LabRegistrationListCreateAPIView(generics.ListCreateAPIView):
         except Exception as e:
             return Response({"detail": f"Could not create registration: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # the serializer counts the repeats once
         ser = self.get_serializer(reg)
         data = dict(ser.data)
         data.update({
             "service_name": getattr(service, "name", None),
             "assigned_doctor_name": _doctor_name(doctor),
-            "repeat_count": (
-                self._LabReg.objects.filter(patient=patient, service=service).count()
-                if patient is not None else None
-            ),
         })
         headers = self.get_success_headers(ser.data)
         return Response(data, status=status.HTTP_201_CREATED, headers=headers)
@@ -1751,89 +1627,116 @@ class LabRegistrationDetailAPIView(RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class PublicDoctorServiceAPI(APIView):
+class PublicDoctorServiceAPI(ListAPIView):
+    """GET /api/v1/services/doctor/<doctor_id>/ — the doctor's lab worklist, newest first, in cursor pages."""
     permission_classes = []  # public
+    serializer_class = LabRegistrationSerializer
 
-    def get(self, request, doctor_id):
-        qs = LabRegistration.objects.filter(service__doctor_id=doctor_id).select_related('patient', 'service')
-        serializer = LabRegistrationSerializer(qs, many=True)
-        return Response(serializer.data)
+    def get_queryset(self):
+        qs = LabRegistration.objects.filter(service__doctor_id=self.kwargs['doctor_id'])
+        return with_repeat_count(qs).order_by('-created_at', '-id')
+
+
+def patient_archive_queryset():
+    """Patients with the relations and payment total PatientArchiveSerializer reads, newest first."""
+    payments_total = (
+        TreatmentPayment.objects.filter(patient=OuterRef("pk"))
+        .values("patient").annotate(total=Sum("amount")).values("total")
+    )
+    return (
+        Patient.objects.select_related('patients_doctor__user')
+        .prefetch_related(
+            Prefetch('appointment_set', queryset=Appointment.objects.select_related('doctor')),
+            'treatmentregistration_set__room',
+            'labregistration_set__service',
+        )
+        .annotate(payments_total=Subquery(payments_total))
+        .order_by('-created_at', '-id')
+    )
 
 
-class PatientArchiveView(APIView):
+class PatientArchiveView(ListAPIView):
+    """
+    Patients with their appointments, stays and lab work, in cursor pages.
+    The relations are prefetched per page, so a page costs the same handful
+    of queries however many patients it holds.
+    """
     permission_classes = [IsAuthenticated]
+    serializer_class = PatientArchiveSerializer
 
-    def get(self, request):
-        patients = Patient.objects.select_related('patients_doctor__user').prefetch_related(
-            'appointment_set', 'treatmentregistration_set__room', 'labregistration_set__service'
-        ).all().order_by('-created_at')
-        serializer = PatientArchiveSerializer(patients, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        return patient_archive_queryset()
 
 
-class RoomHistoryView(APIView):
+class PatientArchiveExportView(GenericAPIView):
+    """
+    GET /api/v1/patients/archive/export/ -> every patient, streamed as one JSON array
+
+    The archive page's full download. Patients are read in chunks of
+    ``stream_chunk_size`` with the relations prefetched per chunk, so the
+    server holds one chunk at a time and the queries grow with the number of
+    chunks, not patients.
+    """
     permission_classes = [IsAuthenticated]
+    serializer_class = PatientArchiveSerializer
+    stream_chunk_size = 500
 
     def get(self, request):
-        registrations = TreatmentRegistration.objects.select_related('room').all()
-        serializer = RoomHistorySerializer(registrations, many=True)
-        return Response(serializer.data)
+        return StreamingHttpResponse(self._stream(patient_archive_queryset()), content_type="application/json")
+
+    def _stream(self, queryset):
+        render = JSONRenderer().render
+        separator = b"["
+        for patient in queryset.iterator(chunk_size=self.stream_chunk_size):
+            yield separator + render(self.get_serializer(patient).data)
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+
+
+
+class RoomHistoryView(ListAPIView):
+    queryset = TreatmentRegistration.objects.select_related('room')
+    serializer_class = RoomHistorySerializer
+    permission_classes = [IsAuthenticated]
 
 
 from django.template.loader import render_to_string
 
-def _build_discharge_context(reg, request=None):
+
+# ➕ A4 DISCHARGE RECEIPT: one pipeline for the HTML view, the API and the discharge POST
+_DISCHARGE_REGISTRATIONS = TreatmentRegistration.objects.select_related(
+    "patient__patients_doctor", "room", "appointment__doctor__user"
+)
+
+
+def _build_discharge_context(reg):
     """
-    Compute all numbers needed for the A4 discharge receipt.
+    Compute all numbers needed for the A4 discharge receipt. Services are
+    summed in the database; each payment set is fetched once and summed in
+    memory.
     """
-    from decimal import Decimal
-    from django.utils import timezone
-    from django.db.models.functions import Coalesce
-    from django.db.models import Sum
-    from apps.models import Appointment, CashRegister, TreatmentPayment
-
     patient = reg.patient
     room = reg.room
     assigned_at = reg.assigned_at
     discharged_at = reg.discharged_at or timezone.now()
+    stay = (assigned_at, discharged_at)
 
     days = max((discharged_at.date() - assigned_at.date()).days + 1, 1)
 
     room_rate = (room.price_per_day or Decimal("0.00")) if room else Decimal("0.00")
     room_cost = room_rate * days
 
-    consultation_cost = Decimal("0.00")
-    try:
-        if patient.patients_doctor and patient.patients_doctor.consultation_price:
-            consultation_cost = patient.patients_doctor.consultation_price
-    except Exception:
-        pass
-
-    services_cost = Decimal("0.00")
-    try:
-        appts = Appointment.objects.filter(
-            patient=patient,
-            created_at__range=(assigned_at, discharged_at)
-        ).prefetch_related("services")
-        for a in appts:
-            for s in a.services.all():
-                services_cost += (s.price or Decimal("0.00"))
-    except Exception:
-        pass
+    doctor = patient.patients_doctor
+    consultation_cost = (doctor.consultation_price if doctor else None) or Decimal("0.00")
 
-    cash_payments = CashRegister.objects.filter(
-        patient=patient,
-        created_at__range=(assigned_at, discharged_at)
-    )
-    room_payments = TreatmentPayment.objects.filter(
-        patient=patient,
-        date__range=(assigned_at, discharged_at)
-    )
+    services_cost = Appointment.services.through.objects.filter(
+        appointment__patient=patient, appointment__created_at__range=stay
+    ).aggregate(t=Coalesce(Sum("service__price"), Decimal("0.00")))["t"]
 
-    paid_total = (
-        cash_payments.aggregate(t=Coalesce(Sum("amount"), Decimal("0.00")))["t"]
-        + room_payments.aggregate(t=Coalesce(Sum("amount"), Decimal("0.00")))["t"]
-    )
+    cash_payments = list(CashRegister.objects.filter(patient=patient, created_at__range=stay).order_by("created_at"))
+    room_payments = list(TreatmentPayment.objects.filter(patient=patient, date__range=stay).order_by("date"))
+    paid_total = sum((p.amount or Decimal("0.00") for p in cash_payments), Decimal("0.00")) \
+        + sum((p.amount or Decimal("0.00") for p in room_payments), Decimal("0.00"))
 
     due_total = room_cost + consultation_cost + services_cost
     balance = due_total - paid_total
@@ -1854,39 +1757,70 @@ def _build_discharge_context(reg, request=None):
         "due_total": due_total,
         "paid_total": paid_total,
         "balance": balance,
-        "cash_payments": list(cash_payments),
-        "room_payments": list(room_payments),
-        "request": request,
+        "cash_payments": cash_payments,
+        "room_payments": room_payments,
     }
 
 
+def _render_discharge(reg):
+    ctx = _build_discharge_context(reg)
+    ctx["staff_name"] = receipt_cache.STAFF_NAME
+    # an open stay is charged per (UTC) calendar day up to now
+    valid_until = None if reg.discharged_at else receipt_cache.next_tick(0, dt_timezone.utc)
+    return render_to_string("receipts/discharge.html", ctx), valid_until
+
+
+def _staff_name(request):
+    user = getattr(request, "user", None)
+    if not user:
+        return "—"
+    return user.get_full_name() if user.is_authenticated else ""
+
+
+def _discharge_receipt_html(request, pk):
+    html = receipt_cache.lookup("discharge", pk)
+    if html is None:
+        reg = get_object_or_404(_DISCHARGE_REGISTRATIONS, pk=pk)
+        html = receipt_cache.render("discharge", pk, reg.patient_id, lambda: _render_discharge(reg))
+    return receipt_cache.fill(html, staff_name=_staff_name(request))
+
+
+class DischargeReceiptHTMLView(View):
+    def get(self, request, pk):
+        return HttpResponse(_discharge_receipt_html(request, pk))
+
+
 class DischargeReceiptAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        reg = get_object_or_404(TreatmentRegistration, pk=pk)
-        ctx = _build_discharge_context(reg, request=request)
-        html = render_to_string("receipts/discharge.html", ctx)
-        return Response({"html": html}, status=200)
+        return Response({"html": _discharge_receipt_html(request, pk)}, status=200)
 
 
 class TreatmentDischargeView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
-        registration = get_object_or_404(TreatmentRegistration, pk=pk, discharged_at__isnull=True)
+        registration = get_object_or_404(_DISCHARGE_REGISTRATIONS, pk=pk, discharged_at__isnull=True)
         registration.discharged_at = now()
         registration.save()
 
-        receipt_api = reverse("discharge-receipt-api", args=[registration.pk])
+        # the receipt is opened right after discharge: render it once now,
+        # after the signals have outdated the patient's cached receipts
+        transaction.on_commit(lambda: receipt_cache.render(
+            "discharge", pk, registration.patient_id, lambda: _render_discharge(registration)
+        ))
         return Response(
-            {"detail": "✅ Patient discharged.", "receipt_api": receipt_api},
+            {
+                "detail": "✅ Patient discharged.",
+                "receipt_url": reverse("discharge-receipt", args=[pk]),
+                "receipt_api": reverse("discharge-receipt-api", args=[pk]),
+            },
             status=status.HTTP_200_OK
         )
 
 
 # === Patient balances & printable statement ===
-from django.template.response import TemplateResponse
 from django.utils.timezone import localtime
 from django.utils import timezone
 from datetime import timedelta
@@ -1899,7 +1833,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.urls import reverse
 
-UZT = ZoneInfo("Asia/Tashkent")
+from apps.billing import UZT, _count_9am_days, _BillingMath
 
 def _to_int(x):
     try:
@@ -1907,181 +1841,6 @@ def _to_int(x):
     except Exception:
         return 0
 
-def _count_9am_days(start_dt, end_dt):
-    """
-    Count “days” as 09:00→09:00 slots in Asia/Tashkent.
-
-    Rules:
-      - If start is at/after 09:00 local, you are already in Day 1.
-      - If start is before 09:00, Day 1 starts at that day’s 09:00 (only if end reaches it).
-      - Crossing a 09:00 boundary increments the day count, but EXACTLY at 09:00
-        still belongs to the previous day (boundary itself does NOT increment).
-    """
-    if not start_dt or not end_dt or end_dt <= start_dt:
-        return 0
-
-    s = timezone.localtime(start_dt, UZT)
-    e = timezone.localtime(end_dt, UZT)
-
-    # Determine the 09:00 slot that 's' belongs to: [slot_start, slot_end)
-    day_9 = s.replace(hour=9, minute=0, second=0, microsecond=0)
-    if s >= day_9:
-        slot_start = day_9                    # same day 09:00
-    else:
-        slot_start = day_9 - timedelta(days=1)  # previous day 09:00
-    slot_end = slot_start + timedelta(days=1)   # next 09:00
-
-    # If we never reach the first slot_end:
-    if e <= slot_end:
-        # Day 1 applies if we were already after today's 09:00, or
-        # we started before 09:00 and reached it.
-        return 1 if (s >= day_9 or e >= day_9) and e > s else 0
-
-    # We passed the first 09:00 boundary strictly → at least 2 days.
-    delta_after_first = e - slot_end
-    extra = delta_after_first.days
-    if delta_after_first.seconds or delta_after_first.microseconds:
-        extra += 1
-    return 1 + extra
-
-
-class _BillingMath:
-    """Compute per-patient expected & paid totals (receipt view).
-       Room (yotoqxona) uses 09:00→09:00 charging. If a new stay starts on the
-       same *calendar* day the previous stay ended, that first day is NOT double-charged.
-    """
-
-    @staticmethod
-    def compute_for_patient(p):
-        # --- find doctor for header/consultation price
-        doctor = getattr(p, "patients_doctor", None)
-        if not doctor:
-            try:
-                last_app = p.appointment_set.order_by("-created_at").first()
-            except Exception:
-                last_app = None
-            if last_app and getattr(last_app, "doctor", None):
-                doctor = last_app.doctor
-        if not doctor:
-            try:
-                for reg in p.treatmentregistration_set.all():
-                    if getattr(reg, "appointment", None) and getattr(reg.appointment, "doctor", None):
-                        doctor = reg.appointment.doctor
-                        break
-            except Exception:
-                pass
-
-        doctor_name = None
-        if doctor:
-            if getattr(doctor, "user", None):
-                full = (doctor.user.get_full_name() or "").strip()
-                doctor_name = full or getattr(doctor, "name", None) or None
-            else:
-                doctor_name = getattr(doctor, "name", None) or None
-
-        # consultation
-        consult_expected = float(doctor.consultation_price) if (doctor and doctor.consultation_price) else 0.0
-
-        # services
-        services_expected = 0.0
-        try:
-            lrs = getattr(p, "labregistration_set", None)
-            if lrs is not None and lrs.exists():
-                for lr in lrs.select_related("service"):
-                    status = (getattr(lr, "status", "") or "").lower()
-                    if status in ("cancelled", "canceled", "bekor", "bekor qilingan"):
-                        continue
-                    svc = getattr(lr, "service", None)
-                    services_expected += float(getattr(svc, "price", 0) or 0)
-            else:
-                seen = set()
-                for app in p.appointment_set.all():
-                    for s in app.services.all():
-                        if s.id in seen:
-                            continue
-                        seen.add(s.id)
-                        services_expected += float(s.price or 0)
-        except Exception:
-            services_expected = 0.0
-
-        # room (09:00 logic)
-        room_expected = 0.0
-        try:
-            regs = (
-                p.treatmentregistration_set
-                 .select_related("room")
-                 .order_by("assigned_at", "id")
-            )
-            prev_end_local_date = None
-
-            for reg in regs:
-                room = getattr(reg, "room", None)
-                if not room:
-                    continue
-
-                start = (
-                    getattr(reg, "assigned_at", None)
-                    or getattr(reg, "admitted_at", None)
-                    or getattr(reg, "start_date", None)
-                    or getattr(reg, "created_at", None)
-                )
-                end = getattr(reg, "discharged_at", None) or timezone.now()
-
-                ticks = _count_9am_days(start, end)
-
-                # If a new reg starts the same *calendar* day the previous ended, avoid double baseline.
-                if prev_end_local_date and timezone.localtime(start, UZT).date() == prev_end_local_date:
-                    ticks = max(ticks - 1, 0)
-
-                room_expected += ticks * float(getattr(room, "price_per_day", 0) or 0)
-                prev_end_local_date = timezone.localtime(end, UZT).date()
-        except Exception:
-            pass
-
-        expected_due = consult_expected + services_expected + room_expected
-
-        # paid (cash register)
-        paid_consult = 0.0
-        paid_service = 0.0
-        paid_other_cash = 0.0
-        try:
-            for cr in p.cashregister_set.all():
-                t = (cr.transaction_type or "").lower()
-                amt = float(cr.amount or 0)
-                if t == "consultation":
-                    paid_consult += amt
-                elif t == "service":
-                    paid_service += amt
-                else:
-                    paid_other_cash += amt
-        except Exception:
-            pass
-
-        # paid (room)
-        paid_room = 0.0
-        try:
-            qs = p.treatmentpayment_set.exclude(status__in=["unpaid", "canceled", "cancelled"])
-            for tp in qs:
-                paid_room += float(tp.amount or 0)
-        except Exception:
-            pass
-
-        paid_total = paid_consult + paid_service + paid_other_cash + paid_room
-
-        return {
-            "doctor_name": doctor_name,
-            "consult_expected": round(consult_expected),
-            "services_expected": round(services_expected),
-            "room_expected": round(room_expected),
-            "expected_due": round(expected_due),
-            "paid_consult": round(paid_consult),
-            "paid_service": round(paid_service),
-            "paid_other_cash": round(paid_other_cash),
-            "paid_room": round(paid_room),
-            "paid_total": round(paid_total),
-            "balance": round(expected_due - paid_total),
-        }
-
 
 class PatientBalancesAPIView(APIView):
     """List last N patients (default 200) with expected/paid/balance."""
@@ -2089,21 +1848,12 @@ class PatientBalancesAPIView(APIView):
 
     def get(self, request):
         limit = int(request.query_params.get("limit", 200))
-        patients = (
-            Patient.objects
-                .order_by('-created_at')[:limit]
-                .select_related('patients_doctor__user')
-                .prefetch_related(
-                    'appointment_set__services',
-                    'treatmentregistration_set__room',
-                    'cashregister_set',
-                    'treatmentpayment_set',
-                )
-        )
+        patients = list(Patient.objects.order_by('-created_at')[:limit])
+        billing = _BillingMath.compute_for_patients(patients)
 
         rows = []
         for p in patients:
-            math = _BillingMath.compute_for_patient(p)
+            math = billing[p.id]
             rows.append({
                 "id": p.id,
                 "name": f"{p.first_name} {p.last_name}".strip(),
@@ -2195,6 +1945,12 @@ class PatientBillingReceiptHTMLView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, patient_id):
+        html = receipt_cache.lookup("patient-billing", patient_id)
+        if html is None:
+            html = receipt_cache.render("patient-billing", patient_id, patient_id, lambda: self._render(patient_id))
+        return HttpResponse(receipt_cache.fill(html))
+
+    def _render(self, patient_id):
         p = get_object_or_404(
             Patient.objects
                 .select_related('patients_doctor__user')
@@ -2220,8 +1976,12 @@ class PatientBillingReceiptHTMLView(APIView):
             "balance": math["balance"],
             "cash_payments": p.cashregister_set.all().order_by('-created_at'),
             "room_payments": p.treatmentpayment_set.all().order_by('-date'),
+            "printed_at": receipt_cache.PRINTED_AT,
         }
-        return TemplateResponse(request, "receipts/patient_billing.html", ctx)
+        # an open stay is charged per 09:00 tick
+        open_stay = any(r.discharged_at is None for r in p.treatmentregistration_set.all())
+        valid_until = receipt_cache.next_tick(9, UZT) if open_stay else None
+        return render_to_string("receipts/patient_billing.html", ctx), valid_until
 
 
 # ------------------------ Compact balances API (new shape + legacy rows) ------------------------
@@ -2242,25 +2002,19 @@ class PatientBalancesDataView(APIView):
         except Exception:
             limit = 200
 
-        qs = (
-            Patient.objects
-            .select_related("patients_doctor", "patients_doctor__user")
-            .order_by("-id")
-        )
-        if q:
-            qs = qs.filter(
-                Q(first_name__icontains=q) |
-                Q(last_name__icontains=q) |
-                Q(phone__icontains=q)
-            )
-        qs = qs[:limit]
+        qs = Patient.objects.order_by("-id")
+        match = patient_search.matches(q)
+        if match is not None:
+            qs = qs.filter(match).annotate(search_rank=patient_search.rank(q)).order_by("-search_rank", "-id")
+        patients = list(qs[:limit])
+        billing = _BillingMath.compute_for_patients(patients)
 
         items = []
         total_billed = _Dec(0)
         total_paid = _Dec(0)
 
-        for p in qs:
-            m = _BillingMath.compute_for_patient(p)
+        for p in patients:
+            m = billing[p.id]
 
             billed  = _Dec(m.get("expected_due", 0) or 0)
             paid    = _Dec(m.get("paid_total", 0) or 0)
@@ -2319,65 +2073,98 @@ class PatientBalancesDataView(APIView):
 
 
 # ------------------------ Unpaid patients (balance > 0) ------------------------
+import base64
+
+
+def _encode_balance_cursor(balance, patient_id):
+    return base64.urlsafe_b64encode(f"{balance}:{patient_id}".encode()).decode()
+
+
+def _decode_balance_cursor(raw):
+    try:
+        balance, patient_id = base64.urlsafe_b64decode(raw.encode()).decode().split(":")
+        return int(balance), int(patient_id)
+    except Exception:
+        return None
+
+
 class UnpaidPatientsDataView(APIView):
+    """
+    GET /api/v1/unpaid-patients/data/?q=&doctor_id=&min_balance=&start_date=&end_date=&limit=&cursor=
+
+    Reads the PatientBalance ledger (see apps.signals), largest debt first.
+    Pages are keyset-paginated on (balance, patient_id): pass ``next_cursor``
+    back as ``cursor``; ``limit`` is capped at 1000. ``offset`` still works for
+    old pages but costs a scan. ``count`` is only computed without a cursor
+    (it is null on the following pages), so a keyset page never scans the
+    whole filtered ledger.
+    """
     permission_classes = [IsAuthenticated]
+    max_limit = 1000
 
     def get(self, request):
-        q_raw = (request.query_params.get("q") or "").strip()
-        q = q_raw.lower()
+        params = request.query_params
+        q_raw = (params.get("q") or "").strip()
 
         try:
-            limit = max(1, int(request.query_params.get("limit", 200)))
+            limit = max(1, int(params.get("limit", 200)))
         except Exception:
             limit = 200
+        limit = min(limit, self.max_limit)
         try:
-            offset = max(0, int(request.query_params.get("offset", 0)))
+            offset = max(0, int(params.get("offset", 0)))
         except Exception:
             offset = 0
-
-        patients = (
-            Patient.objects.order_by("-id")
-            .select_related("patients_doctor", "patients_doctor__user")
-            .prefetch_related(
-                "appointment_set__services",
-                "treatmentregistration_set__room",
-                "cashregister_set",
-                "treatmentpayment_set",
-                "labregistration_set__service",
-            )
-        )
-
-        if q:
-            patients = patients.filter(
-                Q(first_name__icontains=q_raw)
-                | Q(last_name__icontains=q_raw)
-                | Q(phone__icontains=q_raw)
-            )
-
-        results = []
-        for p in patients:
-            math = _BillingMath.compute_for_patient(p)
-
-            balance = int(math.get("balance") or 0)
-            if balance <= 0:
-                continue
-
+        try:
+            min_balance = max(1, int(params.get("min_balance", 1)))
+        except Exception:
+            min_balance = 1
+
+        ledger = PatientBalance.objects.filter(balance__gte=min_balance)
+
+        doctor_id = params.get("doctor_id") or params.get("doctor")
+        if doctor_id and str(doctor_id).isdigit():
+            ledger = ledger.filter(doctor_id=int(doctor_id))
+
+        start_date = parse_date(params.get("start_date") or "")
+        end_date = parse_date(params.get("end_date") or "")
+        ledger = filter_local_days(ledger, "patient__created_at", start_date, end_date)
+
+        match = patient_search.matches(q_raw, prefix="patient__")
+        if match is not None:
+            ledger = ledger.filter(match)
+
+        page_qs = ledger.select_related("patient").order_by("-balance", "-patient_id")
+        cursor = _decode_balance_cursor(params.get("cursor") or "")
+        total_count = None if cursor else ledger.count()
+        if cursor:
+            balance, patient_id = cursor
+            page_qs = page_qs.filter(Q(balance__lt=balance) | Q(balance=balance, patient_id__lt=patient_id))
+        elif offset:
+            page_qs = page_qs[offset:]
+        rows = list(page_qs[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_balance_cursor(rows[-1].balance, rows[-1].patient_id)
+
+        page = []
+        for row in rows:
+            p = row.patient
             name = (f"{getattr(p, 'first_name', '')} {getattr(p, 'last_name', '')}".strip()
                     or getattr(p, "full_name", "") or "—")
 
-            results.append({
+            page.append({
                 "id": p.id,
                 "name": name,
                 "phone": getattr(p, "phone", "") or "",
-                "doctor": (math.get("doctor_name") or "—"),
-                "expected_due": int(math.get("expected_due") or 0),
-                "paid_total":   int(math.get("paid_total")   or 0),
-                "balance":      balance,
+                "doctor": (row.doctor_name or "—"),
+                "expected_due": row.expected_due,
+                "paid_total":   row.paid_total,
+                "balance":      row.balance,
             })
 
-        total_count = len(results)
-        page = results[offset:offset + limit]
-
         role = getattr(request.user, "role", None)
         can_take_payment = (
             getattr(request.user, "is_superuser", False)
@@ -2389,6 +2176,7 @@ class UnpaidPatientsDataView(APIView):
             "count": total_count,
             "can_take_payment": bool(can_take_payment),
             "results": page,
+            "next_cursor": next_cursor,
         }, status=200)
 
 
@@ -3,7 +3,7 @@ document.addEventListener('DOMContentLoaded', async () => {
   const tableBody = document.getElementById('patient-table-body');
 
   try {
-    const response = await fetch('http://localhost:8000/api/v1/patients/', {
+    const response = await fetchAllPages('http://localhost:8000/api/v1/patients/?legacy=1', {
       headers: {
         'Authorization': `Bearer ${token}`
       }
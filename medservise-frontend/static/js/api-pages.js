@@ -0,0 +1,27 @@
+// Lists fetched with ?legacy=1 come back one page at a time as a bare JSON
+// array, with the next page's URL in the Link header (rel="next").
+// fetchAllPages() follows those links and answers with a single Response
+// holding every row, so a page can swap it in for fetch().
+function nextPageUrl(response) {
+  const link = response.headers.get("Link") || "";
+  const match = link.match(/<([^>]+)>;\s*rel="next"/);
+  return match ? match[1] : null;
+}
+
+async function fetchAllPages(url, options = {}, fetchPage = fetch) {
+  const first = await fetchPage(url, options);
+  let next = first.ok ? nextPageUrl(first) : null;
+  if (!next) return first;
+
+  const rows = await first.json();
+  while (next) {
+    const page = await fetchPage(next, options);
+    if (!page.ok) return page;
+    rows.push(...(await page.json()));
+    next = nextPageUrl(page);
+  }
+  return new Response(JSON.stringify(rows), {
+    status: 200,
+    headers: { "Content-Type": "application/json" },
+  });
+}
@@ -12,7 +12,8 @@ let allPatients = [];
 function fetchPatients() {
   patientListDiv.innerHTML = "<p>Yuklanmoqda...</p>";
 
-  fetch(`${API_BASE}/patients/archive/`, {
+  // the whole archive, streamed by the server as one JSON array
+  fetch(`${API_BASE}/patients/archive/export/`, {
     headers: {
       "Content-Type": "application/json",
       Authorization: `Bearer ${token}`,
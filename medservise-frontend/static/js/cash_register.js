@@ -163,7 +163,7 @@ class CashRegister {
     // ---------- Data loaders ----------
     async loadServices() {
         try {
-            const res = await this.authFetch(`${this.apiBase}/services/`);
+            const res = await fetchAllPages(`${this.apiBase}/services/?legacy=1`, {}, (url, opts) => this.authFetch(url, opts));
             if (!res.ok) throw new Error(`HTTP ${res.status}`);
             const services = await res.json();
 
@@ -69,7 +69,7 @@ document.addEventListener("DOMContentLoaded", () => {
 // ======================= LOAD ALL PATIENTS =======================
 async function loadAllPatients() {
   try {
-    const res = await authFetch("/api/v1/patients/");
+    const res = await fetchAllPages("/api/v1/patients/?legacy=1", {}, authFetch);
     if (!res.ok) throw new Error("Failed to fetch patients");
     const patients = await res.json();
 
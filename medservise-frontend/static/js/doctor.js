@@ -91,12 +91,25 @@ document.addEventListener("DOMContentLoaded", () => {
       });
   }
 
-  // 🔃 Auto-refresh every 5 seconds
-  setInterval(() => {
+  const refresh = () => {
     const selectedDate = dateFilter?.value || null;
     const nameQuery = searchName?.value || "";
     loadAppointments(selectedDate, nameQuery);
-  }, 5000);
+  };
+
+  // 🔃 Reload on live queue/call events (turn display channel); slow poll as a safety net
+  function listenTurnEvents(retry = 0) {
+    const wsBase = API.replace(/^http/, "ws").replace(/\/api\/v1\/?$/, "");
+    const ws = new WebSocket(`${wsBase}/ws/turn-display/`);
+    ws.onopen = () => { retry = 0; };
+    ws.onmessage = (e) => {
+      const msg = JSON.parse(e.data);
+      if (msg.event !== "snapshot") refresh();
+    };
+    ws.onclose = () => setTimeout(() => listenTurnEvents(retry + 1), Math.min(30000, 1000 * 2 ** retry));
+  }
+  listenTurnEvents();
+  setInterval(refresh, 60000);
 
   document.getElementById("filter-today-btn")?.addEventListener("click", () => {
     const today = new Date().toISOString().split("T")[0];
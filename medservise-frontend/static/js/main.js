@@ -184,7 +184,7 @@ function viewUploads(patientId) {
   const token = localStorage.getItem("token");
   const API_BASE = (window.API_BASE || location.origin.replace(/\/+$/, '')) + "/api/v1/";
 
-  fetch(API_BASE + `patient-results/?patient=${patientId}`, {
+  fetchAllPages(API_BASE + `patient-results/?patient=${patientId}&legacy=1`, {
     headers: {
       "Authorization": `Bearer ${token}`,
     },
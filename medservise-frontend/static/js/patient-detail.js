@@ -93,7 +93,7 @@ document.getElementById("upload-form").addEventListener("submit", e => {
 function loadResults() {
   resultsListDiv.innerHTML = "<p>⏳ Yuklanmoqda...</p>";
 
-  fetch(`${BASE_API_URL}patient-results/?patient=${patientId}`, {
+  fetchAllPages(`${BASE_API_URL}patient-results/?patient=${patientId}&legacy=1`, {
     headers: { Authorization: `Bearer ${token}` }
   })
     .then(res => {
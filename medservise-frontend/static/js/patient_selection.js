@@ -36,7 +36,7 @@ async function authFetch(url, options = {}) {
 async function loadPatients(dateRange = "today") {
   try {
     let url = `${BASE_API}patients/`;
-    const params = new URLSearchParams();
+    const params = new URLSearchParams({ legacy: "1" });
 
     if (dateRange !== "all") {
       const startDate = new Date();
@@ -59,23 +59,16 @@ async function loadPatients(dateRange = "today") {
 
 async function searchPatients(name, phone, dateRange) {
   try {
-    const params = new URLSearchParams();
-    if (name) params.append("name", name);
-    if (phone) params.append("phone", phone);
+    // ranked name/phone lookup across all patients (see /patients/search/)
+    const q = `${name || ""} ${phone || ""}`.trim();
+    if (!q) return loadPatients(dateRange);
 
-    if (dateRange !== "all") {
-      const startDate = new Date();
-      if (dateRange === "3days") startDate.setDate(startDate.getDate() - 3);
-      else if (dateRange === "7days") startDate.setDate(startDate.getDate() - 7);
-
-      params.append("start_date", startDate.toISOString().split("T")[0]);
-    }
-
-    const response = await authFetch(`${BASE_API}patients/?${params.toString()}`);
+    const params = new URLSearchParams({ q, limit: "50" });
+    const response = await authFetch(`${BASE_API}patients/search/?${params.toString()}`);
     if (!response.ok) throw new Error("Qidiruv bajarilmadi");
 
-    const patients = await response.json();
-    renderPatients(patients);
+    const data = await response.json();
+    renderPatients(data.results);
   } catch (error) {
     console.error("❌ Qidiruv xatoligi:", error);
     alert(`Xatolik: ${error.message}`);
@@ -28,7 +28,7 @@ document.addEventListener("DOMContentLoaded", () => {
 // DOCTORS
 // ===========================
 function fetchDoctors() {
-  fetch(`${BASE_URL}/doctor-list/`, { headers })
+  fetchAllPages(`${BASE_URL}/doctor-list/?legacy=1`, { headers })
     .then((res) => res.json())
     .then((doctors) => {
       const list = document.getElementById("doctor-price-list");
@@ -72,7 +72,7 @@ function confirmDoctorPriceChanges() {
 // SERVICES
 // ===========================
 function fetchServices() {
-  fetch(`${BASE_URL}/services/`, { headers })
+  fetchAllPages(`${BASE_URL}/services/?legacy=1`, { headers })
     .then((res) => res.json())
     .then((services) => {
       const list = document.getElementById("service-price-list");
@@ -116,7 +116,7 @@ function confirmServicePriceChanges() {
 // ROOMS
 // ===========================
 function fetchRooms() {
-  fetch(`${BASE_URL}/treatment-rooms/`, { headers })
+  fetchAllPages(`${BASE_URL}/treatment-rooms/?legacy=1`, { headers })
     .then((res) => res.json())
     .then((rooms) => {
       const list = document.getElementById("room-price-list");
@@ -19,7 +19,7 @@ document.addEventListener("DOMContentLoaded", () => {
   let allServices = [];
 
   // Load doctors
-  fetch(`${BASE_URL}doctor-list/`, { headers })
+  fetchAllPages(`${BASE_URL}doctor-list/?legacy=1`, { headers })
     .then(res => res.json())
     .then(doctors => {
       doctors.forEach(doc => {
@@ -33,7 +33,7 @@ document.addEventListener("DOMContentLoaded", () => {
     .catch(err => console.error("❌ Failed to fetch doctors:", err));
 
   // Load services
-  fetch(`${BASE_URL}services/`, { headers })
+  fetchAllPages(`${BASE_URL}services/?legacy=1`, { headers })
     .then(res => res.json())
     .then(data => {
       allServices = data;
@@ -6,7 +6,7 @@ document.addEventListener("DOMContentLoaded", () => {
     (window.API_BASE || location.origin.replace(/\/+$/, "")) + "/api/v1/";
 
   function loadRooms() {
-    fetch(`${BASE_API}treatment-rooms/`, {
+    fetchAllPages(`${BASE_API}treatment-rooms/?legacy=1`, {
       headers: {
         "Authorization": `Bearer ${token}`
       }
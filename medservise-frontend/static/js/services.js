@@ -16,7 +16,7 @@ document.addEventListener("DOMContentLoaded", () => {
   const doctorSelect = document.getElementById("doctor-select");
 
   function loadDoctors() {
-    fetch(`${BASE_URL}/doctor-list/`, {
+    fetchAllPages(`${BASE_URL}/doctor-list/?legacy=1`, {
       headers: { Authorization: `Bearer ${token}` }
     })
       .then(res => res.json())
@@ -46,7 +46,7 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   function loadServices() {
-    fetch(`${BASE_URL}/services/`, {
+    fetchAllPages(`${BASE_URL}/services/?legacy=1`, {
       headers: { Authorization: `Bearer ${token}` }
     })
       .then(res => res.json())
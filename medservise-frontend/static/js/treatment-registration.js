@@ -19,7 +19,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // Load doctors into select
   function loadDoctors() {
-    fetch(`${API}doctor-list/`, { headers })
+    fetchAllPages(`${API}doctor-list/?legacy=1`, { headers })
       .then(res => res.json())
       .then(doctors => {
         doctorSelect.innerHTML = '<option value="">Barcha shifokorlar</option>';
@@ -38,7 +38,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // Load patients filtered by date and doctor
   function loadPatients(doctorId = null) {
-    fetch(`${API}patients/`, { headers })
+    fetchAllPages(`${API}patients/?legacy=1`, { headers })
       .then(res => res.json())
       .then(patients => {
         const twoDaysAgo = new Date();
@@ -72,7 +72,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // Load treatment rooms and populate UI
   function loadRooms() {
-    fetch(`${API}treatment-rooms/`, { headers })
+    fetchAllPages(`${API}treatment-rooms/?legacy=1`, { headers })
       .then(res => res.json())
       .then(rooms => {
         roomSelect.innerHTML =
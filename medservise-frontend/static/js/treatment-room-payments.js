@@ -462,7 +462,11 @@
         }
 
         // Fallback legacy: /treatment-registrations/ (we have assigned_at here — compute days)
-        return j(API + '/treatment-registrations/?_=' + Date.now()).then(function (regs) {
+        var legacyOpts = { credentials: 'same-origin', cache: 'no-store', headers: hdr(false) };
+        return fetchAllPages(API + '/treatment-registrations/?legacy=1&_=' + Date.now(), legacyOpts).then(function (r) {
+          if (!r.ok) throw new Error('HTTP ' + r.status);
+          return r.json();
+        }).then(function (regs) {
           regs = Array.isArray(regs) ? regs : (regs && regs.results) || [];
           return regs.map(function (r) {
             var p = r.patient || {};
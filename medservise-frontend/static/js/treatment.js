@@ -64,7 +64,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   function loadRooms() {
     // 🔧 FIXED URL
-    fetch(`${BASE_URL}/treatment-rooms/`, {
+    fetchAllPages(`${BASE_URL}/treatment-rooms/?legacy=1`, {
       headers: { Authorization: `Bearer ${token}` }
     })
     .then(res => res.json())
@@ -32,12 +32,47 @@ function updateTurnDisplay(data) {
   });
 }
 
+const API_HOST = "89.39.95.150";
+
 function fetchTurn() {
-  fetch("http://89.39.95.150/api/v1/current-calls/")
+  fetch(`http://${API_HOST}/api/v1/current-calls/`)
     .then(res => res.json())
     .then(updateTurnDisplay)
     .catch(err => console.error("❌ Failed to fetch turn:", err));
 }
 
-fetchTurn();
-setInterval(fetchTurn, 5000);  // ✅ Fixed typo
+// Push updates: WebSocket first, Server-Sent Events if that fails, polling as a last resort.
+let pollTimer = null;
+
+function startPolling() {
+  if (pollTimer) return;
+  fetchTurn();
+  pollTimer = setInterval(fetchTurn, 5000);
+}
+
+function stopPolling() {
+  clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+function listenSSE() {
+  if (!window.EventSource) return startPolling();
+  const source = new EventSource(`http://${API_HOST}/api/v1/current-calls/stream/`);
+  const onEvent = e => { stopPolling(); updateTurnDisplay(JSON.parse(e.data).data); };
+  ["snapshot", "call", "clear", "queue"].forEach(name => source.addEventListener(name, onEvent));
+  source.onerror = () => startPolling();  // EventSource reconnects by itself
+}
+
+function listenWebSocket(retry = 0) {
+  const ws = new WebSocket(`ws://${API_HOST}/ws/turn-display/`);
+  let opened = false;
+  ws.onopen = () => { opened = true; retry = 0; stopPolling(); };
+  ws.onmessage = e => updateTurnDisplay(JSON.parse(e.data).data);
+  ws.onclose = () => {
+    if (!opened && retry >= 2) return listenSSE();
+    startPolling();
+    setTimeout(() => listenWebSocket(retry + 1), Math.min(30000, 1000 * 2 ** retry));
+  };
+}
+
+listenWebSocket();
@@ -21,6 +21,7 @@ BRAND_NAME = 'Controllab'
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # first: runserver serves the ASGI app (WebSockets, SSE)
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -33,11 +34,13 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'corsheaders',
     'django_celery_beat',
+    'channels',
 
 
 ]
 
 MIDDLEWARE = [
+    'apps.metrics.RequestMetricsMiddleware',  # first: times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +54,8 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'root.urls'
 AUTH_USER_MODEL = 'apps.User'
 CORS_ALLOW_ALL_ORIGINS = True
+# legacy list pages follow the next page from the Link header (apps.pagination)
+CORS_EXPOSE_HEADERS = ['Link']
 
 TEMPLATES = [
     {
@@ -70,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'root.wsgi.application'
+ASGI_APPLICATION = 'root.asgi.application'
 
 
 # Database
@@ -130,7 +136,20 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # cursor pages on every list endpoint; ?legacy=1 for pages expecting a bare
+    # array, which follow the Link header through static/js/api-pages.js
+    'DEFAULT_PAGINATION_CLASS': 'apps.pagination.CursorPagination',
 }
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+API_LEGACY_PAGE_SIZE = 1000
+
+# apps.metrics: sample queries slower than this, keep the last N requests over
+# the time or query-count threshold
+METRICS_SLOW_QUERY_MS = 100
+METRICS_SLOW_REQUEST_MS = 1000
+METRICS_MANY_QUERIES = 50
+METRICS_WORST_REQUESTS = 50
 
 
 SPECTACULAR_SETTINGS = {
@@ -144,6 +163,16 @@ SPECTACULAR_SETTINGS = {
 
 
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
+# USB/Win32 printers are reachable from one machine only: see apps.printing
+CELERY_TASK_ROUTES = {'apps.tasks.run_print_job': {'queue': 'printing'}}
+
+# Live turn display (apps.turn_display); root.test_settings keeps events in process.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': ['redis://127.0.0.1:6379/1']},
+    },
+}
  
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -153,6 +182,18 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'sulaymonovabdulaziz1@gmail.com'
 EMAIL_HOST_PASSWORD = 'mmch srjl ihwd sgli'
 
+# apps.printing: ESC/POS printers by role; backend "usb", "win32" or "fake" (root.test_settings)
+PRINTERS = {
+    'receipt': {'backend': 'usb', 'vendor_id': 0x0483, 'product_id': 0x070b},
+    'turn': {'backend': 'win32', 'name': 'ReceiptPrinter'},
+}
+# apps.receipts: let the printer draw QR codes (GS ( k) instead of sending a raster image
+RECEIPT_NATIVE_QR = False
+
+# apps.archive: where monthly patient archives are written and who gets them
+PATIENT_ARCHIVE_DIR = join(BASE_DIR / 'archives')
+PATIENT_ARCHIVE_RECIPIENTS = [EMAIL_HOST_USER]
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -179,6 +220,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.tasks.apply_daily_room_charges',
         'schedule': crontab(minute='*'),  # 🔁 Every minute
     },
+    'sweep-turn-queue': {
+        'task': 'apps.tasks.sweep_turn_queue',
+        'schedule': crontab(hour=0, minute=1),  # right after the queue day rolls over
+    },
+    'requeue-print-jobs': {
+        'task': 'apps.tasks.requeue_print_jobs',
+        'schedule': crontab(minute='*'),
+    },
+    'refresh-open-stay-balances': {
+        'task': 'apps.tasks.refresh_open_stay_balances',
+        'schedule': crontab(hour=9, minute=5),  # just after the 09:00 room-charge tick
+    },
 }
 
 TEMPLATES[0]['DIRS'] = [
@@ -0,0 +1,11 @@
+"""
+Settings for the test suite: ``python manage.py test --settings=root.test_settings``
+(or ``make test``). Live turn display events stay in process and printers
+are the in-memory fake backend (apps.printing), so no Redis channel layer
+or printer has to be reachable.
+"""
+from root.settings import *  # noqa: F401,F403
+
+CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+PRINTERS = {name: {'backend': 'fake'} for name in PRINTERS}  # noqa: F405